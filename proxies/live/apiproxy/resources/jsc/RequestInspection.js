@@ -0,0 +1,35 @@
+// Inspects the request in a single pass, in place of a JavaScript policy per flag or header: flags the
+// headers that clients may not provide, decides whether strict authorised targets apply, and sets the
+// request URL and client RP details that the rest of the flow passes on to the target.
+
+// Convert to string and split by comma
+var requestHeaders = (context.getVariable("request.headers.names") + '').slice(1, -1).split(', ');
+
+var authorisedTargetsAlreadyInHeader = false;
+var requestUrlAlreadyInHeader = false;
+for (var i = 0; i < requestHeaders.length; i++) {
+    var header = requestHeaders[i].toLowerCase();
+    if (header === "authorised_targets") {
+        authorisedTargetsAlreadyInHeader = true;
+    } else if (header === "x-request-url") {
+        requestUrlAlreadyInHeader = true;
+    }
+}
+context.setVariable('apigee.AUTHORISED_TARGETS_ALREADY_IN_HEADER', authorisedTargetsAlreadyInHeader);
+context.setVariable('apigee.REQUEST_URL_ALREADY_IN_HEADER', requestUrlAlreadyInHeader);
+
+var inProdEnvironment = context.getVariable('environment.name') === "prod";
+var useStrictAuthorisedTargets = context.getVariable('app.use_strict_authorised_targets') == "true";
+context.setVariable('apigee.USE_STRICT_AUTHORISED_TARGETS', useStrictAuthorisedTargets || inProdEnvironment);
+
+var req_scheme = context.getVariable('client.scheme');
+var req_host = context.getVariable('request.header.host');
+var req_request_uri = context.getVariable('request.uri');
+context.setVariable('apigee.X_REQUEST_URL', req_scheme + "://" + req_host + req_request_uri);
+
+context.targetRequest.headers['NHSD-Client-RP-Details'] = {
+    "developer.app.name": context.getVariable('developer.app.name'),
+    "developer.app.id": context.getVariable('developer.app.id'),
+    "developer.app.nhs-login-minimum-proofing-level": context.getVariable('nhs-login-allowed-proofing-level'),
+    "client.ip": context.getVariable('client.ip')
+};
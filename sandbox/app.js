@@ -1,16 +1,29 @@
 'use strict';
 
+const cluster = require('cluster');
 const express = require('express');
 const cors = require('cors');
 const app = express();
 const log = require('loglevel');
 const uuid = require('uuid');
+const { responseCache } = require('./immunization-handler/response-cache');
+const { setCompressionThreshold } = require('./immunization-handler/compression');
+const { setExportDirectory } = require('./immunization-handler/bulk-export');
+const { logWriter, setSampleRate, isEnabled, isRequestLogged } = require('./logging');
 
 function setup(options) {
   options = options || {};
   app.locals.app_name = options.APP_NAME || 'immunisation-history';
   app.locals.version_info = JSON.parse(options.VERSION_INFO || '{}');
   log.setLevel(options.LOG_LEVEL || 'info');
+  setSampleRate(options.LOG_SAMPLE_RATE || 1);
+  if (options.RESPONSE_CACHE_SIZE) {
+    responseCache.resize(Number(options.RESPONSE_CACHE_SIZE));
+  }
+  if (options.COMPRESSION_THRESHOLD !== undefined) {
+    setCompressionThreshold(options.COMPRESSION_THRESHOLD);
+  }
+  setExportDirectory(options.EXPORT_DIR);
 
   log.info(
     JSON.stringify({
@@ -26,16 +39,20 @@ function setup(options) {
 function start(options) {
   options = options || {};
   let server = app.listen(options.PORT || 9000, () => {
-    log.info(
-      JSON.stringify({
-        timestamp: Date.now(),
-        level: 'info',
-        app: app.locals.app_name,
-        msg: 'startup',
-        server_port: server.address().port,
-        version: app.locals.version_info
-      })
-    );
+    const startup = {
+      timestamp: Date.now(),
+      level: 'info',
+      app: app.locals.app_name,
+      msg: 'startup',
+      server_port: server.address().port,
+      version: app.locals.version_info
+    };
+    if (cluster.isWorker) {
+      // The primary logs one startup line for all of its workers
+      process.send(startup);
+    } else {
+      log.info(JSON.stringify(startup));
+    }
   });
   return server;
 }
@@ -50,13 +67,17 @@ function before_request(req, res, next) {
   next();
 }
 
-const _health_endpoints = ['/_ping', '/health'];
+const _health_endpoints = ['/_ping', '/health', '/_metrics'];
 
 function after_request(req, res, next) {
   if (_health_endpoints.includes(req.path) && !('log' in Object.assign({}, req.query))) {
     // don't log ping / health by default
     return next();
   }
+  // Unsuccessful requests are always logged, successful ones only if sampled
+  if (!isEnabled('info') || (res.statusCode < 400 && !isRequestLogged(res, 'info'))) {
+    return next();
+  }
   let finished_at = Date.now();
   let log_entry = {
     timestamp: finished_at,
@@ -85,7 +106,7 @@ function after_request(req, res, next) {
     log_entry.req.headers = req.rawHeaders;
     log_entry.res.headers = res.rawHeaders;
   }
-  log.info(JSON.stringify(log_entry));
+  logWriter.write(log_entry);
 
   next();
 }
@@ -100,8 +121,8 @@ function on_error(err, req, res, next) {
     };
   }
   let finished_at = Date.now();
-  log.error(
-    JSON.stringify({
+  if (isEnabled('error')) {
+    logWriter.write({
       timestamp: finished_at,
       level: 'error',
       app: app.locals.app_name,
@@ -112,8 +133,8 @@ function on_error(err, req, res, next) {
       duration: finished_at - res.locals.started_at,
       err: log_err,
       version: app.locals.version_info
-    })
-  );
+    });
+  }
   if (res.headersSent) {
     next();
     return;
@@ -144,8 +165,25 @@ app.use(before_request);
 app.get('/_ping', handlers.status);
 app.get('/_status', handlers.status);
 app.get('/health', handlers.status);
+app.get('/_metrics', handlers.metrics);
 app.all('/hello', handlers.hello);
 app.all('/FHIR/R4/Immunization', handlers.immunization);
+app.post(
+  '/FHIR/R4',
+  express.json({ type: ['application/json', 'application/fhir+json'] }),
+  handlers.batch,
+  handlers.invalidBatchBody
+);
+// Bulk Data's paths have a $ in them, so they're matched with regular expressions
+const EXPORT_ID = '([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})';
+const EXPORT_STATUS = new RegExp(`^/FHIR/R4/\\$export-status/${EXPORT_ID}/?$`);
+const EXPORT_FILE = new RegExp(
+  `^/FHIR/R4/\\$export-files/${EXPORT_ID}/([A-Za-z]+(?:\\.[A-Z0-9]+)?\\.ndjson)$`
+);
+app.get(/^\/FHIR\/R4\/\$export\/?$/, handlers.exportKickOff);
+app.get(EXPORT_STATUS, handlers.exportStatus);
+app.delete(EXPORT_STATUS, handlers.exportDelete);
+app.get(EXPORT_FILE, handlers.exportFile);
 app.use(on_error);
 app.use(after_request);
 
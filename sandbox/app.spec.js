@@ -1,6 +1,13 @@
 
 const request = require("supertest");
 const assert = require("chai").assert;
+const childProcess = require("child_process");
+const fs = require("fs");
+const http = require("http");
+const os = require("os");
+const path = require("path");
+const uuid = require("uuid");
+const zlib = require("zlib");
 // const expect = require("chai").expect;
 
 
@@ -64,5 +71,314 @@ describe("app handler tests", function () {
             .get("/hello")
             .expect(200, done);
     });
-});
 
+    describe("immunization response cache", function () {
+        const path = "/FHIR/R4/Immunization?patient.identifier=https://fhir.nhs.uk/Id/nhs-number|9000000009"
+            + "&immunization.target=HPV&date.from=2020-12-24";
+
+        it("serves repeated queries from the cache", async () => {
+            const first = await request(server).get(path).expect(200);
+            const before = (await request(server).get("/_metrics")).body.responseCache;
+            const second = await request(server).get(path).expect(200);
+            const after = (await request(server).get("/_metrics")).body.responseCache;
+
+            assert.deepEqual(second.body, first.body);
+            assert.equal(second.headers.etag, first.headers.etag);
+            assert.equal(after.hits, before.hits + 1);
+            assert.equal(after.misses, before.misses);
+        });
+
+        it("responds 304 when If-None-Match has the current ETag", async () => {
+            const { headers } = await request(server).get(path).expect(200);
+
+            await request(server).get(path).set("If-None-Match", headers.etag).expect(304);
+            await request(server).get(path).set("If-None-Match", "\"stale\"").expect(200);
+        });
+
+        it("keeps responses for different versions apart", async () => {
+            const v1 = await request(server).get(path).set("Accept", "application/fhir+json;version=1");
+            const v2 = await request(server).get(path).set("Accept", "application/fhir+json;version=2");
+
+            assert.equal(v1.headers.version, "1.0");
+            assert.equal(v2.headers.version, "2.0");
+        });
+    });
+
+    describe("immunization response compression", function () {
+        const path = "/FHIR/R4/Immunization?patient.identifier=https://fhir.nhs.uk/Id/nhs-number|9000000009"
+            + "&immunization.target=HPV";
+        // supertest decompresses gzip, so the bodies as they were sent are read with http
+        const get = (path, headers) => new Promise((resolve, reject) => {
+            http.get({ port: server.address().port, path: path, headers: headers }, res => {
+                const chunks = [];
+                res.on("data", chunk => chunks.push(chunk));
+                res.on("end", () => resolve({ status: res.statusCode, headers: res.headers, body: Buffer.concat(chunks) }));
+            }).on("error", reject);
+        });
+
+        it("compresses with the encoding that the client prefers", async () => {
+            const plain = await get(path, { "Accept-Encoding": "identity" });
+            const br = await get(path, { "Accept-Encoding": "gzip, br" });
+            const gzip = await get(path, { "Accept-Encoding": "gzip, br;q=0.5" });
+
+            assert.notProperty(plain.headers, "content-encoding");
+            assert.equal(br.headers["content-encoding"], "br");
+            assert.equal(gzip.headers["content-encoding"], "gzip");
+            assert.isBelow(br.body.length, plain.body.length);
+            assert.deepEqual(zlib.brotliDecompressSync(br.body), plain.body);
+            assert.deepEqual(zlib.gunzipSync(gzip.body), plain.body);
+            [plain, br, gzip].forEach(res => assert.match(res.headers.vary, /Accept-Encoding/));
+        });
+
+        it("gives each encoding an ETag of its own", async () => {
+            const plain = await get(path, { "Accept-Encoding": "identity" });
+            const gzip = await get(path, { "Accept-Encoding": "gzip" });
+
+            assert.notEqual(gzip.headers.etag, plain.headers.etag);
+            assert.equal((await get(path, { "Accept-Encoding": "gzip", "If-None-Match": gzip.headers.etag })).status, 304);
+            assert.equal((await get(path, { "Accept-Encoding": "gzip", "If-None-Match": plain.headers.etag })).status, 200);
+        });
+
+        it("doesn't compress small responses", async () => {
+            const res = await get("/FHIR/R4/Immunization?patient.identifier=https://fhir.nhs.uk/Id/nhs-number|9000000009",
+                { "Accept-Encoding": "gzip, br" });
+
+            assert.equal(res.status, 400);
+            assert.notProperty(res.headers, "content-encoding");
+        });
+    });
+
+    describe("immunization paging", function () {
+        const path = "/FHIR/R4/Immunization?patient.identifier=https://fhir.nhs.uk/Id/nhs-number|9000000009"
+            + "&immunization.target=HPV";
+        const v2 = "application/fhir+json;version=2";
+        const links = bundle => bundle.link.reduce((urls, link) => ({ ...urls, [link.relation]: link.url }), {});
+        const relative = url => new URL(url).pathname + new URL(url).search;
+        const ids = bundle => bundle.entry.map(entry => entry.fullUrl);
+
+        it("pages through the immunizations by following next links", async () => {
+            const all = (await request(server).get(path).set("Accept", v2).expect(200)).body;
+            const paged = [];
+            let next = `${path}&_count=2`;
+            while (next) {
+                const page = (await request(server).get(next).set("Accept", v2).expect(200)).body;
+                assert.equal(page.total, all.total);
+                assert.isAtMost(page.entry.length, 3);
+                paged.push(...ids(page).slice(0, -1));
+                next = links(page).next && relative(links(page).next);
+            }
+            assert.deepEqual(paged, ids(all).slice(0, -1));
+        });
+
+        it("links back to the previous page", async () => {
+            const first = (await request(server).get(`${path}&_count=1`).set("Accept", v2).expect(200)).body;
+            assert.notProperty(links(first), "previous");
+
+            const second = (await request(server).get(relative(links(first).next)).set("Accept", v2)).body;
+            const previous = (await request(server).get(relative(links(second).previous)).set("Accept", v2)).body;
+            assert.deepEqual(ids(previous), ids(first));
+        });
+
+        it("uses the URL that the proxy was sent for links", async () => {
+            const url = "https://sandbox.api.service.nhs.uk/immunisation-history" + path + "&_count=1";
+            const page = (await request(server).get(`${path}&_count=1`).set("Accept", v2).set("X-Request-Url", url)).body;
+            assert.equal(links(page).self, url);
+            assert.match(links(page).next, /^https:\/\/sandbox\.api\.service\.nhs\.uk\/immunisation-history\//);
+        });
+
+        it("rejects invalid _count and _cursor values", async () => {
+            await request(server).get(`${path}&_count=0`).set("Accept", v2).expect(400);
+            await request(server).get(`${path}&_count=1001`).set("Accept", v2).expect(400);
+            await request(server).get(`${path}&_cursor=MQ`).set("Accept", v2).expect(400);
+            await request(server).get(`${path}&_count=1&_cursor=not-a-cursor`).set("Accept", v2).expect(400);
+        });
+    });
+
+    describe("immunization batch", function () {
+        const patient = "patient.identifier=https://fhir.nhs.uk/Id/nhs-number|";
+        const search = query => ({ request: { method: "GET", url: `Immunization?${query}` } });
+        const batch = (...entry) => ({ resourceType: "Bundle", type: "batch", entry: entry });
+        const post = body => request(server).post("/FHIR/R4").set("Content-Type", "application/fhir+json").send(body);
+
+        it("answers each search in an entry of a batch-response", async () => {
+            const res = await post(batch(
+                search(`${patient}9000000009&immunization.target=HPV`),
+                search(`${patient}9000000033&immunization.target=HPV`)
+            )).expect(200);
+            const single = await request(server).get(`/FHIR/R4/Immunization?${patient}9000000009&immunization.target=HPV`)
+                .set("Accept-Encoding", "identity");
+
+            assert.equal(res.body.type, "batch-response");
+            assert.equal(res.body.entry.length, 2);
+            assert.deepEqual(res.body.entry[0].resource, single.body);
+            assert.deepEqual(res.body.entry[0].response, { status: "200 OK", etag: single.headers.etag });
+            assert.equal(res.body.entry[1].resource.total, 0);
+        });
+
+        it("answers invalid searches in their own entries", async () => {
+            const res = await post(batch(
+                search(`${patient}9000000009&immunization.target=HPV`),
+                search("immunization.target=HPV"),
+                search(`${patient}9000000009&immunization.target=MMR`)
+            )).expect(200);
+
+            assert.deepEqual(res.body.entry.map(entry => entry.response.status), ["200 OK", "400 Bad Request", "400 Bad Request"]);
+            assert.equal(res.body.entry[1].response.outcome.resourceType, "OperationOutcome");
+            assert.notProperty(res.body.entry[1], "resource");
+        });
+
+        it("forbids searches for targets that the app isn't authorised for", async () => {
+            const res = await post(batch(
+                search(`${patient}9000000009&immunization.target=HPV`),
+                search(`${patient}9000000009&procedure-code:below=90640007`)
+            )).set("AUTHORISED_TARGETS", "HPV").expect(200);
+
+            assert.deepEqual(res.body.entry.map(entry => entry.response.status), ["200 OK", "403 Forbidden"]);
+        });
+
+        it("rejects bodies that aren't batches of Immunization searches", async () => {
+            await post({ resourceType: "Bundle", type: "transaction", entry: [search(`${patient}9000000009`)] }).expect(400);
+            await post(batch()).expect(400);
+            await post(batch({ request: { method: "DELETE", url: "Immunization/1" } })).expect(400);
+            await post(batch(...Array(101).fill(search(`${patient}9000000009&immunization.target=HPV`)))).expect(400);
+            await post("{not json").expect(400);
+        });
+    });
+
+    describe("bulk export", function () {
+        const relative = url => new URL(url).pathname;
+
+        const exported = async (path) => {
+            const kickOff = await request(server).get(path).set("Prefer", "respond-async").expect(202);
+            const status = relative(kickOff.headers["content-location"]);
+            let res = await request(server).get(status);
+            while (res.status === 202) {
+                await new Promise(resolve => setTimeout(resolve, 10));
+                res = await request(server).get(status);
+            }
+            assert.equal(res.status, 200);
+            return { status: status, manifest: res.body };
+        };
+
+        it("exports the cohort as NDJSON files listed in the manifest", async () => {
+            const { manifest } = await exported("/FHIR/R4/$export");
+
+            assert.deepEqual(manifest.output.map(output => output.type), ["Patient", "Immunization", "Immunization", "Immunization"]);
+            for (const output of manifest.output) {
+                const res = await request(server).get(relative(output.url)).buffer(true).parse((res, callback) => {
+                    let text = "";
+                    res.on("data", chunk => text += chunk);
+                    res.on("end", () => callback(null, text));
+                }).expect(200);
+                const resources = res.body.trim().split("\n").map(line => JSON.parse(line));
+                assert.equal(res.headers["content-type"], "application/fhir+ndjson");
+                assert.equal(resources.length, output.count);
+                resources.forEach(resource => assert.equal(resource.resourceType, output.type));
+            }
+        });
+
+        it("only exports the targets asked for and authorised", async () => {
+            const { manifest } = await exported("/FHIR/R4/$export?_type=Immunization&immunization.target=HPV");
+            assert.deepEqual(manifest.output.map(output => output.url.split("/").pop()), ["Immunization.HPV.ndjson"]);
+
+            await request(server).get("/FHIR/R4/$export?immunization.target=FLU")
+                .set("Prefer", "respond-async").set("AUTHORISED_TARGETS", "COVID19,HPV").expect(403);
+        });
+
+        it("deletes exports", async () => {
+            const { status, manifest } = await exported("/FHIR/R4/$export");
+
+            await request(server).delete(status).expect(202);
+            await request(server).get(status).expect(404);
+            await request(server).get(relative(manifest.output[0].url)).expect(404);
+        });
+
+        it("reports exports whose worker stopped, or that ran past their deadline, as failed", async () => {
+            const abandoned = owner => {
+                const id = uuid.v4();
+                const directory = path.join(os.tmpdir(), "immunisation-history-exports", id);
+                fs.mkdirSync(directory, { recursive: true });
+                fs.writeFileSync(path.join(directory, "owner.json"), JSON.stringify(owner));
+                return `/FHIR/R4/$export-status/${id}`;
+            };
+            const stoppedPid = childProcess.spawnSync(process.execPath, ["-e", ""]).pid;
+            const statuses = [
+                abandoned({ pid: stoppedPid, host: os.hostname(), startedAt: Date.now() }),
+                abandoned({ pid: process.pid, host: "another-host", startedAt: Date.now() - 24 * 60 * 60 * 1000 })
+            ];
+
+            for (const status of statuses) {
+                const res = await request(server).get(status).expect(500);
+                assert.equal(res.body.resourceType, "OperationOutcome");
+                await request(server).delete(status).expect(202);
+            }
+        });
+
+        it("rejects kick-offs that aren't asynchronous or ask for something else", async () => {
+            await request(server).get("/FHIR/R4/$export").expect(400);
+            await request(server).get("/FHIR/R4/$export?_type=Observation").set("Prefer", "respond-async").expect(400);
+            await request(server).get("/FHIR/R4/$export?_outputFormat=text/csv").set("Prefer", "respond-async").expect(400);
+        });
+    });
+
+    describe("immunization multi-target search", function () {
+        const path = "/FHIR/R4/Immunization?patient.identifier=https://fhir.nhs.uk/Id/nhs-number|9000000009";
+        const v2 = "application/fhir+json;version=2";
+        const search = async (targets, headers) =>
+            (await request(server).get(`${path}&immunization.target=${targets}`).set("Accept", v2).set(headers || {}).expect(200)).body;
+        const matches = bundle => bundle.entry.filter(entry => entry.search.mode === "match").map(entry => entry.fullUrl);
+
+        it("returns the immunizations for every target in one bundle, with the patient once", async () => {
+            const merged = await search("COVID19,FLU,HPV");
+            const separately = [].concat(...await Promise.all(["COVID19", "FLU", "HPV"].map(async target => matches(await search(target)))));
+
+            assert.sameMembers(matches(merged), separately);
+            assert.equal(merged.total, separately.length);
+            assert.equal(merged.entry.filter(entry => entry.search.mode === "include").length, 1);
+        });
+
+        it("leaves out the targets that the app isn't authorised for", async () => {
+            const merged = await search("COVID19,FLU,HPV", { "AUTHORISED_TARGETS": "FLU,HPV" });
+            const authorised = await search("FLU,HPV");
+
+            assert.deepEqual(matches(merged), matches(authorised));
+            await request(server).get(`${path}&immunization.target=COVID19`).set("Accept", v2)
+                .set("AUTHORISED_TARGETS", "FLU,HPV").expect(403);
+        });
+
+        it("rejects unknown targets in the list", async () => {
+            await request(server).get(`${path}&immunization.target=COVID19,MMR`).set("Accept", v2).expect(400);
+        });
+    });
+
+    describe("immunization incremental sync", function () {
+        const path = "/FHIR/R4/Immunization?patient.identifier=https://fhir.nhs.uk/Id/nhs-number|9000000009"
+            + "&immunization.target=COVID19";
+        const v2 = "application/fhir+json;version=2";
+        const search = async query => (await request(server).get(path + query).set("Accept", v2).expect(200)).body;
+        const matches = bundle => bundle.entry.filter(entry => entry.search.mode === "match").map(entry => entry.fullUrl);
+
+        it("returns only the immunizations recorded since the last sync", async () => {
+            const all = await search("");
+            const since = await search("&_lastUpdated=gt2020-12-10");
+
+            assert.equal(since.total, 1);
+            assert.deepEqual(matches(since), matches(all).slice(1));
+            assert.equal(since.entry[since.entry.length - 1].search.mode, "include");
+        });
+
+        it("returns the immunizations recorded between two _lastUpdated values", async () => {
+            const all = await search("");
+            const between = await search("&_lastUpdated=ge2020-12-10&_lastUpdated=lt2020-12-31T00:00:00Z");
+
+            assert.deepEqual(matches(between), matches(all).slice(0, 1));
+            assert.equal((await search("&_lastUpdated=gt2021-01-01")).total, 0);
+        });
+
+        it("rejects invalid _lastUpdated values", async () => {
+            await request(server).get(`${path}&_lastUpdated=2020-13-01`).set("Accept", v2).expect(400);
+            await request(server).get(`${path}&_lastUpdated=ne2020-12-10`).set("Accept", v2).expect(400);
+            await request(server).get(`${path}&_lastUpdated=gt2020-12-10T10:00:00`).set("Accept", v2).expect(400);
+        });
+    });
+});
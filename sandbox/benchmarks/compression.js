@@ -0,0 +1,78 @@
+// Measures bytes on the wire against CPU time for the sandbox's Immunization Bundles, uncompressed
+// and compressed with gzip and brotli at a few levels. The sandbox compresses a cached response once
+// per encoding, the first time it's asked for, so the last line is the cost of every later request.
+//
+// Usage: node benchmarks/compression.js [iterations]
+
+const zlib = require('zlib');
+const moment = require('moment');
+const fhirResponses = '../immunization-handler/v2/fhir-responses';
+const { hpvImmunizationFhir } = require(`${fhirResponses}/hpv-immunization.fhir`);
+const { covidImmunizationFhir } = require(`${fhirResponses}/covid-immunization.fhir`);
+const { serialise } = require('../immunization-handler/response-cache');
+const { ENCODERS, negotiateEncoding, encode } = require('../immunization-handler/compression');
+
+const START = moment('0001-01-01');
+const END = moment('9999-12-31');
+
+// A long history: the HPV fixtures over and over, each with an id of its own
+function longHistory(immunizations) {
+  const fixture = hpvImmunizationFhir(START, END);
+  const matches = fixture.entry.filter(entry => entry.search.mode === 'match');
+  const entry = Array.from({ length: immunizations }, (_, i) => {
+    const copy = JSON.parse(JSON.stringify(matches[i % matches.length]));
+    copy.fullUrl = `urn:uuid:00000000-0000-4000-8000-${String(i).padStart(12, '0')}`;
+    copy.resource.id = copy.fullUrl.slice(9);
+    return copy;
+  });
+  entry.push(fixture.entry[fixture.entry.length - 1]);
+  return { resourceType: 'Bundle', type: 'searchset', total: immunizations, entry };
+}
+
+const gzip = level => body => zlib.gzipSync(body, { level });
+const brotli = quality => body =>
+  zlib.brotliCompressSync(body, { params: { [zlib.constants.BROTLI_PARAM_QUALITY]: quality } });
+
+const encoders = {
+  'gzip level 1': gzip(1),
+  'gzip level 6': gzip(6),
+  'gzip level 9': gzip(9),
+  'br quality 1': brotli(1),
+  'br quality 5': brotli(5),
+  'br quality 11': brotli(11),
+  'sandbox br': ENCODERS.br,
+  'sandbox gzip': ENCODERS.gzip
+};
+
+function timePerCall(fn, iterations) {
+  const startedAt = process.hrtime.bigint();
+  let result;
+  for (let i = 0; i < iterations; i++) {
+    result = fn();
+  }
+  return { result, us: Number(process.hrtime.bigint() - startedAt) / iterations / 1000 };
+}
+
+function report(name, bundle, iterations) {
+  const serialised = serialise({ status: 200, response: bundle, headers: {} });
+  const size = serialised.body.length;
+  console.log(`${name}: ${size} bytes uncompressed`);
+  Object.keys(encoders).forEach(encoder => {
+    const { result, us } = timePerCall(() => encoders[encoder](serialised.body), iterations);
+    const ratio = ((result.length / size) * 100).toFixed(1);
+    console.log(
+      `  ${encoder.padEnd(14)} ${String(result.length).padStart(7)} bytes ${ratio.padStart(5)}% ` +
+        `${us.toFixed(1).padStart(9)} us per response`
+    );
+  });
+  encode(serialised, 'br');
+  const cached = () => encode(serialised, negotiateEncoding('gzip, deflate, br'));
+  const { us } = timePerCall(cached, iterations * 100);
+  console.log(`  ${'cached br'.padEnd(36)} ${us.toFixed(3).padStart(9)} us per response`);
+}
+
+const iterations = Number(process.argv[2]) || 200;
+
+report('COVID19 bundle', covidImmunizationFhir(START, END), iterations);
+report('HPV bundle', hpvImmunizationFhir(START, END), iterations);
+report('100 immunization bundle', longHistory(100), Math.ceil(iterations / 10));
@@ -0,0 +1,51 @@
+// Compares version dispatch in immunization-handler/index.js with the way it used to be done, which
+// built the handler table, called require and tokenised the Accept header on every request.
+//
+// Usage: node benchmarks/dispatch.js [iterations]
+
+const { getHandler } = require('../immunization-handler');
+const { getMajorVersion, extractVersionFromAcceptHeader } = require('../immunization-handler/versioning');
+const { API_VERSIONS } = require('../immunization-handler/constants');
+
+const ACCEPT_HEADERS = [
+  undefined,
+  'application/fhir+json',
+  'application/fhir+json;version=1',
+  'application/fhir+json; version=2',
+  'application/fhir+json;version=3',
+  'application/fhir+json;version=abc'
+];
+
+function previousGetHandler(req) {
+  try {
+    const handlers = {
+      [getMajorVersion(API_VERSIONS.V1)]: require('../immunization-handler/v1/handler'),
+      [getMajorVersion(API_VERSIONS.V2)]: require('../immunization-handler/v2/handler')
+    };
+
+    const version = extractVersionFromAcceptHeader(req.headers['accept']);
+    return handlers[getMajorVersion(version)];
+  } catch {
+    return null;
+  }
+}
+
+function measure(name, dispatch, iterations) {
+  const requests = ACCEPT_HEADERS.map(accept => ({ headers: { accept } }));
+  let dispatched = 0;
+  const startedAt = process.hrtime.bigint();
+  for (let i = 0; i < iterations; i++) {
+    if (dispatch(requests[i % requests.length])) {
+      dispatched++;
+    }
+  }
+  const nanoseconds = Number(process.hrtime.bigint() - startedAt) / iterations;
+  console.log(`${name.padEnd(10)} ${nanoseconds.toFixed(0).padStart(6)} ns per request (${dispatched} dispatched)`);
+}
+
+const iterations = Number(process.argv[2]) || 1000000;
+// Warm both up before measuring, so that neither pays for loading the handler modules
+measure('warm up', previousGetHandler, 10000);
+measure('warm up', getHandler, 10000);
+measure('previous', previousGetHandler, iterations);
+measure('current', getHandler, iterations);
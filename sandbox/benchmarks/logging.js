@@ -0,0 +1,62 @@
+// Measures the cost per request of logging a request, as after_request does, written straight to the
+// output the way it used to be and through the batched writer at a few sample rates. Output goes to
+// /dev/null with synchronous writes, as process.stdout does for files and pipes on Linux.
+//
+// Usage: node benchmarks/logging.js [requests]
+
+const fs = require('fs');
+const { LogWriter } = require('../logging');
+
+const devNull = fs.openSync('/dev/null', 'w');
+const output = { write: chunk => fs.writeSync(devNull, chunk) };
+
+function logEntry(i) {
+  const startedAt = Date.now();
+  return {
+    timestamp: startedAt,
+    level: 'info',
+    app: 'immunisation-history',
+    msg: 'request',
+    correlation_id: `c0f6a1c2-7d3e-4b8a-9f10-${String(i).padStart(12, '0')}`,
+    started: startedAt,
+    finished: startedAt,
+    duration: 0,
+    req: {
+      url: '/FHIR/R4/Immunization?patient.identifier=https://fhir.nhs.uk/Id/nhs-number|9000000009&immunization.target=COVID19',
+      method: 'GET',
+      query: {
+        'patient.identifier': 'https://fhir.nhs.uk/Id/nhs-number|9000000009',
+        'immunization.target': 'COVID19'
+      },
+      path: '/FHIR/R4/Immunization'
+    },
+    res: { status: 200 },
+    version: { build_label: '1233-shaacdef1', releaseId: '1234', commitId: 'acdef12341ccc' }
+  };
+}
+
+function measure(name, logRequest, requests) {
+  const startedAt = process.hrtime.bigint();
+  for (let i = 0; i < requests; i++) {
+    logRequest(logEntry(i));
+  }
+  const elapsed = process.hrtime.bigint() - startedAt;
+  console.log(`${name.padEnd(28)} ${(Number(elapsed) / requests / 1000).toFixed(2).padStart(6)} us per request`);
+}
+
+const requests = Number(process.argv[2]) || 200000;
+
+measure('previous', entry => output.write(JSON.stringify(entry) + '\n'), requests);
+[1, 0.1, 0.01].forEach(sampleRate => {
+  const writer = new LogWriter(output, 500);
+  measure(
+    `batched, sample rate ${sampleRate}`,
+    entry => {
+      if (Math.random() < sampleRate) {
+        writer.write(entry);
+      }
+    },
+    requests
+  );
+  writer.flush();
+});
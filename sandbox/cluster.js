@@ -0,0 +1,145 @@
+'use strict';
+
+const cluster = require('cluster');
+const fs = require('fs');
+const os = require('os');
+const log = require('loglevel');
+
+// How long a worker gets to finish its in-flight requests before it is killed
+const WORKER_SHUTDOWN_TIMEOUT_MS = 30000;
+
+// cgroup v2, then v1, CPU quotas as the microseconds a period that the container can use in each
+const CPU_QUOTA_FILES = [
+  { file: '/sys/fs/cgroup/cpu.max', parse: text => text.trim().split(/\s+/) },
+  {
+    file: '/sys/fs/cgroup/cpu/cpu.cfs_quota_us',
+    parse: text => [
+      text.trim(),
+      fs.readFileSync('/sys/fs/cgroup/cpu/cpu.cfs_period_us', 'utf8').trim()
+    ]
+  }
+];
+
+// The CPUs that the container's cgroup quota allows, rounded up, or undefined without a quota
+function cgroupCpus() {
+  for (const { file, parse } of CPU_QUOTA_FILES) {
+    try {
+      const [quota, period] = parse(fs.readFileSync(file, 'utf8'));
+      if (quota === 'max' || Number(quota) < 0) {
+        return undefined;
+      }
+      const cpus = Math.ceil(Number(quota) / Number(period));
+      return cpus > 0 ? cpus : undefined;
+    } catch (err) {
+      // Not this cgroup version, or not in a cgroup with a CPU controller
+    }
+  }
+  return undefined;
+}
+
+// os.cpus() counts the host's CPUs, which in a container can be many more than the task is allowed,
+// and each worker holds its own copy of the dataset and response cache
+function workerCount(workers) {
+  if (workers === 'auto') {
+    return Math.min(cgroupCpus() || os.cpus().length, os.cpus().length);
+  }
+  return Math.max(parseInt(workers, 10) || 1, 1);
+}
+
+// Resolves once the new worker is accepting connections
+function fork() {
+  return new Promise((resolve, reject) => {
+    const worker = cluster.fork();
+    const onExit = code => {
+      reject(new Error(`worker ${worker.process.pid} exited with ${code} while starting`));
+    };
+    worker.once('exit', onExit);
+    worker.on('message', message => {
+      if (message && message.msg === 'startup') {
+        worker.removeListener('exit', onExit);
+        worker.startup = message;
+        resolve(worker);
+      }
+    });
+  });
+}
+
+function stop(worker) {
+  return new Promise(resolve => {
+    if (worker.isDead()) {
+      resolve();
+      return;
+    }
+    const timeout = setTimeout(() => worker.kill('SIGKILL'), WORKER_SHUTDOWN_TIMEOUT_MS);
+    worker.once('exit', () => {
+      clearTimeout(timeout);
+      resolve();
+    });
+    // Stops the worker's server accepting connections and lets it exit once in-flight requests are done
+    worker.disconnect();
+  });
+}
+
+// Runs the sandbox in `workers` processes that share the listening port. SIGHUP replaces the workers one
+// at a time, each only once its replacement is serving; SIGINT and SIGTERM stop them all gracefully.
+function startPrimary(options) {
+  const appName = options.APP_NAME || 'immunisation-history';
+  const workers = workerCount(options.WORKERS);
+  const stopping = new Set();
+  let shuttingDown = false;
+  log.setLevel(options.LOG_LEVEL || 'info');
+
+  const logLine = (msg, fields) => {
+    log.info(
+      JSON.stringify(
+        Object.assign({ timestamp: Date.now(), level: 'info', app: appName, msg: msg }, fields)
+      )
+    );
+  };
+
+  cluster.on('exit', (worker, code, signal) => {
+    // Workers that never started are not replaced, so that a bad deployment doesn't fork forever
+    if (shuttingDown || stopping.has(worker) || !worker.startup) {
+      return;
+    }
+    logLine('worker_exit', { pid: worker.process.pid, code: code, signal: signal });
+    fork().catch(err => logLine('worker_restart_failed', { err: err.message }));
+  });
+
+  async function rollingRestart() {
+    logLine('rolling_restart', { workers: Object.keys(cluster.workers).length });
+    for (const worker of Object.values(cluster.workers)) {
+      await fork();
+      stopping.add(worker);
+      await stop(worker);
+      stopping.delete(worker);
+    }
+    logLine('rolling_restart_complete', {
+      pids: Object.values(cluster.workers).map(w => w.process.pid)
+    });
+  }
+
+  async function shutdown(signal, value) {
+    shuttingDown = true;
+    logLine('shutdown', { signal: signal });
+    await Promise.all(Object.values(cluster.workers).map(stop));
+    process.exit(128 + value);
+  }
+
+  process.on('SIGHUP', () => {
+    rollingRestart().catch(err => logLine('rolling_restart_failed', { err: err.message }));
+  });
+  process.on('SIGINT', () => shutdown('SIGINT', 2));
+  process.on('SIGTERM', () => shutdown('SIGTERM', 15));
+
+  return Promise.all(Array.from({ length: workers }, fork)).then(started => {
+    logLine('startup', {
+      server_port: started[0].startup.server_port,
+      workers: started.map(worker => ({ id: worker.id, pid: worker.process.pid })),
+      version: started[0].startup.version
+    });
+  });
+}
+
+exports.workerCount = workerCount;
+exports.startPrimary = startPrimary;
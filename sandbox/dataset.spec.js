@@ -0,0 +1,103 @@
+const assert = require("chai").assert;
+const fs = require("fs");
+const os = require("os");
+const path = require("path");
+const moment = require("moment");
+
+const {
+    loadDataset, unloadDataset, isDatasetLoaded, datasetImmunizationFhir, datasetLines
+} = require("./immunization-handler/dataset");
+
+describe("dataset tests", function () {
+    const nhsNumber = value => ({ system: "https://fhir.nhs.uk/Id/nhs-number", value });
+    const patient = (id, value) => ({ resourceType: "Patient", id, identifier: [nhsNumber(value)] });
+    const immunization = (id, value, occurrenceDateTime, recorded) => ({
+        resourceType: "Immunization",
+        id,
+        patient: { identifier: nhsNumber(value) },
+        occurrenceDateTime,
+        recorded
+    });
+    const ndjson = resources => resources.map(resource => JSON.stringify(resource)).join("\n") + "\n";
+    const date = value => moment(value, "YYYY-MM-DD", true);
+    const ids = bundle => bundle.entry.map(entry => entry.resource.id);
+    let directory;
+
+    before(async function () {
+        directory = fs.mkdtempSync(path.join(os.tmpdir(), "dataset-"));
+        fs.writeFileSync(path.join(directory, "Patient.ndjson"), ndjson([
+            patient("p1", "9000000009"),
+            patient("p2", "9000000017")
+        ]));
+        fs.writeFileSync(path.join(directory, "Immunization.COVID19.ndjson"), ndjson([
+            immunization("c3", "9000000009", "2021-08-02T12:46:16.019+00:00", "2021-08-02"),
+            immunization("c2", "9000000017", "2020-12-25T13:00:08.476+00:00", "2020-12-25"),
+            immunization("c1", "9000000009", "2020-12-10T13:00:08.476+00:00", "2021-09-01"),
+            immunization("c4", "9000000009", "2021-03-01T10:00:00.000+00:00")
+        ]));
+        fs.writeFileSync(path.join(directory, "Immunization.FLU.ndjson"), ndjson([
+            immunization("f1", "9000000025", "2020-10-01T09:00:00.000+00:00")
+        ]));
+        await loadDataset(directory);
+    });
+
+    after(function () {
+        unloadDataset();
+        fs.rmdirSync(directory, { recursive: true });
+    });
+
+    it("is loaded", () => {
+        assert.isTrue(isDatasetLoaded());
+    });
+
+    it("returns a patient's immunizations in date order, followed by the patient", () => {
+        const bundle = datasetImmunizationFhir("9000000009", "COVID19", date("0001-01-01"), date("9999-12-31"));
+        assert.equal(bundle.total, 3);
+        assert.deepEqual(ids(bundle), ["c1", "c4", "c3", "p1"]);
+        assert.deepEqual(bundle.entry.map(entry => entry.search.mode), ["match", "match", "match", "include"]);
+        assert.equal(bundle.entry[0].fullUrl, "urn:uuid:c1");
+    });
+
+    it("returns only the immunizations within the date range", () => {
+        const bundle = datasetImmunizationFhir("9000000009", "COVID19", date("2021-04-01"), date("9999-12-31"));
+        assert.equal(bundle.total, 1);
+        assert.deepEqual(ids(bundle), ["c3", "p1"]);
+    });
+
+    it("returns only the immunizations recorded within the recorded range, in date order", () => {
+        const recordedSince = (from, dateFrom, page) => datasetImmunizationFhir(
+            "9000000009", "COVID19", date(dateFrom), date("9999-12-31"), page, { from: date(from).valueOf(), to: Infinity }
+        );
+
+        assert.deepEqual(ids(recordedSince("2021-01-01", "0001-01-01")), ["c1", "c3", "p1"]);
+        assert.deepEqual(ids(recordedSince("2021-08-03", "0001-01-01")), ["c1", "p1"]);
+        assert.deepEqual(ids(recordedSince("2021-01-01", "2021-01-01")), ["c3", "p1"]);
+        assert.equal(recordedSince("2021-10-01", "0001-01-01").total, 0);
+
+        const page = recordedSince("2021-01-01", "0001-01-01", { offset: 1, count: 1 });
+        assert.equal(page.total, 2);
+        assert.deepEqual(ids(page), ["c3", "p1"]);
+    });
+
+    it("returns just the patient for a target they have no immunizations for", () => {
+        assert.deepEqual(ids(datasetImmunizationFhir("9000000017", "HPV", date("0001-01-01"), date("9999-12-31"))), ["p2"]);
+        assert.deepEqual(ids(datasetImmunizationFhir("9000000017", "FLU", date("0001-01-01"), date("9999-12-31"))), ["p2"]);
+    });
+
+    it("returns an empty bundle for a patient that isn't in the dataset", () => {
+        assert.deepEqual(datasetImmunizationFhir("9000000025", "FLU", date("0001-01-01"), date("9999-12-31")), {
+            resourceType: "Bundle",
+            type: "searchset",
+            total: 0,
+            entry: []
+        });
+    });
+
+    it("lists every resource of a type for exports, with null for patients only seen in immunizations", () => {
+        const lineIds = lines => lines.map(line => line && JSON.parse(line).id);
+
+        assert.deepEqual(lineIds(datasetLines("Patient")), ["p1", "p2", null]);
+        assert.deepEqual(lineIds(datasetLines("Immunization", "COVID19")), ["c1", "c4", "c3", "c2"]);
+        assert.deepEqual(datasetLines("Immunization", "HPV"), []);
+    });
+});
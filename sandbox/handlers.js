@@ -1,14 +1,27 @@
 'use strict';
+const cluster = require('cluster');
 const { immunization } = require('./immunization-handler');
+const { batch, invalidBatchBody } = require('./immunization-handler/batch');
+const {
+  exportKickOff,
+  exportStatus,
+  exportDelete,
+  exportFile
+} = require('./immunization-handler/bulk-export');
+const { responseCache } = require('./immunization-handler/response-cache');
 const { writeLog } = require('./logging');
 
 async function status(req, res, next) {
-  res.json({
+  const body = {
     status: 'pass',
     ping: 'pong',
     service: req.app.locals.app_name,
     version: req.app.locals.version_info
-  });
+  };
+  if (cluster.isWorker) {
+    body.worker = { id: cluster.worker.id, pid: process.pid };
+  }
+  res.json(body);
   res.end();
   next();
 }
@@ -28,6 +41,21 @@ async function hello(req, res, next) {
   next();
 }
 
+async function metrics(req, res, next) {
+  res.json({
+    responseCache: responseCache.stats()
+  });
+  res.end();
+  next();
+}
+
 exports.status = status;
 exports.hello = hello;
+exports.metrics = metrics;
 exports.immunization = immunization;
+exports.batch = batch;
+exports.invalidBatchBody = invalidBatchBody;
+exports.exportKickOff = exportKickOff;
+exports.exportStatus = exportStatus;
+exports.exportDelete = exportDelete;
+exports.exportFile = exportFile;
@@ -11,4 +11,15 @@ function badRequest(errorMessage, version) {
   };
 }
 
+function forbidden(errorMessage, version) {
+  return {
+    status: HTTP_STATUS.FORBIDDEN,
+    response: operationOutcomeFhir(errorMessage),
+    headers: {
+      version: version
+    }
+  };
+}
+
 exports.badRequest = badRequest;
+exports.forbidden = forbidden;
@@ -0,0 +1,32 @@
+// The proxy sends the targets that the calling app is authorised for in the AUTHORISED_TARGETS
+// header, either * or a comma separated list. The sandbox proxy doesn't, so without the header every
+// target is allowed.
+
+// The targets in the header, null when every target is allowed
+function parseAuthorisedTargets(header) {
+  if (header === undefined || header.trim() === '*') {
+    return null;
+  }
+  return new Set(
+    header
+      .split(',')
+      .map(target => target.trim())
+      .filter(target => target)
+  );
+}
+
+// The targets that a request is authorised for. The searches in a batch are given the ones that the
+// batch was authorised for, rather than each parsing the header again.
+function authorisedTargetsOf(req) {
+  return req.authorisedTargets !== undefined
+    ? req.authorisedTargets
+    : parseAuthorisedTargets(req.headers['authorised_targets']);
+}
+
+function isAuthorised(authorisedTargets, target) {
+  return authorisedTargets === null || authorisedTargets.has(target);
+}
+
+exports.parseAuthorisedTargets = parseAuthorisedTargets;
+exports.authorisedTargetsOf = authorisedTargetsOf;
+exports.isAuthorised = isAuthorised;
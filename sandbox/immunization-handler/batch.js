@@ -0,0 +1,175 @@
+const http = require('http');
+const querystring = require('querystring');
+const { getHandler, getResponse, send, INVALID_VERSION_RESPONSE } = require('./index');
+const { authorisedTargetsOf, isAuthorised } = require('./authorised-targets');
+const { operationOutcomeFhir } = require('./operation-outcome.fhir');
+const { badRequest, forbidden } = require('./api-response');
+const { serialise, withEtag } = require('./response-cache');
+const { getMajorVersion } = require('./versioning');
+const { requestUrl } = require('./v2/paging');
+const { IMMUNIZATION_TARGETS } = require('./v2/constants');
+const { API_VERSIONS, HTTP_STATUS } = require('./constants');
+const { writeLog } = require('../logging');
+
+const MAX_BATCH_ENTRIES = 100;
+
+// Each entry searches for one patient's immunizations, as a GET of Immunization would
+const ENTRY_URL = /^Immunization(\?|$)/;
+
+function apiVersion(version) {
+  return Object.values(API_VERSIONS).find(apiVersion => getMajorVersion(apiVersion) === version);
+}
+
+// The reason that a batch can't be run, or undefined when it can
+function validateBatch(bundle) {
+  if (!bundle || bundle.resourceType !== 'Bundle' || bundle.type !== 'batch') {
+    return 'Invalid request body: must be a Bundle of type batch';
+  }
+  if (!Array.isArray(bundle.entry) || bundle.entry.length === 0) {
+    return 'Invalid request body: [entry] must list at least one search';
+  }
+  if (bundle.entry.length > MAX_BATCH_ENTRIES) {
+    return `Invalid request body: [entry] must list at most ${MAX_BATCH_ENTRIES} searches`;
+  }
+  const invalid = bundle.entry.findIndex(
+    entry =>
+      !entry ||
+      !entry.request ||
+      entry.request.method !== 'GET' ||
+      typeof entry.request.url !== 'string' ||
+      !ENTRY_URL.test(entry.request.url)
+  );
+  if (invalid !== -1) {
+    return `Invalid request body: [entry[${invalid}].request] must be a GET of Immunization`;
+  }
+}
+
+// The entry's search as a request that the handlers can answer. Entry URLs are relative to the
+// batch's, and each search is authorised for the targets that the batch is.
+function entryRequest(req, baseUrl, url, authorisedTargets) {
+  const entryUrl = new URL(url, baseUrl);
+  return {
+    method: 'GET',
+    path: entryUrl.pathname,
+    query: querystring.parse(entryUrl.search.slice(1)),
+    headers: Object.assign({}, req.headers, { 'x-request-url': entryUrl.toString() }),
+    rawHeaders: req.rawHeaders,
+    authorisedTargets: authorisedTargets
+  };
+}
+
+// The targets that a search is for, none when it doesn't give any and the handler rejects it
+function searchTargets(query) {
+  if (typeof query['immunization.target'] === 'string') {
+    return query['immunization.target'].split(',').map(target => target.trim());
+  }
+  if (query['procedure-code:below'] !== undefined) {
+    return [IMMUNIZATION_TARGETS.COVID19];
+  }
+  return [];
+}
+
+// Searches for more than one target are left to the handler to narrow down to the authorised ones
+function entryResponse(res, versionedHandler, entryReq) {
+  const targets = searchTargets(entryReq.query);
+  if (
+    targets.length > 0 &&
+    !targets.some(target => isAuthorised(entryReq.authorisedTargets, target))
+  ) {
+    const errorMessage = `Not authorised for immunization target: ${targets.join(',')}`;
+    return serialise(forbidden(errorMessage, null));
+  }
+  // The handlers expect a patient, and fail outright without one
+  if (!entryReq.query['patient.identifier']) {
+    return serialise(badRequest('Missing required request parameters: [patient.identifier]', null));
+  }
+  return getResponse(entryReq, res, versionedHandler);
+}
+
+// The serialised responses are spliced into the batch-response as they are, so responses that are
+// cached aren't parsed and serialised again. Searches that failed have their OperationOutcome as
+// the response's outcome, and no resource.
+function batchResponseBody(responses) {
+  const entries = responses.map(({ status, body, etag }) => {
+    const responseStatus = JSON.stringify(`${status} ${http.STATUS_CODES[status]}`);
+    if (status !== HTTP_STATUS.OK) {
+      return `{"response":{"status":${responseStatus},"outcome":${body}}}`;
+    }
+    const response = `{"status":${responseStatus},"etag":${JSON.stringify(etag)}}`;
+    return `{"resource":${body},"response":${response}}`;
+  });
+  return Buffer.from(
+    `{"resourceType":"Bundle","type":"batch-response","entry":[${entries.join(',')}]}`
+  );
+}
+
+// Runs a batch of Immunization searches, answering each one in an entry of a batch-response Bundle.
+// The authorised targets are only read once for the whole batch.
+async function batch(req, res, next) {
+  const versionedHandler = getHandler(req);
+  if (!versionedHandler) {
+    send(req, res, INVALID_VERSION_RESPONSE);
+    res.end();
+    return next();
+  }
+  const version = apiVersion(versionedHandler.version);
+  const errorMessage = validateBatch(req.body);
+  if (errorMessage) {
+    send(req, res, serialise(badRequest(errorMessage, version)));
+    res.end();
+    return next();
+  }
+
+  writeLog(res, 'info', {
+    message: 'immunization batch',
+    req: {
+      path: req.path,
+      entries: req.body.entry.length,
+      version: version,
+      accept: req.headers['accept']
+    }
+  });
+
+  const authorisedTargets = authorisedTargetsOf(req);
+  const baseUrl = requestUrl(req).replace(/\/?(\?.*)?$/, '/');
+  const responses = req.body.entry.map(entry =>
+    entryResponse(
+      res,
+      versionedHandler,
+      entryRequest(req, baseUrl, entry.request.url, authorisedTargets)
+    )
+  );
+  send(
+    req,
+    res,
+    withEtag({
+      status: HTTP_STATUS.OK,
+      headers: { version: version },
+      body: batchResponseBody(responses)
+    })
+  );
+  res.end();
+  next();
+}
+
+// Request bodies that can't be read are the client's fault, not the sandbox's
+function invalidBatchBody(err, req, res, next) {
+  if (!(err.status >= 400 && err.status < 500)) {
+    return next(err);
+  }
+  send(
+    req,
+    res,
+    serialise({
+      status: err.status,
+      response: operationOutcomeFhir(`Invalid request body: ${err.message}`),
+      headers: {}
+    })
+  );
+  res.end();
+  next();
+}
+
+exports.MAX_BATCH_ENTRIES = MAX_BATCH_ENTRIES;
+exports.batch = batch;
+exports.invalidBatchBody = invalidBatchBody;
@@ -0,0 +1,461 @@
+const fs = require('fs');
+const os = require('os');
+const path = require('path');
+const { Readable, pipeline } = require('stream');
+const { promisify } = require('util');
+const uuid = require('uuid');
+const { send } = require('./index');
+const { parseAuthorisedTargets, isAuthorised } = require('./authorised-targets');
+const { operationOutcomeFhir } = require('./operation-outcome.fhir');
+const { serialise } = require('./response-cache');
+const { negotiateEncoding, STREAM_ENCODERS } = require('./compression');
+const { isDatasetLoaded, datasetLines } = require('./dataset');
+const { requestUrl } = require('./v2/paging');
+const { IMMUNIZATION_TARGETS, EXTREME_DATES } = require('./v2/constants');
+const { covidImmunizationFhir } = require('./v2/fhir-responses/covid-immunization.fhir');
+const { hpvImmunizationFhir } = require('./v2/fhir-responses/hpv-immunization.fhir');
+const { fluImmunizationFhir } = require('./v2/fhir-responses/flu-immunization.fhir');
+const { patientFhir } = require('./v2/fhir-responses/patient.fhir');
+const { HTTP_STATUS } = require('./constants');
+const { logWriter, isEnabled } = require('../logging');
+
+const pipelineAsync = promisify(pipeline);
+// fs.rm replaces a recursive fs.rmdir from Node 14
+const removeDirectory = fs.promises.rm || fs.promises.rmdir;
+
+const DEFAULT_EXPORT_DIRECTORY = path.join(os.tmpdir(), 'immunisation-history-exports');
+const MAX_RUNNING_EXPORTS = 2;
+const EXPORT_TTL_MS = 60 * 60 * 1000;
+const RETRY_AFTER_SECONDS = 1;
+const RESOURCE_TYPES = ['Patient', 'Immunization'];
+const OUTPUT_FORMATS = ['application/fhir+ndjson', 'application/ndjson', 'ndjson'];
+const MANIFEST_FILE = 'manifest.json';
+const ERROR_FILE = 'error.json';
+const OWNER_FILE = 'owner.json';
+
+// Exports are run by the worker that was sent the kick-off. One that hasn't finished this long
+// after it started, or whose worker has stopped, never will, and is failed so that it's cleaned up.
+const EXPORT_DEADLINE_MS = 30 * 60 * 1000;
+const SWEEP_INTERVAL_MS = 10 * 60 * 1000;
+
+// Resources are written out in chunks of about this many characters, and only one chunk is waiting
+// to be written at a time, so an export holds little more than that in memory besides the dataset
+const CHUNK_SIZE = 64 * 1024;
+
+const FIXTURES = {
+  [IMMUNIZATION_TARGETS.COVID19]: covidImmunizationFhir,
+  [IMMUNIZATION_TARGETS.HPV]: hpvImmunizationFhir,
+  [IMMUNIZATION_TARGETS.FLU]: fluImmunizationFhir
+};
+
+let exportDirectory = DEFAULT_EXPORT_DIRECTORY;
+let runningExports = 0;
+let sweepTimer = null;
+
+// Exports started by this process, from when they start until they expire. Each export's files,
+// and its manifest once it's finished, are kept in a directory of its own under the export
+// directory, so that with more than one worker any of them can report on and serve any export.
+const jobs = new Map();
+
+function setExportDirectory(directory) {
+  exportDirectory = directory || DEFAULT_EXPORT_DIRECTORY;
+  clearInterval(sweepTimer);
+  sweepTimer = setInterval(() => sweepExports().catch(() => {}), SWEEP_INTERVAL_MS);
+  sweepTimer.unref();
+}
+
+function exportPath(id) {
+  return path.join(exportDirectory, id);
+}
+
+function outcome(status, message) {
+  return serialise({ status: status, response: operationOutcomeFhir(message), headers: {} });
+}
+
+function parseList(raw, allowed) {
+  if (typeof raw !== 'string') {
+    return null;
+  }
+  const values = raw.split(',').map(value => value.trim());
+  return values.every(value => allowed.includes(value)) ? Array.from(new Set(values)) : null;
+}
+
+// The resource types and targets asked for, or the status and message that the kick-off fails with.
+// Without immunization.target, every target that the app is authorised for is exported.
+function parseExport(query, authorisedTargets) {
+  const types = query._type === undefined ? RESOURCE_TYPES : parseList(query._type, RESOURCE_TYPES);
+  if (!types) {
+    return { status: HTTP_STATUS.BAD_REQUEST, errorMessage: 'Invalid request parameters: [_type]' };
+  }
+  if (query._outputFormat !== undefined && !OUTPUT_FORMATS.includes(query._outputFormat)) {
+    return {
+      status: HTTP_STATUS.BAD_REQUEST,
+      errorMessage: 'Invalid request parameters: [_outputFormat]'
+    };
+  }
+  const allTargets = Object.values(IMMUNIZATION_TARGETS);
+  const rawTarget = query['immunization.target'];
+  const targets =
+    rawTarget === undefined
+      ? allTargets.filter(target => isAuthorised(authorisedTargets, target))
+      : parseList(rawTarget, allTargets);
+  if (!targets) {
+    return {
+      status: HTTP_STATUS.BAD_REQUEST,
+      errorMessage: 'Invalid request parameters: [immunization.target]'
+    };
+  }
+  const forbidden = targets.filter(target => !isAuthorised(authorisedTargets, target));
+  if (targets.length === 0 || forbidden.length > 0) {
+    return {
+      status: HTTP_STATUS.FORBIDDEN,
+      errorMessage: `Not authorised for immunization target: ${forbidden.join(',') || 'any'}`
+    };
+  }
+  return { types: types, targets: targets };
+}
+
+// An export's files, laid out as a SANDBOX_DATASET is, so that one can be loaded as the other
+function exportOutputs(types, targets) {
+  const outputs = [];
+  if (types.includes('Patient')) {
+    outputs.push({ type: 'Patient', file: 'Patient.ndjson', count: 0 });
+  }
+  if (types.includes('Immunization')) {
+    targets.forEach(target =>
+      outputs.push({
+        type: 'Immunization',
+        target: target,
+        file: `Immunization.${target}.ndjson`,
+        count: 0
+      })
+    );
+  }
+  return outputs;
+}
+
+// Without a dataset, the built-in responses' resources are exported
+function fixtureLines(type, target) {
+  if (type === 'Patient') {
+    return [JSON.stringify(patientFhir().resource)];
+  }
+  return FIXTURES[target](EXTREME_DATES.START, EXTREME_DATES.END)
+    .entry.filter(entry => entry.search.mode === 'match')
+    .map(entry => JSON.stringify(entry.resource));
+}
+
+function resourceLines(type, target) {
+  return isDatasetLoaded() ? datasetLines(type, target) : fixtureLines(type, target);
+}
+
+// NDJSON for an output's resources, skipping the patients that were only seen in immunizations
+function* ndjsonChunks(job, output, lines) {
+  let chunk = '';
+  for (let i = 0; i < lines.length && !job.cancelled; i++) {
+    if (lines[i] === null) {
+      continue;
+    }
+    chunk += `${lines[i]}\n`;
+    output.count++;
+    job.exported++;
+    if (chunk.length >= CHUNK_SIZE) {
+      yield chunk;
+      chunk = '';
+    }
+  }
+  if (chunk) {
+    yield chunk;
+  }
+}
+
+function manifest(job) {
+  return {
+    transactionTime: job.transactionTime,
+    request: job.request,
+    requiresAccessToken: true,
+    output: job.outputs
+      .filter(output => output.count > 0)
+      .map(output => ({
+        type: output.type,
+        url: `${job.baseUrl}$export-files/${job.id}/${output.file}`,
+        count: output.count
+      })),
+    error: []
+  };
+}
+
+function logExport(job, level, message) {
+  if (isEnabled(level)) {
+    logWriter.write({
+      timestamp: Date.now(),
+      level: level,
+      msg: message,
+      export: { id: job.id, request: job.request, exported: job.exported }
+    });
+  }
+}
+
+// Writes an export's files one after the other. Each is streamed out a chunk at a time, so the
+// sandbox keeps answering searches while it waits for the disk.
+async function runExport(job) {
+  try {
+    for (const output of job.outputs) {
+      const file = path.join(job.directory, output.file);
+      const lines = resourceLines(output.type, output.target);
+      await pipelineAsync(
+        Readable.from(ndjsonChunks(job, output, lines), { highWaterMark: 1 }),
+        fs.createWriteStream(file)
+      );
+      if (output.count === 0) {
+        await fs.promises.unlink(file);
+      }
+    }
+    if (!job.cancelled) {
+      job.manifest = manifest(job);
+      await fs.promises.writeFile(
+        path.join(job.directory, MANIFEST_FILE),
+        JSON.stringify(job.manifest)
+      );
+      logExport(job, 'info', 'export finished');
+    }
+  } catch (err) {
+    if (!job.cancelled) {
+      job.error = operationOutcomeFhir(`Export failed: ${err.message}`);
+      await fs.promises
+        .writeFile(path.join(job.directory, ERROR_FILE), JSON.stringify(job.error))
+        .catch(() => {});
+      logExport(job, 'error', 'export failed');
+    }
+  } finally {
+    runningExports--;
+    job.finished = true;
+    if (!job.cancelled) {
+      job.expiry = setTimeout(() => removeExport(job.id), EXPORT_TTL_MS);
+      job.expiry.unref();
+    }
+  }
+}
+
+function removeExport(id) {
+  const job = jobs.get(id);
+  if (job) {
+    job.cancelled = true;
+    clearTimeout(job.expiry);
+    jobs.delete(id);
+  }
+  return removeDirectory(exportPath(id), { recursive: true }).catch(() => {});
+}
+
+async function readJson(file) {
+  try {
+    return JSON.parse(await fs.promises.readFile(file, 'utf8'));
+  } catch (err) {
+    return null;
+  }
+}
+
+async function exists(file) {
+  try {
+    await fs.promises.access(file);
+    return true;
+  } catch (err) {
+    return false;
+  }
+}
+
+async function modifiedAt(file) {
+  try {
+    return (await fs.promises.stat(file)).mtimeMs;
+  } catch (err) {
+    return null;
+  }
+}
+
+function isRunning(pid) {
+  try {
+    process.kill(pid, 0);
+    return true;
+  } catch (err) {
+    return err.code === 'EPERM';
+  }
+}
+
+// The worker that's running an export and when it started it, or null if there's no such export.
+// Until the kick-off has recorded its owner, an export is taken to have started when its directory
+// was made.
+async function exportOwner(id) {
+  const owner = await readJson(path.join(exportPath(id), OWNER_FILE));
+  if (owner) {
+    return owner;
+  }
+  const startedAt = await modifiedAt(exportPath(id));
+  return startedAt === null ? null : { startedAt: startedAt };
+}
+
+// Whether an export that hasn't finished never will: it's past its deadline, or the worker running
+// it has stopped. Workers are only checked on the same host, as another host's pids mean nothing
+// here, and this process's exports are in `jobs` for as long as they exist.
+function isAbandoned(id, owner) {
+  if (Date.now() - owner.startedAt > EXPORT_DEADLINE_MS) {
+    return true;
+  }
+  if (owner.pid === undefined || owner.host !== os.hostname()) {
+    return false;
+  }
+  return owner.pid === process.pid ? !jobs.has(id) : !isRunning(owner.pid);
+}
+
+// Fails an abandoned export as its worker would have, so that it's reported and expires as such
+async function abandonExport(id) {
+  const error = operationOutcomeFhir('Export failed: it stopped before it finished');
+  await fs.promises
+    .writeFile(path.join(exportPath(id), ERROR_FILE), JSON.stringify(error))
+    .catch(() => {});
+  return error;
+}
+
+// Exports are removed by the worker that ran them an hour after they finish. This removes those
+// that outlived their worker, and fails those that were abandoned, so that they're removed in turn.
+async function sweepExports() {
+  const directories = await fs.promises
+    .readdir(exportDirectory, { withFileTypes: true })
+    .catch(() => []);
+  for (const directory of directories) {
+    const id = directory.name;
+    if (!directory.isDirectory() || jobs.has(id)) {
+      continue;
+    }
+    const finishedAt =
+      (await modifiedAt(path.join(exportPath(id), MANIFEST_FILE))) ||
+      (await modifiedAt(path.join(exportPath(id), ERROR_FILE)));
+    if (finishedAt !== null) {
+      if (Date.now() - finishedAt > EXPORT_TTL_MS) {
+        await removeExport(id);
+      }
+    } else {
+      const owner = await exportOwner(id);
+      if (owner && isAbandoned(id, owner)) {
+        await abandonExport(id);
+      }
+    }
+  }
+}
+
+// Starts exporting the immunization histories of the whole cohort, as FHIR Bulk Data's system level
+// $export does, and responds with the URL to poll for its status
+async function exportKickOff(req, res, next) {
+  const prefer = req.headers['prefer'] || '';
+  const authorisedTargets = parseAuthorisedTargets(req.headers['authorised_targets']);
+  const { types, targets, status, errorMessage } = parseExport(req.query, authorisedTargets);
+  if (!/\brespond-async\b/.test(prefer)) {
+    send(req, res, outcome(HTTP_STATUS.BAD_REQUEST, 'Missing required request header: [Prefer]'));
+  } else if (errorMessage) {
+    send(req, res, outcome(status, errorMessage));
+  } else if (runningExports >= MAX_RUNNING_EXPORTS) {
+    res.set('Retry-After', String(RETRY_AFTER_SECONDS));
+    send(req, res, outcome(HTTP_STATUS.TOO_MANY_REQUESTS, 'Too many exports running'));
+  } else {
+    const request = requestUrl(req);
+    const id = uuid.v4();
+    const job = {
+      id: id,
+      request: request,
+      baseUrl: request.replace(/(\$|%24)export(\?.*)?$/i, ''),
+      directory: exportPath(id),
+      transactionTime: new Date().toISOString(),
+      outputs: exportOutputs(types, targets),
+      exported: 0,
+      finished: false,
+      cancelled: false
+    };
+    await fs.promises.mkdir(job.directory, { recursive: true });
+    await fs.promises.writeFile(
+      path.join(job.directory, OWNER_FILE),
+      JSON.stringify({ pid: process.pid, host: os.hostname(), startedAt: Date.now() })
+    );
+    jobs.set(id, job);
+    runningExports++;
+    runExport(job);
+    logExport(job, 'info', 'export started');
+    res.status(HTTP_STATUS.ACCEPTED).set('Content-Location', `${job.baseUrl}$export-status/${id}`);
+  }
+  res.end();
+  next();
+}
+
+// 202 while an export is running, then its manifest, or the OperationOutcome that it failed with.
+// Exports that were abandoned by the worker running them are reported as failed.
+async function exportStatus(req, res, next) {
+  const id = req.params[0];
+  const job = jobs.get(id);
+  const directory = exportPath(id);
+  if (job && !job.finished) {
+    res.status(HTTP_STATUS.ACCEPTED).set({
+      'X-Progress': `${job.exported} resources exported`,
+      'Retry-After': String(RETRY_AFTER_SECONDS)
+    });
+  } else {
+    const finished = (job && job.manifest) || (await readJson(path.join(directory, MANIFEST_FILE)));
+    const failed =
+      !finished && ((job && job.error) || (await readJson(path.join(directory, ERROR_FILE))));
+    if (finished) {
+      send(req, res, serialise({ status: HTTP_STATUS.OK, response: finished, headers: {} }));
+    } else if (failed) {
+      const status = HTTP_STATUS.INTERNAL_SERVER_ERROR;
+      send(req, res, serialise({ status: status, response: failed, headers: {} }));
+    } else {
+      const owner = await exportOwner(id);
+      if (!owner) {
+        send(req, res, outcome(HTTP_STATUS.NOT_FOUND, `Export not found: ${id}`));
+      } else if (isAbandoned(id, owner)) {
+        const status = HTTP_STATUS.INTERNAL_SERVER_ERROR;
+        const error = await abandonExport(id);
+        send(req, res, serialise({ status: status, response: error, headers: {} }));
+      } else {
+        // Running in another worker
+        res.status(HTTP_STATUS.ACCEPTED).set('Retry-After', String(RETRY_AFTER_SECONDS));
+      }
+    }
+  }
+  res.end();
+  next();
+}
+
+// Cancels an export if it's still running, and deletes its files
+async function exportDelete(req, res, next) {
+  const id = req.params[0];
+  if (!jobs.has(id) && !(await exists(exportPath(id)))) {
+    send(req, res, outcome(HTTP_STATUS.NOT_FOUND, `Export not found: ${id}`));
+  } else {
+    await removeExport(id);
+    res.status(HTTP_STATUS.ACCEPTED);
+  }
+  res.end();
+  next();
+}
+
+// Streams one of an export's NDJSON files, compressed as it's read when the client accepts it
+async function exportFile(req, res, next) {
+  const file = path.join(exportPath(req.params[0]), req.params[1]);
+  if (!(await exists(file))) {
+    send(req, res, outcome(HTTP_STATUS.NOT_FOUND, `Export file not found: ${req.params[1]}`));
+    res.end();
+    return next();
+  }
+  const streams = [fs.createReadStream(file)];
+  const encoding = negotiateEncoding(req.headers['accept-encoding']);
+  res.status(HTTP_STATUS.OK).type('application/fhir+ndjson');
+  res.vary('Accept-Encoding');
+  if (encoding) {
+    res.set('Content-Encoding', encoding);
+    streams.push(STREAM_ENCODERS[encoding]());
+  }
+  await pipelineAsync(...streams, res);
+  next();
+}
+
+exports.setExportDirectory = setExportDirectory;
+exports.exportKickOff = exportKickOff;
+exports.exportStatus = exportStatus;
+exports.exportDelete = exportDelete;
+exports.exportFile = exportFile;
@@ -0,0 +1,108 @@
+const zlib = require('zlib');
+
+const DEFAULT_THRESHOLD = 1024;
+const GZIP_LEVEL = 6;
+const BROTLI_QUALITY = 5;
+
+// In order of preference when a client accepts more than one equally
+const ENCODERS = {
+  br: body =>
+    zlib.brotliCompressSync(body, {
+      params: {
+        [zlib.constants.BROTLI_PARAM_MODE]: zlib.constants.BROTLI_MODE_TEXT,
+        [zlib.constants.BROTLI_PARAM_QUALITY]: BROTLI_QUALITY,
+        [zlib.constants.BROTLI_PARAM_SIZE_HINT]: body.length
+      }
+    }),
+  gzip: body => zlib.gzipSync(body, { level: GZIP_LEVEL })
+};
+const ENCODINGS = Object.keys(ENCODERS);
+
+// The same encodings for bodies that are streamed rather than sent all at once
+const STREAM_ENCODERS = {
+  br: () =>
+    zlib.createBrotliCompress({
+      params: {
+        [zlib.constants.BROTLI_PARAM_MODE]: zlib.constants.BROTLI_MODE_TEXT,
+        [zlib.constants.BROTLI_PARAM_QUALITY]: BROTLI_QUALITY
+      }
+    }),
+  gzip: () => zlib.createGzip({ level: GZIP_LEVEL })
+};
+
+let threshold = DEFAULT_THRESHOLD;
+
+// Smaller bodies are sent as they are: below about a kilobyte, compressing saves less than it costs
+function setCompressionThreshold(bytes) {
+  const parsed = Number(bytes);
+  threshold = isNaN(parsed) ? DEFAULT_THRESHOLD : Math.max(parsed, 0);
+}
+
+function isCompressible(serialised) {
+  return serialised.body.length >= threshold;
+}
+
+// Like the Accept header, clients send the same few Accept-Encoding headers over and over
+const NEGOTIATED_CACHE_SIZE = 64;
+const MAX_CACHED_ACCEPT_ENCODING_LENGTH = 256;
+const negotiatedCache = new Map();
+
+function parseEncoding(acceptEncoding) {
+  const qualities = {};
+  (acceptEncoding || '').split(',').forEach(coding => {
+    const [name, ...params] = coding.split(';').map(part => part.trim());
+    const q = params.find(param => /^q=/i.test(param));
+    qualities[name.toLowerCase()] = q ? Number(q.slice(2)) || 0 : 1;
+  });
+  let best = null;
+  let bestQuality = 0;
+  ENCODINGS.forEach(encoding => {
+    const quality = encoding in qualities ? qualities[encoding] : qualities['*'] || 0;
+    if (quality > bestQuality) {
+      best = encoding;
+      bestQuality = quality;
+    }
+  });
+  return best;
+}
+
+// The encoding to send a response in, null to send it as it is
+function negotiateEncoding(acceptEncoding) {
+  if (negotiatedCache.has(acceptEncoding)) {
+    return negotiatedCache.get(acceptEncoding);
+  }
+  const encoding = parseEncoding(acceptEncoding);
+  if (
+    typeof acceptEncoding !== 'string' ||
+    acceptEncoding.length <= MAX_CACHED_ACCEPT_ENCODING_LENGTH
+  ) {
+    if (negotiatedCache.size >= NEGOTIATED_CACHE_SIZE) {
+      negotiatedCache.delete(negotiatedCache.keys().next().value);
+    }
+    negotiatedCache.set(acceptEncoding, encoding);
+  }
+  return encoding;
+}
+
+// A serialised response's body and ETag in an encoding. Each encoding is compressed the first time
+// it's asked for and then kept with the response, so a cached response is only compressed once per
+// encoding. Strong ETags have to differ between encodings of the same response.
+function encode(serialised, encoding) {
+  if (!serialised.encoded) {
+    serialised.encoded = {};
+  }
+  if (!serialised.encoded[encoding]) {
+    serialised.encoded[encoding] = {
+      body: ENCODERS[encoding](serialised.body),
+      etag: serialised.etag.replace(/"$/, `-${encoding}"`)
+    };
+  }
+  return serialised.encoded[encoding];
+}
+
+exports.ENCODERS = ENCODERS;
+exports.STREAM_ENCODERS = STREAM_ENCODERS;
+exports.setCompressionThreshold = setCompressionThreshold;
+exports.isCompressible = isCompressible;
+exports.negotiateEncoding = negotiateEncoding;
+exports.encode = encode;
@@ -1,6 +1,12 @@
 const HTTP_STATUS = {
+  ACCEPTED: 202,
   BAD_REQUEST: 400,
-  OK: 200
+  FORBIDDEN: 403,
+  INTERNAL_SERVER_ERROR: 500,
+  NOT_FOUND: 404,
+  NOT_MODIFIED: 304,
+  OK: 200,
+  TOO_MANY_REQUESTS: 429
 };
 
 const API_VERSIONS = {
@@ -0,0 +1,224 @@
+const fs = require('fs');
+const path = require('path');
+const readline = require('readline');
+const moment = require('moment');
+
+const { IMMUNIZATION_TARGETS } = require('./v2/constants');
+const { recordedEpoch } = require('./v2/last-updated');
+const { emptyImmunizationFhir } = require('./v2/fhir-responses/empty-immunization.fhir');
+const {
+  datedEntry,
+  firstIndexWhere,
+  recordedOrder,
+  recordedWithin
+} = require('./v2/fhir-responses/response-helper');
+
+const NHS_NUMBER_SYSTEM = 'https://fhir.nhs.uk/Id/nhs-number';
+const PATIENT_FILE = 'Patient.ndjson';
+const immunizationFile = target => `Immunization.${target}.ndjson`;
+
+// Patient and Immunization resources loaded from SANDBOX_DATASET, a directory of NDJSON files:
+// Patient.ndjson and one Immunization.<target>.ndjson per immunization target. Resources are kept
+// as the JSON text they were read as, and only parsed for the responses they are in.
+//
+// Patients are numbered in the order they are first seen. For each target, immunizations are sorted
+// by patient number and then occurrenceDateTime, with `patientStart[p]` the first of patient p's,
+// so that a patient's history for a date range is a Map lookup and two binary searches away.
+// Immunizations that were recorded are also indexed by patient number and then when they were
+// recorded, in `recordedPositions`, so that _lastUpdated searches of long histories only look at
+// the immunizations recorded in the range that they're for.
+function emptyDataset() {
+  return {
+    loaded: false,
+    patientNumbers: new Map(),
+    patients: [],
+    targets: {}
+  };
+}
+
+let dataset = emptyDataset();
+
+function nhsNumberOf(identifiers) {
+  const identifier = [].concat(identifiers || []).find(i => i.system === NHS_NUMBER_SYSTEM);
+  return identifier ? identifier.value : undefined;
+}
+
+function patientNumber(loading, nhsNumber) {
+  let number = loading.patientNumbers.get(nhsNumber);
+  if (number === undefined) {
+    number = loading.patients.length;
+    loading.patientNumbers.set(nhsNumber, number);
+    loading.patients.push(null);
+  }
+  return number;
+}
+
+async function forEachLine(file, callback) {
+  const lines = readline.createInterface({ input: fs.createReadStream(file), crlfDelay: Infinity });
+  let lineNumber = 0;
+  for await (const line of lines) {
+    lineNumber++;
+    if (line.trim()) {
+      try {
+        callback(line, JSON.parse(line));
+      } catch (err) {
+        throw new Error(`${file}:${lineNumber}: ${err.message}`);
+      }
+    }
+  }
+}
+
+async function loadPatients(loading, directory) {
+  await forEachLine(path.join(directory, PATIENT_FILE), (line, patient) => {
+    loading.patients[patientNumber(loading, nhsNumberOf(patient.identifier))] = line;
+  });
+}
+
+// The index of each patient's first in a list sorted by patient number, and the list's length last
+function patientStarts(loading, patients) {
+  const patientStart = new Uint32Array(loading.patients.length + 1);
+  patients.forEach(patient => patientStart[patient + 1]++);
+  for (let p = 1; p < patientStart.length; p++) {
+    patientStart[p] += patientStart[p - 1];
+  }
+  return patientStart;
+}
+
+async function loadImmunizations(loading, file) {
+  const lines = [];
+  const patients = [];
+  const epochs = [];
+  const recordedEpochs = [];
+  await forEachLine(file, (line, immunization) => {
+    lines.push(line);
+    const patient = immunization.patient || {};
+    patients.push(patientNumber(loading, nhsNumberOf(patient.identifier)));
+    epochs.push(moment(immunization.occurrenceDateTime).valueOf());
+    recordedEpochs.push(recordedEpoch(immunization));
+  });
+
+  const order = Uint32Array.from(lines.keys()).sort(
+    (a, b) => patients[a] - patients[b] || epochs[a] - epochs[b]
+  );
+  const recorded = Float64Array.from(order, record => recordedEpochs[record]);
+  const recordedPositions = recordedOrder(
+    recorded,
+    (a, b) => patients[order[a]] - patients[order[b]]
+  );
+  return {
+    lines: Array.from(order, record => lines[record]),
+    epochs: Float64Array.from(order, record => epochs[record]),
+    patientStart: patientStarts(loading, Array.from(order, record => patients[record])),
+    recordedPositions,
+    recordedEpochs: Float64Array.from(recordedPositions, position => recorded[position]),
+    recordedStart: patientStarts(
+      loading,
+      Array.from(recordedPositions, position => patients[order[position]])
+    )
+  };
+}
+
+async function loadDataset(directory) {
+  if (!directory) {
+    return;
+  }
+  const loading = emptyDataset();
+  await loadPatients(loading, directory);
+  for (const target of Object.values(IMMUNIZATION_TARGETS)) {
+    const file = path.join(directory, immunizationFile(target));
+    if (fs.existsSync(file)) {
+      loading.targets[target] = await loadImmunizations(loading, file);
+    }
+  }
+  loading.loaded = true;
+  dataset = loading;
+}
+
+// Goes back to the built-in responses
+function unloadDataset() {
+  dataset = emptyDataset();
+}
+
+function isDatasetLoaded() {
+  return dataset.loaded;
+}
+
+function bundleEntry(resource, mode) {
+  return {
+    fullUrl: `urn:uuid:${resource.id}`,
+    resource,
+    search: { mode }
+  };
+}
+
+// The same searchset Bundle as the built-in responses, of a patient's immunizations for a target.
+// With a page, only the immunizations on it are parsed.
+function datasetImmunizationFhir(nhsNumber, target, dateFrom, dateTo, page, recordedRange) {
+  const patient = dataset.patientNumbers.get(nhsNumber);
+  if (patient === undefined || dataset.patients[patient] === null) {
+    return emptyImmunizationFhir();
+  }
+
+  const entries = [];
+  let total = 0;
+  const immunizations = dataset.targets[target];
+  // Patients first seen after the target's file was loaded have no immunizations for it
+  if (immunizations && patient + 1 < immunizations.patientStart.length) {
+    const { epochs, lines, patientStart } = immunizations;
+    if (recordedRange) {
+      const { recordedStart } = immunizations;
+      const positions = recordedWithin(
+        immunizations,
+        recordedStart[patient],
+        recordedStart[patient + 1],
+        dateFrom,
+        dateTo,
+        recordedRange
+      );
+      total = positions.length;
+      const pageStart = page ? Math.min(page.offset, total) : 0;
+      const pageEnd = page ? Math.min(pageStart + page.count, total) : total;
+      for (let i = pageStart; i < pageEnd; i++) {
+        const position = positions[i];
+        entries.push(
+          datedEntry(bundleEntry(JSON.parse(lines[position]), 'match'), epochs[position])
+        );
+      }
+    } else {
+      const from = dateFrom.valueOf();
+      const to = dateTo.valueOf();
+      const last = patientStart[patient + 1];
+      const start = firstIndexWhere(epochs, patientStart[patient], last, epoch => epoch >= from);
+      const end = firstIndexWhere(epochs, start, last, epoch => epoch > to);
+      total = end - start;
+      const pageStart = page ? Math.min(start + page.offset, end) : start;
+      const pageEnd = page ? Math.min(pageStart + page.count, end) : end;
+      for (let i = pageStart; i < pageEnd; i++) {
+        entries.push(datedEntry(bundleEntry(JSON.parse(lines[i]), 'match'), epochs[i]));
+      }
+    }
+  }
+  entries.push(bundleEntry(JSON.parse(dataset.patients[patient]), 'include'));
+  return {
+    resourceType: 'Bundle',
+    type: 'searchset',
+    total: total,
+    entry: entries
+  };
+}
+
+// All of the Patient resources, or of the Immunization resources for a target, as the JSON text they
+// were read as, for exports. Patients that were only seen in immunizations are null.
+function datasetLines(resourceType, target) {
+  if (resourceType === 'Patient') {
+    return dataset.patients;
+  }
+  const immunizations = dataset.targets[target];
+  return immunizations ? immunizations.lines : [];
+}
+
+exports.loadDataset = loadDataset;
+exports.unloadDataset = unloadDataset;
+exports.isDatasetLoaded = isDatasetLoaded;
+exports.datasetImmunizationFhir = datasetImmunizationFhir;
+exports.datasetLines = datasetLines;
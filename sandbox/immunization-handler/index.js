@@ -1,32 +1,127 @@
 const { getMajorVersion, extractVersionFromAcceptHeader } = require('./versioning');
-const { API_VERSIONS } = require('./constants');
+const { API_VERSIONS, HTTP_STATUS } = require('./constants');
+const { EXTREME_DATES, SK_DATE_FORMAT } = require('./v2/constants');
+const { requestUrl } = require('./v2/paging');
 const { badRequest } = require('./api-response');
+const { responseCache, serialise, etagMatches } = require('./response-cache');
+const { isCompressible, negotiateEncoding, encode } = require('./compression');
 
-function getHandler(req) {
-  try {
-    const handlers = {
-      [getMajorVersion(API_VERSIONS.V1)]: require('./v1/handler'),
-      [getMajorVersion(API_VERSIONS.V2)]: require('./v2/handler')
-    };
+const DEFAULT_DATE_FROM = EXTREME_DATES.START.format(SK_DATE_FORMAT);
+const DEFAULT_DATE_TO = EXTREME_DATES.END.format(SK_DATE_FORMAT);
+
+const HANDLERS = {
+  [getMajorVersion(API_VERSIONS.V1)]: require('./v1/handler'),
+  [getMajorVersion(API_VERSIONS.V2)]: require('./v2/handler')
+};
+const INVALID_VERSION_RESPONSE = serialise({ ...badRequest('Invalid version', null), headers: {} });
 
-    const version = extractVersionFromAcceptHeader(req.headers['accept']);
-    return handlers[getMajorVersion(version)];
+// Clients send the same few Accept headers over and over, so each is only parsed the first time it's seen
+const ACCEPT_CACHE_SIZE = 64;
+const MAX_CACHED_ACCEPT_LENGTH = 256;
+const acceptCache = new Map();
+
+function parseVersion(accept) {
+  try {
+    const version = getMajorVersion(extractVersionFromAcceptHeader(accept));
+    return Object.prototype.hasOwnProperty.call(HANDLERS, version) ? version : null;
   } catch {
     return null;
   }
 }
 
+function getVersion(accept) {
+  if (acceptCache.has(accept)) {
+    return acceptCache.get(accept);
+  }
+  const version = parseVersion(accept);
+  if (typeof accept !== 'string' || accept.length <= MAX_CACHED_ACCEPT_LENGTH) {
+    if (acceptCache.size >= ACCEPT_CACHE_SIZE) {
+      acceptCache.delete(acceptCache.keys().next().value);
+    }
+    acceptCache.set(accept, version);
+  }
+  return version;
+}
+
+function getHandler(req) {
+  const version = getVersion(req.headers['accept']);
+  return version === null ? null : { version, handler: HANDLERS[version] };
+}
+
+// Everything that the handlers' responses depend on. Leaving out a date and giving the extreme date that
+// it defaults to are the same query. Paged responses link to other pages of the URL that was requested.
+// Searches for more than one target only return the ones that the app is authorised for.
+function cacheKey(version, req) {
+  const query = req.query;
+  return JSON.stringify([
+    version,
+    query['patient.identifier'],
+    query['immunization.target'],
+    query['procedure-code:below'],
+    query['date.from'] || DEFAULT_DATE_FROM,
+    query['date.to'] || DEFAULT_DATE_TO,
+    query['_lastUpdated'],
+    query['_count'],
+    query['_cursor'],
+    query['_elements'],
+    query['_summary'],
+    query['_count'] === undefined ? undefined : requestUrl(req),
+    req.headers['authorised_targets']
+  ]);
+}
+
+function getResponse(req, res, { version, handler }) {
+  // Without a patient the handlers fail before they can respond, leave that to them
+  if (!req.query['patient.identifier']) {
+    return serialise(handler(req, res));
+  }
+  const key = cacheKey(version, req);
+  let cached = responseCache.get(key);
+  if (!cached) {
+    cached = serialise(handler(req, res));
+    responseCache.set(key, cached);
+  }
+  return cached;
+}
+
+function send(req, res, serialised) {
+  const { status, headers } = serialised;
+  let { body, etag } = serialised;
+  res.set(headers);
+  let encoding = null;
+  if (isCompressible(serialised)) {
+    res.vary('Accept-Encoding');
+    encoding = negotiateEncoding(req.headers['accept-encoding']);
+    if (encoding) {
+      ({ body, etag } = encode(serialised, encoding));
+    }
+  }
+  if (status === HTTP_STATUS.OK) {
+    res.set('ETag', etag);
+    if (etagMatches(req.headers['if-none-match'], etag)) {
+      res.status(HTTP_STATUS.NOT_MODIFIED);
+      return;
+    }
+  }
+  if (encoding) {
+    res.set('Content-Encoding', encoding);
+  }
+  res.status(status).type('json').send(body);
+}
+
 async function immunization(req, res, next) {
-  const handler = getHandler(req);
-  if (!handler) {
-    const { status, response } = badRequest('Invalid version', null);
-    res.status(status).json(response);
+  const versionedHandler = getHandler(req);
+  if (!versionedHandler) {
+    send(req, res, INVALID_VERSION_RESPONSE);
   } else {
-    const { status, response, headers } = handler(req, res);
-    res.set(headers).status(status).json(response);
+    send(req, res, getResponse(req, res, versionedHandler));
   }
   res.end();
   next();
 }
 
 exports.immunization = immunization;
+exports.getHandler = getHandler;
+exports.getResponse = getResponse;
+exports.send = send;
+exports.INVALID_VERSION_RESPONSE = INVALID_VERSION_RESPONSE;
@@ -0,0 +1,83 @@
+const crypto = require('crypto');
+
+const DEFAULT_MAX_ENTRIES = 1000;
+
+// Least recently used cache of serialised responses. A Map iterates in insertion order, so moving an
+// entry to the end on every hit leaves the least recently used entry first.
+class ResponseCache {
+  constructor(maxEntries) {
+    this.maxEntries = maxEntries;
+    this.entries = new Map();
+    this.hits = 0;
+    this.misses = 0;
+    this.evictions = 0;
+  }
+
+  resize(maxEntries) {
+    this.maxEntries = maxEntries;
+    this.evict();
+  }
+
+  get(key) {
+    const entry = this.entries.get(key);
+    if (entry === undefined) {
+      this.misses++;
+      return undefined;
+    }
+    this.hits++;
+    this.entries.delete(key);
+    this.entries.set(key, entry);
+    return entry;
+  }
+
+  set(key, entry) {
+    this.entries.delete(key);
+    this.entries.set(key, entry);
+    this.evict();
+  }
+
+  evict() {
+    while (this.entries.size > this.maxEntries) {
+      this.entries.delete(this.entries.keys().next().value);
+      this.evictions++;
+    }
+  }
+
+  stats() {
+    return {
+      entries: this.entries.size,
+      maxEntries: this.maxEntries,
+      hits: this.hits,
+      misses: this.misses,
+      evictions: this.evictions
+    };
+  }
+}
+
+// Adds the strong ETag to a response whose body is already the Buffer that is sent
+function withEtag({ status, headers, body }) {
+  const etag = `"${crypto.createHash('sha1').update(body).digest('base64')}"`;
+  return { status, headers, body, etag };
+}
+
+// Turns a handler's { status, response, headers } into the Buffer that is sent, and its strong ETag
+function serialise({ status, response, headers }) {
+  return withEtag({ status, headers, body: Buffer.from(JSON.stringify(response)) });
+}
+
+// If-None-Match uses the weak comparison, so W/"x" matches "x"
+function etagMatches(ifNoneMatch, etag) {
+  if (!ifNoneMatch) {
+    return false;
+  }
+  return ifNoneMatch
+    .split(',')
+    .map(tag => tag.trim().replace(/^W\//, ''))
+    .some(tag => tag === '*' || tag === etag);
+}
+
+exports.responseCache = new ResponseCache(DEFAULT_MAX_ENTRIES);
+exports.ResponseCache = ResponseCache;
+exports.withEtag = withEtag;
+exports.serialise = serialise;
+exports.etagMatches = etagMatches;
@@ -1,4 +1,4 @@
-const { isEntryWithinDateRange } = require('./response-helper');
+const { createDateIndex, entriesWithinDateRange } = require('./response-helper');
 const { patientFhir } = require('./patient.fhir');
 
 const entries = [
@@ -237,8 +237,10 @@ const entries = [
   }
 ];
 
+const entriesByDate = createDateIndex(entries);
+
 exports.covidImmunizationFhir = (dateFrom, dateTo) => {
-  const filteredEntries = entries.filter(entry => isEntryWithinDateRange(entry, dateFrom, dateTo));
+  const filteredEntries = entriesWithinDateRange(entriesByDate, dateFrom, dateTo);
   const vaccineLength = filteredEntries.length;
   filteredEntries.push(patientFhir());
   return {
@@ -1,4 +1,4 @@
-const { isEntryWithinDateRange } = require('./response-helper');
+const { createDateIndex, entriesWithinDateRange } = require('./response-helper');
 const { patientFhir } = require('./patient.fhir');
 
 const entries = [
@@ -115,8 +115,10 @@ const entries = [
   },
 ];
 
+const entriesByDate = createDateIndex(entries);
+
 exports.fluImmunizationFhir = (dateFrom, dateTo) => {
-  const filteredEntries = entries.filter(entry => isEntryWithinDateRange(entry, dateFrom, dateTo));
+  const filteredEntries = entriesWithinDateRange(entriesByDate, dateFrom, dateTo);
   const vaccineLength = filteredEntries.length;
   filteredEntries.push(patientFhir());
   return {
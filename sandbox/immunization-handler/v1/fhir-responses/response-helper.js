@@ -1,8 +1,28 @@
 const moment = require('moment');
 
-function isEntryWithinDateRange(entry, dateFrom, dateTo) {
-  const parseOccurrenceDateTime = moment(entry.resource.occurrenceDateTime);
-  return parseOccurrenceDateTime.isSameOrAfter(dateFrom) && parseOccurrenceDateTime.isSameOrBefore(dateTo);
+// The same binary search as v2's, so that there's only the one to maintain
+const { firstIndexWhere } = require('../../v2/fhir-responses/response-helper');
+
+// Sorts entries by occurrenceDateTime once, at startup, so that date ranges don't need any parsing
+function createDateIndex(entries) {
+  const indexed = entries
+    .map(entry => ({ entry, epoch: moment(entry.resource.occurrenceDateTime).valueOf() }))
+    .sort((a, b) => a.epoch - b.epoch);
+  return {
+    entries: indexed.map(({ entry }) => entry),
+    epochs: Float64Array.from(indexed, ({ epoch }) => epoch)
+  };
+}
+
+// Entries that occurred between dateFrom and dateTo inclusive, in date order
+function entriesWithinDateRange(dateIndex, dateFrom, dateTo) {
+  const from = dateFrom.valueOf();
+  const to = dateTo.valueOf();
+  const { epochs } = dateIndex;
+  const start = firstIndexWhere(epochs, 0, epochs.length, epoch => epoch >= from);
+  const end = firstIndexWhere(epochs, start, epochs.length, epoch => epoch > to);
+  return dateIndex.entries.slice(start, end);
 }
 
-exports.isEntryWithinDateRange = isEntryWithinDateRange;
+exports.createDateIndex = createDateIndex;
+exports.entriesWithinDateRange = entriesWithinDateRange;
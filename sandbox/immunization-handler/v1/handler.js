@@ -6,6 +6,7 @@ const { fluImmunizationFhir } = require('./fhir-responses/flu-immunization.fhir'
 const { badRequest } = require('../api-response');
 const { parseDateRange, validateDateRange } = require('./date-range');
 const { writeLog } = require('../../logging');
+const { isDatasetLoaded, datasetImmunizationFhir } = require('../dataset');
 const { HTTP_STATUS, API_VERSIONS } = require('../constants');
 
 const VERSION = API_VERSIONS.V1;
@@ -17,6 +18,12 @@ function getImmunizationResponse(
   dateFrom,
   dateTo
 ) {
+  if (isDatasetLoaded()) {
+    // The only procedure code that is accepted is the one for COVID-19 vaccinations
+    const target = immunizationTarget || IMMUNIZATION_TARGETS.COVID19;
+    return datasetImmunizationFhir(patientIdentifier, target, dateFrom, dateTo);
+  }
+
   if (patientIdentifier !== '9000000009') {
     return emptyImmunizationFhir();
   }
@@ -100,8 +107,6 @@ function immunisationGetHandler(req, res) {
     message: 'immunization',
     req: {
       path: req.path,
-      query: req.query,
-      headers: req.rawHeaders,
       patientIdentifier: patientIdentifier,
       procedureCodeBelow: procedureCodeBelow,
       immunizationTarget: immunizationTarget,
@@ -111,6 +116,13 @@ function immunisationGetHandler(req, res) {
       accept: req.headers['accept']
     }
   });
+  writeLog(res, 'debug', {
+    message: 'immunization request',
+    req: {
+      query: req.query,
+      headers: req.rawHeaders
+    }
+  });
 
   return getFhirResponse(
     patientIdentifier,
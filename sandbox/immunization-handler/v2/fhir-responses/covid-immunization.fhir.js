@@ -1,4 +1,4 @@
-const { isEntryWithinDateRange } = require('./response-helper');
+const { createDateIndex, entriesWithinDateRange, pageOf } = require('./response-helper');
 const { patientFhir } = require('./patient.fhir');
 
 const entries = [
@@ -237,14 +237,17 @@ const entries = [
   }
 ];
 
-exports.covidImmunizationFhir = (dateFrom, dateTo) => {
-  const filteredEntries = entries.filter(entry => isEntryWithinDateRange(entry, dateFrom, dateTo));
+const entriesByDate = createDateIndex(entries);
+
+exports.covidImmunizationFhir = (dateFrom, dateTo, page, recordedRange) => {
+  const filteredEntries = entriesWithinDateRange(entriesByDate, dateFrom, dateTo, recordedRange);
   const vaccineLength = filteredEntries.length;
-  filteredEntries.push(patientFhir());
+  const pageEntries = pageOf(filteredEntries, page);
+  pageEntries.push(patientFhir());
   return {
     resourceType: 'Bundle',
     type: 'searchset',
     total: vaccineLength,
-    entry: filteredEntries
+    entry: pageEntries
   };
 };
@@ -1,4 +1,4 @@
-const { isEntryWithinDateRange } = require('./response-helper');
+const { createDateIndex, entriesWithinDateRange, pageOf } = require('./response-helper');
 const { patientFhir } = require('./patient.fhir');
 
 const entries = [
@@ -115,14 +115,17 @@ const entries = [
   },
 ];
 
-exports.fluImmunizationFhir = (dateFrom, dateTo) => {
-  const filteredEntries = entries.filter(entry => isEntryWithinDateRange(entry, dateFrom, dateTo));
+const entriesByDate = createDateIndex(entries);
+
+exports.fluImmunizationFhir = (dateFrom, dateTo, page, recordedRange) => {
+  const filteredEntries = entriesWithinDateRange(entriesByDate, dateFrom, dateTo, recordedRange);
   const vaccineLength = filteredEntries.length;
-  filteredEntries.push(patientFhir());
+  const pageEntries = pageOf(filteredEntries, page);
+  pageEntries.push(patientFhir());
   return {
     resourceType: 'Bundle',
     type: 'searchset',
     total: vaccineLength,
-    entry: filteredEntries
+    entry: pageEntries
   };
 };
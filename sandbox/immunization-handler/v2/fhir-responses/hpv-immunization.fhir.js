@@ -1,4 +1,4 @@
-const { isEntryWithinDateRange } = require('./response-helper');
+const { createDateIndex, entriesWithinDateRange, pageOf } = require('./response-helper');
 const { patientFhir } = require('./patient.fhir');
 
 const entries = [
@@ -365,14 +365,17 @@ const entries = [
   }
 ];
 
-exports.hpvImmunizationFhir = (dateFrom, dateTo) => {
-  const filteredEntries = entries.filter(entry => isEntryWithinDateRange(entry, dateFrom, dateTo));
+const entriesByDate = createDateIndex(entries);
+
+exports.hpvImmunizationFhir = (dateFrom, dateTo, page, recordedRange) => {
+  const filteredEntries = entriesWithinDateRange(entriesByDate, dateFrom, dateTo, recordedRange);
   const vaccineLength = filteredEntries.length;
-  filteredEntries.push(patientFhir());
+  const pageEntries = pageOf(filteredEntries, page);
+  pageEntries.push(patientFhir());
   return {
     resourceType: 'Bundle',
     type: 'searchset',
     total: vaccineLength,
-    entry: filteredEntries
+    entry: pageEntries
   };
 };
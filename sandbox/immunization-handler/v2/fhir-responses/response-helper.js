@@ -1,8 +1,152 @@
 const moment = require('moment');
 
-function isEntryWithinDateRange(entry, dateFrom, dateTo) {
-  const parseOccurrenceDateTime = moment(entry.resource.occurrenceDateTime);
-  return parseOccurrenceDateTime.isSameOrAfter(dateFrom) && parseOccurrenceDateTime.isSameOrBefore(dateTo);
+const { recordedEpoch } = require('../last-updated');
+
+// Index of the first of epochs[low..high) for which `isAfter(epoch)` is true, `high` if none is
+function firstIndexWhere(epochs, low, high, isAfter) {
+  while (low < high) {
+    const middle = (low + high) >>> 1;
+    if (isAfter(epochs[middle])) {
+      high = middle;
+    } else {
+      low = middle + 1;
+    }
+  }
+  return low;
+}
+
+// When each entry that has been indexed occurred, so that bundles can be merged in date order
+// without parsing their dates again
+const occurrenceEpochs = new WeakMap();
+
+// Records when an entry occurred, for entries that aren't in a date index
+function datedEntry(entry, epoch) {
+  occurrenceEpochs.set(entry, epoch);
+  return entry;
+}
+
+// Positions of the entries that were recorded, in the order that they were recorded in, given
+// when each entry was recorded, NaN if it wasn't, and how to order those recorded at the same time
+function recordedOrder(recordedEpochs, compareFirst) {
+  return Uint32Array.from(recordedEpochs.keys())
+    .filter(position => !isNaN(recordedEpochs[position]))
+    .sort((a, b) => compareFirst(a, b) || recordedEpochs[a] - recordedEpochs[b]);
+}
+
+// Positions of the entries in recordedPositions[low..high) that were recorded within recordedRange,
+// and occurred between dateFrom and dateTo inclusive, in date order. `recordedEpochs` are when
+// they were recorded, in the same order, and `epochs` when each entry occurred, in date order.
+function recordedWithin(dateIndex, low, high, dateFrom, dateTo, recordedRange) {
+  const from = dateFrom.valueOf();
+  const to = dateTo.valueOf();
+  const { epochs, recordedEpochs, recordedPositions } = dateIndex;
+  const start = firstIndexWhere(recordedEpochs, low, high, epoch => epoch >= recordedRange.from);
+  const end = firstIndexWhere(recordedEpochs, start, high, epoch => epoch > recordedRange.to);
+  return recordedPositions
+    .slice(start, end)
+    .filter(position => epochs[position] >= from && epochs[position] <= to)
+    .sort();
+}
+
+// Sorts entries by occurrenceDateTime once, at startup, so that date ranges don't need any parsing.
+// They're also indexed by when they were recorded, for _lastUpdated, as the dataset's are.
+function createDateIndex(entries) {
+  const indexed = entries
+    .map(entry => ({ entry, epoch: moment(entry.resource.occurrenceDateTime).valueOf() }))
+    .sort((a, b) => a.epoch - b.epoch);
+  indexed.forEach(({ entry, epoch }) => datedEntry(entry, epoch));
+  const recordedEpochs = indexed.map(({ entry }) => recordedEpoch(entry.resource));
+  const recordedPositions = recordedOrder(recordedEpochs, () => 0);
+  return {
+    entries: indexed.map(({ entry }) => entry),
+    epochs: Float64Array.from(indexed, ({ epoch }) => epoch),
+    recordedPositions,
+    recordedEpochs: Float64Array.from(recordedPositions, position => recordedEpochs[position])
+  };
+}
+
+// Entries that occurred between dateFrom and dateTo inclusive, in date order. With a recordedRange,
+// only those recorded within it.
+function entriesWithinDateRange(dateIndex, dateFrom, dateTo, recordedRange) {
+  if (recordedRange) {
+    const { entries, recordedPositions } = dateIndex;
+    const positions = recordedWithin(
+      dateIndex,
+      0,
+      recordedPositions.length,
+      dateFrom,
+      dateTo,
+      recordedRange
+    );
+    return Array.from(positions, position => entries[position]);
+  }
+  const { epochs } = dateIndex;
+  const from = dateFrom.valueOf();
+  const to = dateTo.valueOf();
+  const start = firstIndexWhere(epochs, 0, epochs.length, epoch => epoch >= from);
+  const end = firstIndexWhere(epochs, start, epochs.length, epoch => epoch > to);
+  return dateIndex.entries.slice(start, end);
+}
+
+// The entries on a page of results, or all of them when the results aren't paged
+function pageOf(entries, page) {
+  return page ? entries.slice(page.offset, page.offset + page.count) : entries;
+}
+
+// One searchset Bundle of the immunizations in several, in date order, with each resource in it
+// once. The patient is included in each of them, and in the merged Bundle once, at the end.
+// Each bundle's immunizations are already in date order, so they're merged by when they occurred,
+// as they were dated when they were indexed or read, with ties going to the earlier bundle.
+function mergeBundles(bundles, page) {
+  const includedUrls = new Set();
+  const includes = [];
+  const sources = bundles.map(bundle => {
+    const matches = [];
+    bundle.entry.forEach(entry => {
+      if (entry.search.mode === 'match') {
+        matches.push(entry);
+      } else if (!includedUrls.has(entry.fullUrl)) {
+        includedUrls.add(entry.fullUrl);
+        includes.push(entry);
+      }
+    });
+    return { matches: matches, epochs: matches.map(entry => occurrenceEpochs.get(entry)), next: 0 };
+  });
+
+  const mergedUrls = new Set();
+  const merged = [];
+  for (;;) {
+    let earliest = null;
+    sources.forEach(source => {
+      if (
+        source.next < source.matches.length &&
+        (earliest === null || source.epochs[source.next] < earliest.epochs[earliest.next])
+      ) {
+        earliest = source;
+      }
+    });
+    if (earliest === null) {
+      break;
+    }
+    const entry = earliest.matches[earliest.next++];
+    if (!mergedUrls.has(entry.fullUrl)) {
+      mergedUrls.add(entry.fullUrl);
+      merged.push(entry);
+    }
+  }
+  return {
+    resourceType: 'Bundle',
+    type: 'searchset',
+    total: merged.length,
+    entry: pageOf(merged, page).concat(includes)
+  };
 }
 
-exports.isEntryWithinDateRange = isEntryWithinDateRange;
+exports.firstIndexWhere = firstIndexWhere;
+exports.recordedOrder = recordedOrder;
+exports.recordedWithin = recordedWithin;
+exports.datedEntry = datedEntry;
+exports.createDateIndex = createDateIndex;
+exports.entriesWithinDateRange = entriesWithinDateRange;
+exports.pageOf = pageOf;
+exports.mergeBundles = mergeBundles;
@@ -2,40 +2,77 @@ const { emptyImmunizationFhir } = require('./fhir-responses/empty-immunization.f
 const { SNOMED_PROCEDURE_CODES, IMMUNIZATION_TARGETS } = require('./constants');
 const { covidImmunizationFhir } = require('./fhir-responses/covid-immunization.fhir');
 const { hpvImmunizationFhir } = require('./fhir-responses/hpv-immunization.fhir');
-const { fluImmunizationFhir } = require('./fhir-responses/flu-immunization.fhir')
+const { fluImmunizationFhir } = require('./fhir-responses/flu-immunization.fhir');
+const { mergeBundles } = require('./fhir-responses/response-helper');
 const { parseDateRange, validateDateRange } = require('./date-range');
+const { parsePage, requestUrl, withPageLinks } = require('./paging');
+const { parseProjection, projectBundle } = require('./projection');
+const { parseLastUpdated } = require('./last-updated');
 const { writeLog } = require('../../logging');
+const { isDatasetLoaded, datasetImmunizationFhir } = require('../dataset');
+const { authorisedTargetsOf, isAuthorised } = require('../authorised-targets');
 const { HTTP_STATUS, API_VERSIONS } = require('../constants');
-const { badRequest } = require('../api-response');
+const { badRequest, forbidden } = require('../api-response');
 
 const VERSION = API_VERSIONS.V2;
 
-function getImmunizationResponse(
-  patientIdentifier,
-  procedureCodeBelow,
-  immunizationTarget,
-  dateFrom,
-  dateTo
-) {
-  if (patientIdentifier !== '9000000009') {
-    return emptyImmunizationFhir();
-  }
+const FIXTURES = {
+  [IMMUNIZATION_TARGETS.COVID19]: covidImmunizationFhir,
+  [IMMUNIZATION_TARGETS.HPV]: hpvImmunizationFhir,
+  [IMMUNIZATION_TARGETS.FLU]: fluImmunizationFhir
+};
 
-  if (
-    procedureCodeBelow === SNOMED_PROCEDURE_CODES.CORONAVIRUS_VACCINATION ||
-    immunizationTarget === IMMUNIZATION_TARGETS.COVID19
-  ) {
-    return covidImmunizationFhir(dateFrom, dateTo);
+// The targets in a comma separated immunization.target, without repeats, or null if any is unknown
+function parseTargets(immunizationTarget) {
+  if (typeof immunizationTarget !== 'string') {
+    return null;
   }
+  const targets = immunizationTarget.split(',').map(target => target.trim());
+  return targets.every(target => Object.values(IMMUNIZATION_TARGETS).includes(target))
+    ? Array.from(new Set(targets))
+    : null;
+}
 
-  if (immunizationTarget === IMMUNIZATION_TARGETS.HPV) {
-    return hpvImmunizationFhir(dateFrom, dateTo);
+function targetImmunizationFhir(patientIdentifier, target, dateFrom, dateTo, page, recordedRange) {
+  if (isDatasetLoaded()) {
+    return datasetImmunizationFhir(
+      patientIdentifier,
+      target,
+      dateFrom,
+      dateTo,
+      page,
+      recordedRange
+    );
   }
-
-  if (fluImmunizationFhir === IMMUNIZATION_TARGETS.FLU) {
-    return fluImmunizationFhir(dateFrom, dateTo);
+  if (patientIdentifier !== '9000000009') {
+    return emptyImmunizationFhir();
   }
+  return FIXTURES[target](dateFrom, dateTo, page, recordedRange);
+}
 
+// Immunizations for more than one target are merged into one Bundle, and paged once merged
+function getImmunizationResponse(
+  patientIdentifier,
+  targets,
+  dateFrom,
+  dateTo,
+  page,
+  recordedRange
+) {
+  if (targets.length === 1) {
+    return targetImmunizationFhir(
+      patientIdentifier,
+      targets[0],
+      dateFrom,
+      dateTo,
+      page,
+      recordedRange
+    );
+  }
+  const bundles = targets.map(target =>
+    targetImmunizationFhir(patientIdentifier, target, dateFrom, dateTo, null, recordedRange)
+  );
+  return mergeBundles(bundles, page);
 }
 
 function getFhirResponse(
@@ -43,7 +80,14 @@ function getFhirResponse(
   procedureCodeBelow,
   immunizationTarget,
   rawDateFrom,
-  rawDateTo
+  rawDateTo,
+  rawLastUpdated,
+  rawCount,
+  rawCursor,
+  rawElements,
+  rawSummary,
+  url,
+  authorisedTargets
 ) {
   if (!patientIdentifier) {
     return badRequest('Missing required request parameters: [patient.identifier]', VERSION);
@@ -56,7 +100,10 @@ function getFhirResponse(
     );
   }
 
-  if (immunizationTarget && !Object.values(IMMUNIZATION_TARGETS).includes(immunizationTarget)) {
+  const targets = procedureCodeBelow
+    ? [IMMUNIZATION_TARGETS.COVID19]
+    : parseTargets(immunizationTarget);
+  if (!targets) {
     return badRequest(
       'Missing or invalid required request parameters: [procedure-code:below] OR [immunization.target]',
       VERSION
@@ -75,15 +122,44 @@ function getFhirResponse(
     return badRequest(errorMessage, VERSION);
   }
 
+  const { recordedRange, errorMessage: lastUpdatedErrorMessage } = parseLastUpdated(rawLastUpdated);
+  if (lastUpdatedErrorMessage) {
+    return badRequest(lastUpdatedErrorMessage, VERSION);
+  }
+
+  const { page, errorMessage: pageErrorMessage } = parsePage(rawCount, rawCursor);
+  if (pageErrorMessage) {
+    return badRequest(pageErrorMessage, VERSION);
+  }
+
+  const { projection, errorMessage: projectionErrorMessage } = parseProjection(
+    rawElements,
+    rawSummary
+  );
+  if (projectionErrorMessage) {
+    return badRequest(projectionErrorMessage, VERSION);
+  }
+
+  // Targets that the app isn't authorised for are left out, as long as there are others
+  const authorised = targets.filter(target => isAuthorised(authorisedTargets, target));
+  if (authorised.length === 0) {
+    return forbidden(`Not authorised for immunization target: ${targets.join(',')}`, VERSION);
+  }
+
+  let bundle = getImmunizationResponse(
+    patientIdentifier,
+    authorised,
+    dateFrom,
+    dateTo,
+    page,
+    recordedRange
+  );
+  if (projection) {
+    bundle = projectBundle(bundle, projection);
+  }
   return {
     status: HTTP_STATUS.OK,
-    response: getImmunizationResponse(
-      patientIdentifier,
-      procedureCodeBelow,
-      immunizationTarget,
-      dateFrom,
-      dateTo
-    ),
+    response: page ? withPageLinks(bundle, url, page) : bundle,
     headers: {
       version: VERSION
     }
@@ -96,29 +172,52 @@ function immunisationGetHandler(req, res) {
   const immunizationTarget = req.query['immunization.target'];
   const rawDateFrom = req.query['date.from'];
   const rawDateTo = req.query['date.to'];
+  const rawLastUpdated = req.query['_lastUpdated'];
+  const rawCount = req.query['_count'];
+  const rawCursor = req.query['_cursor'];
+  const rawElements = req.query['_elements'];
+  const rawSummary = req.query['_summary'];
+  const authorisedTargets = authorisedTargetsOf(req);
 
   writeLog(res, 'info', {
     message: 'immunization',
     req: {
       path: req.path,
-      query: req.query,
-      headers: req.rawHeaders,
       patientIdentifier: patientIdentifier,
       procedureCodeBelow: procedureCodeBelow,
       immunizationTarget: immunizationTarget,
       rawDateFrom: rawDateFrom,
       rawDateTo: rawDateTo,
+      rawLastUpdated: rawLastUpdated,
+      rawCount: rawCount,
+      rawCursor: rawCursor,
+      rawElements: rawElements,
+      rawSummary: rawSummary,
       version: VERSION,
       accept: req.headers['accept']
     }
   });
+  writeLog(res, 'debug', {
+    message: 'immunization request',
+    req: {
+      query: req.query,
+      headers: req.rawHeaders
+    }
+  });
 
   return getFhirResponse(
     patientIdentifier,
     procedureCodeBelow,
     immunizationTarget,
     rawDateFrom,
-    rawDateTo
+    rawDateTo,
+    rawLastUpdated,
+    rawCount,
+    rawCursor,
+    rawElements,
+    rawSummary,
+    requestUrl(req),
+    authorisedTargets
   );
 }
 
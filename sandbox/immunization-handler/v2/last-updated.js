@@ -0,0 +1,72 @@
+const moment = require('moment');
+
+const { SK_DATE_FORMAT } = require('./constants');
+
+// _lastUpdated searches on when immunizations were recorded, which can be long after they occurred,
+// so that clients that poll for changes only get the immunizations recorded since they last did.
+// It takes a date or a dateTime with a timezone, with one of FHIR's gt, ge, lt, le or eq prefixes,
+// and can be given more than once to search between two of them.
+const LAST_UPDATED = /^(gt|ge|lt|le|eq)?(\d{4}-\d{2}-\d{2}(T.*)?)$/;
+
+// A dateTime stands for the whole of the second, or millisecond, that it gives
+const DATE_TIME_FORMATS = [
+  ['YYYY-MM-DDTHH:mm:ssZ', 'second'],
+  ['YYYY-MM-DDTHH:mm:ss.SSSZ', 'millisecond']
+];
+
+// The first and last epochs of the date or dateTime in `value`, or null if it isn't valid
+function parseInstants(value, hasTime) {
+  const formats = hasTime ? DATE_TIME_FORMATS : [[SK_DATE_FORMAT, 'day']];
+  for (let i = 0; i < formats.length; i++) {
+    const [format, precision] = formats[i];
+    const date = moment(value, format, true);
+    if (date.isValid()) {
+      return {
+        first: date.clone().startOf(precision).valueOf(),
+        last: date.clone().endOf(precision).valueOf()
+      };
+    }
+  }
+  return null;
+}
+
+// Narrows `range` down to the epochs that one _lastUpdated value matches, false if it isn't valid
+function narrowRange(range, value) {
+  const match = typeof value === 'string' && LAST_UPDATED.exec(value);
+  const instants = match && parseInstants(match[2], match[3] !== undefined);
+  if (!instants) {
+    return false;
+  }
+  const prefix = match[1] || 'eq';
+  if (prefix === 'gt') {
+    range.from = Math.max(range.from, instants.last + 1);
+  } else if (prefix === 'ge' || prefix === 'eq') {
+    range.from = Math.max(range.from, instants.first);
+  }
+  if (prefix === 'lt') {
+    range.to = Math.min(range.to, instants.first - 1);
+  } else if (prefix === 'le' || prefix === 'eq') {
+    range.to = Math.min(range.to, instants.last);
+  }
+  return true;
+}
+
+// The recorded epochs, from and to inclusive, that _lastUpdated searches for, null without it
+function parseLastUpdated(rawLastUpdated) {
+  if (rawLastUpdated === undefined) {
+    return { recordedRange: null };
+  }
+  const range = { from: -Infinity, to: Infinity };
+  if (![].concat(rawLastUpdated).every(value => narrowRange(range, value))) {
+    return { errorMessage: 'Invalid request parameters: [_lastUpdated]' };
+  }
+  return { recordedRange: range };
+}
+
+// When an immunization was recorded, NaN if it wasn't
+function recordedEpoch(immunization) {
+  return immunization.recorded ? moment(immunization.recorded).valueOf() : NaN;
+}
+
+exports.parseLastUpdated = parseLastUpdated;
+exports.recordedEpoch = recordedEpoch;
@@ -0,0 +1,70 @@
+const MAX_COUNT = 1000;
+
+// Cursors are opaque to clients: the position of the page's first immunization, base64url encoded
+function encodeCursor(offset) {
+  return Buffer.from(String(offset))
+    .toString('base64')
+    .replace(/\+/g, '-')
+    .replace(/\//g, '_')
+    .replace(/=+$/, '');
+}
+
+function decodeCursor(cursor) {
+  const offset = Buffer.from(cursor.replace(/-/g, '+').replace(/_/g, '/'), 'base64').toString();
+  return /^(0|[1-9]\d*)$/.test(offset) ? Number(offset) : NaN;
+}
+
+// The page asked for with _count and _cursor, null when the response isn't paged
+function parsePage(rawCount, rawCursor) {
+  if (rawCount === undefined && rawCursor === undefined) {
+    return { page: null };
+  }
+  const count = /^[1-9]\d*$/.test(rawCount) ? Number(rawCount) : NaN;
+  if (!(count <= MAX_COUNT)) {
+    return { errorMessage: 'Invalid request parameters: [_count]' };
+  }
+  const offset = rawCursor === undefined ? 0 : decodeCursor(String(rawCursor));
+  if (isNaN(offset)) {
+    return { errorMessage: 'Invalid request parameters: [_cursor]' };
+  }
+  return { page: { offset: offset, count: count } };
+}
+
+// The URL that the client requested, which the proxy passes on in X-Request-Url
+function requestUrl(req) {
+  return req.headers['x-request-url'] || `${req.protocol}://${req.get('host')}${req.originalUrl}`;
+}
+
+function pageUrl(url, offset) {
+  const paged = new URL(url);
+  if (offset > 0) {
+    paged.searchParams.set('_cursor', encodeCursor(offset));
+  } else {
+    paged.searchParams.delete('_cursor');
+  }
+  return paged.toString();
+}
+
+// Adds self, next and previous links to a page of a searchset Bundle
+function withPageLinks(bundle, url, page) {
+  const link = [{ relation: 'self', url: url }];
+  if (page.offset + page.count < bundle.total) {
+    link.push({ relation: 'next', url: pageUrl(url, page.offset + page.count) });
+  }
+  if (page.offset > 0) {
+    const previous = Math.max(Math.min(page.offset, bundle.total) - page.count, 0);
+    link.push({ relation: 'previous', url: pageUrl(url, previous) });
+  }
+  return {
+    resourceType: bundle.resourceType,
+    type: bundle.type,
+    total: bundle.total,
+    link: link,
+    entry: bundle.entry
+  };
+}
+
+exports.MAX_COUNT = MAX_COUNT;
+exports.parsePage = parsePage;
+exports.requestUrl = requestUrl;
+exports.withPageLinks = withPageLinks;
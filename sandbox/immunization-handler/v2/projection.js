@@ -0,0 +1,122 @@
+// Elements that are always returned, whatever is asked for, along with resourceType, id and meta:
+// FHIR has servers return an Immunization's mandatory (1..1) elements and its modifiers with _elements
+const MANDATORY_ELEMENTS = [
+  'status',
+  'vaccineCode',
+  'patient',
+  'occurrenceDateTime',
+  'occurrenceString',
+  'modifierExtension'
+];
+
+// The elements of an Immunization that FHIR R4 marks as part of its summary
+const SUMMARY_ELEMENTS = [
+  'identifier',
+  'status',
+  'vaccineCode',
+  'patient',
+  'occurrenceDateTime',
+  'occurrenceString',
+  'primarySource',
+  'performer',
+  'isSubpotent'
+];
+
+const SUBSETTED_TAG = {
+  system: 'http://terminology.hl7.org/CodeSystem/v3-ObservationValue',
+  code: 'SUBSETTED',
+  display: 'Resource encoded in summary mode'
+};
+
+const ELEMENT_NAME = /^[a-z][A-Za-z0-9]*$/;
+
+// Returns a function that prunes a resource down to `elements`, tagging it as subsetted
+function compileProjection(elements) {
+  const keep = Array.from(new Set(MANDATORY_ELEMENTS.concat(elements))).filter(
+    element => !['resourceType', 'id', 'meta'].includes(element)
+  );
+  return resource => {
+    const meta = resource.meta || {};
+    const projected = { resourceType: resource.resourceType };
+    if (resource.id !== undefined) {
+      projected.id = resource.id;
+    }
+    projected.meta = Object.assign({}, meta, { tag: (meta.tag || []).concat(SUBSETTED_TAG) });
+    for (let i = 0; i < keep.length; i++) {
+      const element = keep[i];
+      if (resource[element] !== undefined) {
+        projected[element] = resource[element];
+      }
+    }
+    return projected;
+  };
+}
+
+const summaryProjection = compileProjection(SUMMARY_ELEMENTS);
+
+// Clients send the same few _elements lists over and over, so each is only compiled the first time
+const PROJECTION_CACHE_SIZE = 64;
+const MAX_CACHED_ELEMENTS_LENGTH = 256;
+const projectionCache = new Map();
+
+function elementsProjection(rawElements) {
+  if (projectionCache.has(rawElements)) {
+    return projectionCache.get(rawElements);
+  }
+  const elements = rawElements.split(',').map(element => element.trim());
+  const projection = elements.every(element => ELEMENT_NAME.test(element))
+    ? compileProjection(elements)
+    : null;
+  if (rawElements.length <= MAX_CACHED_ELEMENTS_LENGTH) {
+    if (projectionCache.size >= PROJECTION_CACHE_SIZE) {
+      projectionCache.delete(projectionCache.keys().next().value);
+    }
+    projectionCache.set(rawElements, projection);
+  }
+  return projection;
+}
+
+// The projection asked for with _elements or _summary, null to return immunizations in full
+function parseProjection(rawElements, rawSummary) {
+  if (rawElements !== undefined && rawSummary !== undefined) {
+    return {
+      errorMessage: 'Invalid request parameters: [_elements] and [_summary] cannot be used together'
+    };
+  }
+  if (rawSummary !== undefined) {
+    if (rawSummary === 'true') {
+      return { projection: summaryProjection };
+    }
+    if (rawSummary === 'false') {
+      return { projection: null };
+    }
+    return { errorMessage: 'Invalid request parameters: [_summary]' };
+  }
+  if (rawElements !== undefined) {
+    const projection = typeof rawElements === 'string' ? elementsProjection(rawElements) : null;
+    if (!projection) {
+      return { errorMessage: 'Invalid request parameters: [_elements]' };
+    }
+    return { projection: projection };
+  }
+  return { projection: null };
+}
+
+// Applies a projection to the immunizations in a searchset Bundle. The patient included with them
+// is small and returned in full.
+function projectBundle(bundle, projection) {
+  return Object.assign({}, bundle, {
+    entry: bundle.entry.map(entry =>
+      entry.search.mode === 'match'
+        ? {
+            fullUrl: entry.fullUrl,
+            resource: projection(entry.resource),
+            search: entry.search
+          }
+        : entry
+    )
+  });
+}
+
+exports.parseProjection = parseProjection;
+exports.projectBundle = projectBundle;
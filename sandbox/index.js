@@ -1,10 +1,8 @@
 'use strict';
 
-const app = require('./app');
-
-app.setup(process.env);
-
-const server = app.start(process.env);
+const cluster = require('cluster');
+const { startPrimary, workerCount } = require('./cluster');
+const { loadDataset } = require('./immunization-handler/dataset');
 
 const signals = {
   SIGHUP: 1,
@@ -12,19 +10,49 @@ const signals = {
   SIGTERM: 15
 };
 
-const shutdown = (signal, value) => {
-  console.log('shutdown!');
-  server.close(() => {
-    console.log(`server stopped by ${signal} with value ${value}`);
-    process.exit(128 + value);
+function startServer() {
+  const app = require('./app');
+
+  app.setup(process.env);
+
+  let server = null;
+
+  const shutdown = (signal, value) => {
+    console.log('shutdown!');
+    if (!server) {
+      process.exit(128 + value);
+    }
+    server.close(() => {
+      console.log(`server stopped by ${signal} with value ${value}`);
+      process.exit(128 + value);
+    });
+  };
+
+  Object.keys(signals).forEach(signal => {
+    process.on(signal, () => {
+      console.log(`process received a ${signal} signal`);
+      shutdown(signal, signals[signal]);
+    });
   });
-};
 
-Object.keys(signals).forEach(signal => {
-  process.on(signal, () => {
-    console.log(`process received a ${signal} signal`);
-    shutdown(signal, signals[signal]);
+  // Requests are only accepted once the dataset, if there is one, is loaded
+  return loadDataset(process.env.SANDBOX_DATASET).then(() => {
+    server = app.start(process.env);
+    return server;
   });
-});
+}
 
-module.exports = { server: server };
+// With WORKERS set to a number, or to auto for one per CPU that the container may use, this
+// process forks that many workers and manages them, see cluster.js; otherwise, and in each worker,
+// it serves requests itself
+if (cluster.isMaster && workerCount(process.env.WORKERS) > 1) {
+  startPrimary(process.env).catch(err => {
+    console.log(`failed to start workers: ${err.message}`);
+    process.exit(1);
+  });
+} else {
+  startServer().catch(err => {
+    console.log(`failed to start server: ${err.message}`);
+    process.exit(1);
+  });
+}
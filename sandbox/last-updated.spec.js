@@ -0,0 +1,46 @@
+const assert = require("chai").assert;
+const moment = require("moment");
+
+const { parseLastUpdated } = require("./immunization-handler/v2/last-updated");
+
+describe("_lastUpdated tests", function () {
+    const range = rawLastUpdated => parseLastUpdated(rawLastUpdated).recordedRange;
+    const startOfDay = date => moment(date, "YYYY-MM-DD", true).valueOf();
+
+    it("searches every immunization without _lastUpdated", () => {
+        assert.deepEqual(parseLastUpdated(undefined), { recordedRange: null });
+    });
+
+    it("searches the whole of a day, or from or to it, depending on the prefix", () => {
+        const day = startOfDay("2021-02-14");
+        const nextDay = startOfDay("2021-02-15");
+
+        assert.deepEqual(range("2021-02-14"), { from: day, to: nextDay - 1 });
+        assert.deepEqual(range("eq2021-02-14"), { from: day, to: nextDay - 1 });
+        assert.deepEqual(range("gt2021-02-14"), { from: nextDay, to: Infinity });
+        assert.deepEqual(range("ge2021-02-14"), { from: day, to: Infinity });
+        assert.deepEqual(range("lt2021-02-14"), { from: -Infinity, to: day - 1 });
+        assert.deepEqual(range("le2021-02-14"), { from: -Infinity, to: nextDay - 1 });
+    });
+
+    it("searches from or to an instant for a dateTime", () => {
+        const instant = Date.parse("2021-02-14T10:30:00.250Z");
+
+        assert.deepEqual(range("gt2021-02-14T10:30:00.250Z"), { from: instant + 1, to: Infinity });
+        assert.deepEqual(range("ge2021-02-14T10:30:00Z"), { from: instant - 250, to: Infinity });
+        assert.deepEqual(range("le2021-02-14T10:30:00Z"), { from: -Infinity, to: instant + 749 });
+    });
+
+    it("searches between the values when it's given more than once", () => {
+        assert.deepEqual(range(["ge2021-01-01", "lt2021-02-01"]), {
+            from: startOfDay("2021-01-01"),
+            to: startOfDay("2021-02-01") - 1
+        });
+    });
+
+    it("rejects invalid _lastUpdated values", () => {
+        ["", "2021-02-30", "ne2021-02-14", "gt2021-02-14T10:30:00", "gt2021-02", ["gt2021-01-01", "lt"]].forEach(value =>
+            assert.equal(parseLastUpdated(value).errorMessage, "Invalid request parameters: [_lastUpdated]")
+        );
+    });
+});
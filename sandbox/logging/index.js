@@ -1,7 +1,82 @@
 const log = require('loglevel');
 
+const MAX_BATCH_SIZE = 500;
+
+// Collects log entries and writes them out together once the current turn of the event loop is done,
+// so that serialising and writing them is kept off the path of the request that logged them
+class LogWriter {
+  constructor(stream, maxBatchSize) {
+    this.stream = stream;
+    this.maxBatchSize = maxBatchSize;
+    this.entries = [];
+    this.scheduled = false;
+  }
+
+  write(entry) {
+    this.entries.push(entry);
+    if (this.entries.length >= this.maxBatchSize) {
+      this.flush();
+    } else if (!this.scheduled) {
+      this.scheduled = true;
+      setImmediate(() => this.flush());
+    }
+  }
+
+  flush() {
+    this.scheduled = false;
+    if (this.entries.length === 0) {
+      return;
+    }
+    const lines = this.entries.map(entry => JSON.stringify(entry)).join('\n') + '\n';
+    this.entries = [];
+    this.stream.write(lines);
+  }
+}
+
+// As when entries went through loglevel, warnings and errors are written to stderr and the rest to stdout
+const STDERR_LEVELS = new Set(['warn', 'error']);
+const stdoutWriter = new LogWriter(process.stdout, MAX_BATCH_SIZE);
+const stderrWriter = new LogWriter(process.stderr, MAX_BATCH_SIZE);
+
+const logWriter = {
+  write(entry) {
+    (STDERR_LEVELS.has(entry.level) ? stderrWriter : stdoutWriter).write(entry);
+  },
+  flush() {
+    stdoutWriter.flush();
+    stderrWriter.flush();
+  }
+};
+process.on('exit', () => logWriter.flush());
+
+let sampleRate = 1;
+
+// The fraction of successful requests that are logged; errors and warnings are always logged
+function setSampleRate(rate) {
+  const parsed = Number(rate);
+  sampleRate = isNaN(parsed) ? 1 : Math.min(Math.max(parsed, 0), 1);
+}
+
+function isSampled() {
+  return sampleRate >= 1 || Math.random() < sampleRate;
+}
+
+function isEnabled(log_level) {
+  return log.getLevel() <= log.levels[log_level.toUpperCase()];
+}
+
+function isRequestLogged(res, log_level) {
+  if (log_level === 'warn' || log_level === 'error') {
+    return true;
+  }
+  if (res.locals.log_sampled === undefined) {
+    res.locals.log_sampled = isSampled();
+  }
+  return res.locals.log_sampled;
+}
+
 const writeLog = (res, log_level, options = {}) => {
-  if (log.getLevel() > log.levels[log_level.toUpperCase()]) {
+  if (!isEnabled(log_level) || !isRequestLogged(res, log_level)) {
     return;
   }
   if (typeof options === 'function') {
@@ -31,7 +106,12 @@ const writeLog = (res, log_level, options = {}) => {
     };
   }
 
-  log[log_level](JSON.stringify(log_line));
+  logWriter.write(log_line);
 };
 
 exports.writeLog = writeLog;
+exports.logWriter = logWriter;
+exports.LogWriter = LogWriter;
+exports.setSampleRate = setSampleRate;
+exports.isEnabled = isEnabled;
+exports.isRequestLogged = isRequestLogged;
@@ -0,0 +1,55 @@
+const assert = require("chai").assert;
+const moment = require("moment");
+
+const { parseProjection, projectBundle } = require("./immunization-handler/v2/projection");
+const { hpvImmunizationFhir } = require("./immunization-handler/v2/fhir-responses/hpv-immunization.fhir");
+
+describe("projection tests", function () {
+    const bundle = hpvImmunizationFhir(moment("0001-01-01"), moment("9999-12-31"));
+    const project = (rawElements, rawSummary) => projectBundle(bundle, parseProjection(rawElements, rawSummary).projection);
+    const matches = projected => projected.entry.filter(entry => entry.search.mode === "match");
+    const isSubsetted = resource => resource.meta.tag.some(tag => tag.code === "SUBSETTED");
+
+    it("keeps only the elements asked for, and the ones that are always returned", () => {
+        matches(project("vaccineCode,occurrenceDateTime, status")).forEach(entry => {
+            assert.deepEqual(Object.keys(entry.resource), ["resourceType", "meta", "status", "vaccineCode", "patient", "occurrenceDateTime"]);
+            assert.isTrue(isSubsetted(entry.resource));
+        });
+    });
+
+    it("keeps the mandatory elements when they aren't asked for", () => {
+        matches(project("lotNumber")).forEach(entry => {
+            assert.deepEqual(Object.keys(entry.resource), ["resourceType", "meta", "status", "vaccineCode", "patient", "occurrenceDateTime", "lotNumber"]);
+        });
+    });
+
+    it("keeps the summary elements for _summary=true", () => {
+        matches(project(undefined, "true")).forEach(entry => {
+            assert.includeMembers(Object.keys(entry.resource), ["identifier", "status", "vaccineCode", "patient", "occurrenceDateTime"]);
+            assert.notProperty(entry.resource, "extension");
+            assert.notProperty(entry.resource, "lotNumber");
+            assert.isTrue(isSubsetted(entry.resource));
+        });
+    });
+
+    it("leaves the included patient and the fixtures as they are", () => {
+        const before = JSON.stringify(bundle);
+        const projected = project("status");
+
+        assert.equal(projected.total, bundle.total);
+        assert.deepEqual(projected.entry[projected.entry.length - 1], bundle.entry[bundle.entry.length - 1]);
+        assert.equal(JSON.stringify(bundle), before);
+    });
+
+    it("returns immunizations in full without _elements or with _summary=false", () => {
+        assert.deepEqual(parseProjection(undefined, undefined), { projection: null });
+        assert.deepEqual(parseProjection(undefined, "false"), { projection: null });
+    });
+
+    it("rejects invalid _elements and _summary values", () => {
+        assert.equal(parseProjection("", undefined).errorMessage, "Invalid request parameters: [_elements]");
+        assert.equal(parseProjection("status;lotNumber", undefined).errorMessage, "Invalid request parameters: [_elements]");
+        assert.equal(parseProjection(undefined, "count").errorMessage, "Invalid request parameters: [_summary]");
+        assert.isDefined(parseProjection("status", "true").errorMessage);
+    });
+});
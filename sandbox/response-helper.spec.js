@@ -0,0 +1,89 @@
+const assert = require("chai").assert;
+const moment = require("moment");
+
+const {
+    createDateIndex, datedEntry, entriesWithinDateRange, mergeBundles
+} = require("./immunization-handler/v2/fhir-responses/response-helper");
+
+describe("date index tests", function () {
+    const entry = (id, occurrenceDateTime) => ({ fullUrl: id, resource: { occurrenceDateTime } });
+    const entries = [
+        entry("c", "2020-12-25T13:00:08.476+00:00"),
+        entry("a", "2020-12-10T13:00:08.476+00:00"),
+        entry("b", "2020-12-23T00:00:00.000+00:00"),
+        entry("d", "2021-08-02T12:46:16.019+00:00")
+    ];
+    const dateIndex = createDateIndex(entries);
+    const ids = (from, to) =>
+        entriesWithinDateRange(dateIndex, moment(from, "YYYY-MM-DD", true), moment(to, "YYYY-MM-DD", true))
+            .map(e => e.fullUrl);
+
+    it("returns every entry, in date order, for an open range", () => {
+        assert.deepEqual(ids("0001-01-01", "9999-12-31"), ["a", "b", "c", "d"]);
+    });
+
+    it("includes entries on the boundaries of the range", () => {
+        assert.deepEqual(ids("2020-12-23", "2020-12-25"), ["b"]);
+        assert.deepEqual(ids("2020-12-10", "2021-08-03"), ["a", "b", "c", "d"]);
+    });
+
+    it("returns only the entries recorded within a recorded range", () => {
+        const recorded = (id, occurrenceDateTime, recorded) => ({ fullUrl: id, resource: { occurrenceDateTime, recorded } });
+        const recordedIndex = createDateIndex([
+            recorded("a", "2020-12-10T13:00:08.476+00:00", "2021-01-20"),
+            recorded("b", "2020-12-23T00:00:00.000+00:00", "2020-12-23"),
+            recorded("c", "2020-12-25T13:00:08.476+00:00")
+        ]);
+        const recordedIds = recordedRange =>
+            entriesWithinDateRange(recordedIndex, moment("0001-01-01", "YYYY-MM-DD", true), moment("9999-12-31", "YYYY-MM-DD", true), recordedRange)
+                .map(e => e.fullUrl);
+        const epoch = date => moment(date).valueOf();
+
+        assert.deepEqual(recordedIds({ from: epoch("2021-01-01"), to: Infinity }), ["a"]);
+        assert.deepEqual(recordedIds({ from: -Infinity, to: epoch("2021-01-01") }), ["b"]);
+        assert.deepEqual(recordedIds({ from: -Infinity, to: Infinity }), ["a", "b"]);
+    });
+
+    it("returns no entries for a range with none in it", () => {
+        assert.deepEqual(ids("2021-01-01", "2021-08-01"), []);
+        assert.deepEqual(ids("2022-01-01", "2023-01-01"), []);
+        assert.deepEqual(ids("2021-01-01", "2020-01-01"), []);
+    });
+});
+
+describe("merged bundle tests", function () {
+    // Immunizations are dated when they're indexed, as the built-in responses' are
+    const match = (id, occurrenceDateTime) =>
+        createDateIndex([{ fullUrl: id, resource: { occurrenceDateTime }, search: { mode: "match" } }]).entries[0];
+    const patient = { fullUrl: "p", resource: { resourceType: "Patient" }, search: { mode: "include" } };
+    const bundle = (...entry) => ({ resourceType: "Bundle", type: "searchset", total: entry.length - 1, entry });
+    const covid = bundle(match("c1", "2020-12-10T13:00:08.476+00:00"), match("c2", "2021-08-02T12:46:16.019+00:00"), patient);
+    const flu = bundle(match("f1", "2020-10-01T09:00:00.000+00:00"), match("c2", "2021-08-02T12:46:16.019+00:00"), patient);
+    const ids = merged => merged.entry.map(e => e.fullUrl);
+
+    it("merges the immunizations in date order, with each resource once and the patient last", () => {
+        const merged = mergeBundles([covid, flu], null);
+
+        assert.deepEqual(ids(merged), ["f1", "c1", "c2", "p"]);
+        assert.equal(merged.total, 3);
+    });
+
+    it("merges by the dates that the immunizations were indexed with, without parsing them again", () => {
+        // It has no occurrenceDateTime to parse, only the date it was read with
+        const dated = datedEntry({ fullUrl: "d", resource: {}, search: { mode: "match" } }, moment("2021-01-01").valueOf());
+
+        assert.deepEqual(ids(mergeBundles([covid, bundle(dated, patient)], null)), ["c1", "d", "c2", "p"]);
+    });
+
+    it("pages the merged immunizations", () => {
+        const merged = mergeBundles([covid, flu], { offset: 1, count: 1 });
+
+        assert.deepEqual(ids(merged), ["c1", "p"]);
+        assert.equal(merged.total, 3);
+    });
+
+    it("merges empty bundles into an empty bundle", () => {
+        const empty = { resourceType: "Bundle", type: "searchset", total: 0, entry: [] };
+        assert.deepEqual(mergeBundles([empty, empty], null), empty);
+    });
+});
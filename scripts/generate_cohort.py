@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+
+"""
+generate_cohort.py
+
+Writes a synthetic cohort of patients and their immunisation histories as NDJSON, in the layout
+that the sandbox loads with SANDBOX_DATASET: Patient.ndjson and one Immunization.<TARGET>.ndjson
+per target. Resources start from the examples in the specification's schemas, and the same seed
+always gives the same files.
+
+Usage:
+  generate_cohort.py OUT_DIR [options]
+
+Options:
+  --patients=<n>        Number of patients [default: 1000]
+  --seed=<seed>         Seed for everything that varies between records [default: 0]
+  --targets=<targets>   Comma separated immunisation targets [default: COVID19,HPV,FLU]
+  --min-history=<n>     Fewest immunisations per patient and target [default: 0]
+  --max-history=<n>     Most immunisations per patient and target [default: 5]
+  --schemas=<dir>       Schemas to build resources from [default: specification/components/schemas]
+"""
+import datetime
+import json
+import os.path
+import random
+import string
+import uuid
+from contextlib import ExitStack
+
+import yaml
+from docopt import docopt
+
+from generate_examples import generate_resource_example
+
+NHS_NUMBER_SYSTEM = "https://fhir.nhs.uk/Id/nhs-number"
+
+# What each target's immunisations are, and when: the first is given some time from `start`,
+# and each one after is `interval` days after the one before it
+TARGETS = {
+    "COVID19": {
+        "procedure": (
+            "1324681000000101",
+            "Administration of first dose of severe acute respiratory syndrome coronavirus 2 vaccine (procedure)",
+        ),
+        "vaccine": (
+            "39114911000001105",
+            "COVID-19 Vaccine AstraZeneca (ChAdOx1 S [recombinant]) 5x10,000,000,000 viral particles/0.5ml dose "
+            "solution for injection multidose vials (AstraZeneca UK Ltd) (product)",
+        ),
+        "manufacturer": "AstraZeneca Ltd",
+        "start": datetime.date(2020, 12, 8),
+        "interval": (56, 182),
+    },
+    "HPV": {
+        "procedure": (
+            "149481000000105",
+            "Administration of vaccine product containing only Human papillomavirus 6, 11, 16, 18, 31, 33, 45, 52 "
+            "and 58 antigens (procedure)",
+        ),
+        "vaccine": (
+            "12238911000001100",
+            "Cervarix vaccine suspension for injection 0.5ml pre-filled syringes (GlaxoSmithKline) (product)",
+        ),
+        "manufacturer": "GlaxoSmithKline UK Ltd",
+        "start": datetime.date(2008, 9, 1),
+        "interval": (182, 365),
+    },
+    "FLU": {
+        "procedure": (
+            "884861000000100",
+            "Administration of first intranasal seasonal influenza vaccination (procedure)",
+        ),
+        "vaccine": (
+            "22704311000001108",
+            "Fluarix Tetra vaccine suspension for injection 0.5ml pre-filled syringes (GlaxoSmithKline UK Ltd) "
+            "(product)",
+        ),
+        "manufacturer": "GlaxoSmithKline UK Ltd",
+        "start": datetime.date(2010, 9, 1),
+        "interval": (330, 400),
+    },
+}
+
+EARLIEST_BIRTH_DATE = datetime.date(1930, 1, 1)
+LATEST_BIRTH_DATE = datetime.date(2010, 12, 31)
+
+
+def load_example(schemas_dir, name):
+    """The example resource for a schema, as JSON, which is quicker to copy from than a dict"""
+    with open(os.path.join(schemas_dir, name + ".yaml"), "r") as schema_file:
+        schema = yaml.safe_load(schema_file)
+    return json.dumps(generate_resource_example(schema["properties"], [name]))
+
+
+def new_resource(example, rng):
+    """A copy of an example resource with an id of its own"""
+    resource = json.loads(example)
+    # meta only tags resources that have had elements left out of them
+    resource.pop("meta", None)
+    return {"resourceType": resource.pop("resourceType"), "id": random_uuid(rng), **resource}
+
+
+def nhs_numbers():
+    """
+    Valid NHS numbers in the 900 000 000x test range, in order
+
+    The check digit is 11 minus the weighted sum of the first nine digits modulo 11, where a result of
+    11 is a check digit of 0 and one of 10 means that the nine digits aren't used.
+    """
+    for body in range(900000000, 1000000000):
+        digits = str(body)
+        check = 11 - sum(int(digit) * (10 - i) for i, digit in enumerate(digits)) % 11
+        if check == 11:
+            check = 0
+        if check != 10:
+            yield f"{digits}{check}"
+
+
+def random_date(rng, earliest, latest):
+    return earliest + datetime.timedelta(days=rng.randint(0, (latest - earliest).days))
+
+
+def random_uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def random_code(rng, length):
+    return "".join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(length))
+
+
+def generate_patient(example, rng, nhs_number):
+    patient = new_resource(example, rng)
+    patient["identifier"] = [{"system": NHS_NUMBER_SYSTEM, "value": nhs_number}]
+    patient["birthDate"] = random_date(rng, EARLIEST_BIRTH_DATE, LATEST_BIRTH_DATE).isoformat()
+    return patient
+
+
+def generate_immunizations(example, rng, patient, target, count):
+    """A patient's `count` immunisations for a target, in date order"""
+    details = TARGETS[target]
+    occurred = random_date(rng, details["start"], details["start"] + datetime.timedelta(days=365))
+    for dose in range(1, count + 1):
+        immunization = new_resource(example, rng)
+        occurrence = datetime.datetime.combine(occurred, datetime.time()) + datetime.timedelta(
+            seconds=rng.randint(8 * 3600, 18 * 3600)
+        )
+        primary_source = rng.random() < 0.9
+
+        immunization["extension"][0]["valueCodeableConcept"]["coding"][0].update(
+            {"code": details["procedure"][0], "display": details["procedure"][1]}
+        )
+        immunization["identifier"][0]["value"] = str(rng.randrange(10 ** 15, 10 ** 16))
+        immunization["vaccineCode"]["coding"][0].update(
+            {"code": details["vaccine"][0], "display": details["vaccine"][1]}
+        )
+        immunization["patient"]["reference"] = f"urn:uuid:{patient['id']}"
+        immunization["patient"]["identifier"]["value"] = patient["identifier"][0]["value"]
+        immunization["occurrenceDateTime"] = f"{occurrence.isoformat()}.000+00:00"
+        immunization["recorded"] = (occurred + datetime.timedelta(days=rng.randint(0, 30))).isoformat()
+        immunization["primarySource"] = primary_source
+        if primary_source:
+            immunization.pop("reportOrigin", None)
+        immunization["manufacturer"]["display"] = details["manufacturer"]
+        immunization["lotNumber"] = random_code(rng, 4)
+        immunization["expirationDate"] = (occurred + datetime.timedelta(days=rng.randint(30, 365))).isoformat()
+        immunization["performer"][0]["actor"]["identifier"]["value"] = random_code(rng, 5)
+        immunization["protocolApplied"] = [{"doseNumberPositiveInt": dose}]
+        yield immunization
+
+        occurred += datetime.timedelta(days=rng.randint(*details["interval"]))
+
+
+def write_ndjson(out_file, resource):
+    out_file.write(json.dumps(resource, separators=(",", ":")))
+    out_file.write("\n")
+
+
+def main(arguments):
+    """Program entry point"""
+    out_dir = arguments["OUT_DIR"]
+    patients = int(arguments["--patients"])
+    seed = arguments["--seed"]
+    targets = arguments["--targets"].split(",")
+    min_history = int(arguments["--min-history"])
+    max_history = int(arguments["--max-history"])
+
+    unknown_targets = set(targets) - set(TARGETS)
+    if unknown_targets:
+        raise SystemExit(f"unknown targets: {', '.join(sorted(unknown_targets))}")
+    if not 0 <= min_history <= max_history:
+        raise SystemExit("--min-history must be at least 0 and at most --max-history")
+
+    patient_example = load_example(arguments["--schemas"], "Patient")
+    immunization_example = load_example(arguments["--schemas"], "Immunization")
+
+    os.makedirs(out_dir, exist_ok=True)
+    with ExitStack() as stack:
+        patient_file = stack.enter_context(open(os.path.join(out_dir, "Patient.ndjson"), "w"))
+        immunization_files = {
+            target: stack.enter_context(open(os.path.join(out_dir, f"Immunization.{target}.ndjson"), "w"))
+            for target in targets
+        }
+
+        # Each patient gets their own generator, seeded from the cohort's seed and their position
+        # in it, so that their records don't depend on the rest of the cohort's, and nothing but
+        # the patient being written is ever held in memory
+        for index, nhs_number in zip(range(patients), nhs_numbers()):
+            rng = random.Random(f"{seed}:{index}")
+            patient = generate_patient(patient_example, rng, nhs_number)
+            write_ndjson(patient_file, patient)
+            for target in targets:
+                count = rng.randint(min_history, max_history)
+                for immunization in generate_immunizations(immunization_example, rng, patient, target, count):
+                    write_ndjson(immunization_files[target], immunization)
+
+
+if __name__ == "__main__":
+    main(arguments=docopt(__doc__, version="0"))
@@ -1,14 +1,13 @@
 # flake8: noqaimport asyncio
-import asyncio
 import json
 from copy import deepcopy
 from typing import Dict, List
 from uuid import uuid4
 
 import pytest
-import requests
 
 from tests import conftest
+from tests.rate_governor import rate_governor
 
 TARGET_COMBINATIONS = [["COVID19"], ["HPV", "COVID19"]]
 
@@ -70,13 +69,15 @@ def _assert_unauthorized_client_exception(exc_info):
 
 @pytest.mark.smoketest
 def test_ping(service_url):
-    resp = requests.get(f"{service_url}/_ping")
+    resp = rate_governor.get(f"{service_url}/_ping")
     assert resp.status_code == 200
 
 
 @pytest.mark.smoketest
 def test_status(service_url):
-    resp = requests.get(f"{service_url}/_status", headers={"apikey": conftest.get_env("STATUS_ENDPOINT_API_KEY")})
+    resp = rate_governor.get(
+        f"{service_url}/_status", headers={"apikey": conftest.get_env("STATUS_ENDPOINT_API_KEY")}
+    )
     status_json = resp.json()
     assert resp.status_code == 200
     assert status_json["status"] == "pass"
@@ -84,13 +85,13 @@ def test_status(service_url):
 
 @pytest.mark.smoketest
 def test_check_status_is_secured(service_url):
-    resp = requests.get(f"{service_url}/_status")
+    resp = rate_governor.get(f"{service_url}/_status")
     assert resp.status_code == 401
 
 
 @pytest.mark.e2e
 def test_check_immunization_is_secured(service_url):
-    resp = requests.get(f'{service_url}/{_base_valid_uri(VALID_NHS_NUMBER)}')
+    resp = rate_governor.get(f'{service_url}/{_base_valid_uri(VALID_NHS_NUMBER)}')
     assert resp.status_code == 401
 
 
@@ -112,7 +113,7 @@ def test_client_credentials_happy_path(immunisation_history_app: Dict, service_u
     correlation_id = _generate_correlation_id('test_client_credentials_happy_path')
     authorised_headers["X-Correlation-ID"] = correlation_id
 
-    resp = requests.get(
+    resp = rate_governor.get(
         f'{service_url}/{_valid_uri_procedure_below(VALID_NHS_NUMBER, "90640007")}',
         headers=authorised_headers,
     )
@@ -125,7 +126,6 @@ def test_client_credentials_happy_path(immunisation_history_app: Dict, service_u
 
 
 @pytest.mark.e2e
-@pytest.mark.asyncio
 @pytest.mark.parametrize(
     "immunisation_history_app",
     _add_authorised_targets_to_request_params(
@@ -136,13 +136,12 @@ def test_client_credentials_happy_path(immunisation_history_app: Dict, service_u
     ),
     indirect=True,
 )
-async def test_immunization_no_auth_bearer_token_provided(
+def test_immunization_no_auth_bearer_token_provided(
     immunisation_history_app: Dict, service_url: str
 ):
-    await asyncio.sleep(1)  # Add delay to tests to avoid 429 on service callout
     correlation_id = _generate_correlation_id('test_immunization_no_auth_bearer_token_provided')
     headers = {"Authorization": "Bearer", "X-Correlation-ID": correlation_id}
-    resp = requests.get(
+    resp = rate_governor.get(
         f'{service_url}/{_valid_uri_procedure_below(VALID_NHS_NUMBER, "90640007")}', headers=headers,
     )
     assert resp.status_code == 401, "failed getting backend data"
@@ -159,7 +158,6 @@ async def test_immunization_no_auth_bearer_token_provided(
 
 
 @pytest.mark.e2e
-@pytest.mark.asyncio
 @pytest.mark.parametrize(
     "immunisation_history_app",
     _add_authorised_targets_to_request_params(
@@ -173,9 +171,7 @@ async def test_immunization_no_auth_bearer_token_provided(
     ),
     indirect=True,
 )
-async def test_bad_nhs_number(immunisation_history_app: Dict, service_url: str, environment: str, _jwt_keys):
-    await asyncio.sleep(1)  # Add delay to tests to avoid 429 on service callout
-
+def test_bad_nhs_number(immunisation_history_app: Dict, service_url: str, environment: str, _jwt_keys):
     subject_token_claims = {
         "identity_proofing_level": immunisation_history_app["request_params"]["identity_proofing_level"]
     }
@@ -185,7 +181,7 @@ async def test_bad_nhs_number(immunisation_history_app: Dict, service_url: str,
     )
     correlation_id = _generate_correlation_id('test_bad_nhs_number')
 
-    resp = requests.get(
+    resp = rate_governor.get(
         f'{service_url}/{_valid_uri_procedure_below("90000000009", "90640007")}',
         headers={
             "Authorization": f'Bearer {token_response["access_token"]}',
@@ -210,7 +206,7 @@ def test_correlation_id_mirrored_in_resp_when_error(service_url):
 
     correlation_id = _generate_correlation_id('test_correlation_id_mirrored_in_resp_when_error')
 
-    resp = requests.get(
+    resp = rate_governor.get(
         f'{service_url}/{_valid_uri_procedure_below(VALID_NHS_NUMBER, "90640007")}',
         headers={
             "Authorization": f"Bearer {access_token}",
@@ -274,7 +270,7 @@ def test_token_exchange_happy_path(immunisation_history_app: Dict, service_url:
     correlation_id = _generate_correlation_id('test_token_exchange_happy_path')
     headers = {"Authorization": f"Bearer {token}", "X-Correlation-ID": correlation_id}
 
-    resp = requests.get(
+    resp = rate_governor.get(
         f'{service_url}/{_valid_uri_procedure_below(VALID_NHS_NUMBER, "90640007")}', headers=headers,
     )
     assert resp.status_code == 200, f'failed getting backend data {immunisation_history_app["request_params"]} {resp}'
@@ -323,7 +319,6 @@ def test_token_exchange_sad_path(immunisation_history_app: Dict, environment: st
 
 @pytest.mark.skip(reason="Does not work as-is with mock-auth")
 @pytest.mark.e2e
-@pytest.mark.asyncio
 @pytest.mark.parametrize(
     "test_product_and_app",
     [
@@ -340,9 +335,7 @@ def test_token_exchange_sad_path(immunisation_history_app: Dict, environment: st
     ],
     indirect=True,
 )
-async def test_user_restricted_access_not_permitted(test_product_and_app, service_url: str, environment: str):
-    await asyncio.sleep(1)  # Add delay to tests to avoid 429 on service callout
-
+def test_user_restricted_access_not_permitted(test_product_and_app, service_url: str, environment: str):
     test_product, test_app = test_product_and_app
 
     token_response = conftest.get_token(app=test_app, environment=environment)
@@ -357,7 +350,7 @@ async def test_user_restricted_access_not_permitted(test_product_and_app, servic
         "X-Correlation-ID": correlation_id
     }
 
-    resp = requests.get(
+    resp = rate_governor.get(
         f'{service_url}/{_valid_uri_procedure_below(VALID_NHS_NUMBER, "90640007")}',
         headers=authorised_headers
     )
@@ -402,7 +395,7 @@ def test_token_exchange_invalid_identity_proofing_level_scope(test_product_and_a
     correlation_id = _generate_correlation_id('test_token_exchange_invalid_identity_proofing_level_scope')
     headers = {"Authorization": f"Bearer {token}", "X-Correlation-ID": correlation_id}
 
-    resp = requests.get(
+    resp = rate_governor.get(
         f'{service_url}/{_valid_uri_procedure_below(VALID_NHS_NUMBER, "90640007")}', headers=headers,
     )
     assert resp.status_code == 401
@@ -441,7 +434,7 @@ def test_pass_when_auth_targets_is_null(immunisation_history_app: Dict, service_
     correlation_id = _generate_correlation_id('test_pass_when_auth_targets_is_null')
     authorised_headers["X-Correlation-ID"] = correlation_id
 
-    resp = requests.get(
+    resp = rate_governor.get(
         f'{service_url}/{_valid_uri_procedure_below(VALID_NHS_NUMBER, "90640007")}',
         headers=authorised_headers,
     )
@@ -470,7 +463,7 @@ def test_fail_when_auth_targets_is_null_in_strict_mode(
     correlation_id = _generate_correlation_id('test_fail_when_auth_targets_is_null_in_strict_mode')
     authorised_headers["X-Correlation-ID"] = correlation_id
 
-    resp = requests.get(
+    resp = rate_governor.get(
         f'{service_url}/{_valid_uri_procedure_below(VALID_NHS_NUMBER, "90640007")}',
         headers=authorised_headers,
 
@@ -517,7 +510,7 @@ def test_fail_when_auth_targets_is_blank_or_invalid(
     correlation_id = _generate_correlation_id('test_fail_when_auth_targets_is_blank_or_invalid')
     authorised_headers["X-Correlation-ID"] = correlation_id
 
-    resp = requests.get(
+    resp = rate_governor.get(
         f'{service_url}/{_valid_uri_procedure_below(VALID_NHS_NUMBER, "90640007")}',
         headers=authorised_headers,
 
@@ -547,7 +540,7 @@ def test_pass_when_auth_targets_is_star_in_non_strict_mode(
     correlation_id = _generate_correlation_id('test_pass_when_auth_targets_is_star_in_non_strict_mode')
     authorised_headers["X-Correlation-ID"] = correlation_id
 
-    resp = requests.get(
+    resp = rate_governor.get(
         f'{service_url}/{_valid_uri_procedure_below(VALID_NHS_NUMBER, "90640007")}',
         headers=authorised_headers,
     )
@@ -576,7 +569,7 @@ def test_fail_when_auth_targets_is_star_in_strict_mode(
     correlation_id = _generate_correlation_id('test_fail_when_auth_targets_is_star_in_strict_mode')
     authorised_headers["X-Correlation-ID"] = correlation_id
 
-    resp = requests.get(
+    resp = rate_governor.get(
         f'{service_url}/{_valid_uri_procedure_below(VALID_NHS_NUMBER, "90640007")}',
         headers=authorised_headers,
 
@@ -608,7 +601,7 @@ def test_fail_when_authorised_targets_header_upper_set_in_good_request(
     authorised_headers["X-Correlation-ID"] = correlation_id
     authorised_headers[extra_header] = "FOO,BAR"
 
-    resp = requests.get(
+    resp = rate_governor.get(
         f'{service_url}/{_valid_uri_procedure_below(VALID_NHS_NUMBER, "90640007")}',
         headers=authorised_headers,
 
@@ -644,7 +637,7 @@ def test_immunization_target_happy_path(immunisation_history_app: Dict, immuniza
     correlation_id = _generate_correlation_id('test_immunization_target_happy_path')
     authorised_headers["X-Correlation-ID"] = correlation_id
 
-    resp = requests.get(
+    resp = rate_governor.get(
         f'{service_url}/{_valid_uri_immunization_target(VALID_NHS_NUMBER, immunization_target)}',
         headers=authorised_headers,
 
@@ -676,7 +669,7 @@ def test_immunization_target_unhappy_path(immunisation_history_app: Dict, immuni
     correlation_id = _generate_correlation_id('test_immunization_target_unhappy_path')
     authorised_headers["X-Correlation-ID"] = correlation_id
 
-    resp = requests.get(
+    resp = rate_governor.get(
         f'{service_url}/{_valid_uri_immunization_target(VALID_NHS_NUMBER, immunization_target)}',
         headers=authorised_headers,
 
@@ -713,7 +706,7 @@ def test_fails_if_request_url_set_in_header(immunisation_history_app: Dict, immu
     authorised_headers["X-Correlation-ID"] = correlation_id
     authorised_headers[x_request_url_name] = "this_is_an_injected_url"
 
-    resp = requests.get(
+    resp = rate_governor.get(
         f'{service_url}/{_valid_uri_immunization_target(VALID_NHS_NUMBER, immunization_target)}',
         headers=authorised_headers,
 
@@ -0,0 +1,55 @@
+from time import time
+from unittest import mock
+
+from pytest_nhsd_apim.apigee_apis import ApiProductsAPI, DeveloperAppsAPI
+
+from tests.conftest import APP_EMAIL, POOLED_RESOURCE_PREFIX, POOLED_RESOURCE_TTL_SECONDS, _remove_orphaned_resources
+
+
+def _resource(name: str, age_seconds: int) -> dict:
+    return {"name": name, "createdAt": str(int((time() - age_seconds) * 1000))}
+
+
+def _apis(apps: list, products: list):
+    # Specced from the real classes, so that calling a method pytest-nhsd-apim doesn't have fails
+    developer_apps_api = mock.create_autospec(DeveloperAppsAPI, instance=True)
+    developer_apps_api.list_apps.return_value = {"app": apps}
+    products_api = mock.create_autospec(ApiProductsAPI, instance=True)
+    products_api.get_products.return_value = {"apiProduct": products}
+    return developer_apps_api, products_api
+
+
+def test_janitor_removes_only_this_suites_expired_resources():
+    expired = POOLED_RESOURCE_TTL_SECONDS + 60
+    developer_apps_api, products_api = _apis(
+        apps=[
+            _resource(f"{POOLED_RESOURCE_PREFIX}old-app", expired),
+            _resource(f"{POOLED_RESOURCE_PREFIX}new-app", 60),
+            _resource("another-suites-app", expired),
+        ],
+        products=[
+            _resource(f"{POOLED_RESOURCE_PREFIX}old-product", expired),
+            _resource("another-suites-product", expired),
+        ],
+    )
+
+    _remove_orphaned_resources(developer_apps_api=developer_apps_api, products_api=products_api)
+
+    developer_apps_api.list_apps.assert_called_once_with(email=APP_EMAIL, expand=True)
+    developer_apps_api.delete_app_by_name.assert_called_once_with(
+        email=APP_EMAIL, app_name=f"{POOLED_RESOURCE_PREFIX}old-app"
+    )
+    products_api.delete_product_by_name.assert_called_once_with(product_name=f"{POOLED_RESOURCE_PREFIX}old-product")
+
+
+def test_janitor_carries_on_when_another_job_deleted_a_resource_first():
+    expired = POOLED_RESOURCE_TTL_SECONDS + 60
+    developer_apps_api, products_api = _apis(
+        apps=[_resource(f"{POOLED_RESOURCE_PREFIX}app-{i}", expired) for i in range(2)],
+        products=[],
+    )
+    developer_apps_api.delete_app_by_name.side_effect = [Exception("failed with status_code: 404"), None]
+
+    _remove_orphaned_resources(developer_apps_api=developer_apps_api, products_api=products_api)
+
+    assert developer_apps_api.delete_app_by_name.call_count == 2
@@ -1,7 +1,11 @@
 # flake8: noqa
+import hashlib
 import json
 import os
-from typing import List, Dict
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Dict, Optional, Tuple
 from uuid import uuid4
 from time import time
 
@@ -23,8 +27,17 @@ from pytest_nhsd_apim.identity_service import (
     TokenExchangeAuthenticator
 )
 
+from tests.id_tokens import IdTokenPool, load_private_key
+
 APP_EMAIL = "apm-testing-internal-dev@nhs.net"
 ID_TOKEN_ISSUER = "https://identity.ptl.api.platform.nhs.uk/realms/NHS-Login-mock-internal-dev"
+TOKEN_REFRESH_MARGIN_SECONDS = 30
+APP_PROVISIONING_WORKERS = 8
+# Only apps and products with this prefix are swept by the janitor, so that resources other suites create under
+# the shared developer and org are never touched
+POOLED_RESOURCE_PREFIX = "ih-test-pool-"
+POOLED_RESOURCE_TTL_SECONDS = 24 * 60 * 60
+POOLED_RESOURCE_MIN_REMAINING_SECONDS = 60 * 60
 
 
 def get_env(variable_name: str, default: str = None) -> str:
@@ -47,18 +60,32 @@ def get_oath_url(environment: str) -> str:
     return f'{get_env("OAUTH_BASE_URI", default=default_base_oauth_url)}/{get_env("OAUTH_PROXY", default="oauth2-mock")}'
 
 
-def _get_nhs_login_private_key() -> str:
+def _get_nhs_login_private_key():
     nhs_login_id_token_private_key_path = os.environ.get(
         "ID_TOKEN_NHS_LOGIN_PRIVATE_KEY_ABSOLUTE_PATH"
     )
-    with open(nhs_login_id_token_private_key_path, "r") as f:
-        return f.read()
+    return load_private_key(nhs_login_id_token_private_key_path)
 
 
 def nhs_login_id_token(
     id_token_claims: Dict = None,
     id_token_headers: Dict = None,
     allowed_proofing_level: str = "P9",
+) -> str:
+    """Returns a signed NHS login ID token, pre-minted in the background unless custom headers are needed"""
+    if id_token_headers is not None:
+        return _mint_nhs_login_id_token(
+            id_token_claims=id_token_claims,
+            id_token_headers=id_token_headers,
+            allowed_proofing_level=allowed_proofing_level,
+        )
+    return _id_token_pool.get(id_token_claims=id_token_claims, allowed_proofing_level=allowed_proofing_level)
+
+
+def _mint_nhs_login_id_token(
+    id_token_claims: Dict = None,
+    id_token_headers: Dict = None,
+    allowed_proofing_level: str = "P9",
 ) -> str:
     expires = int(time())
     default_id_token_claims = {
@@ -96,8 +123,72 @@ def nhs_login_id_token(
     )
 
 
+_id_token_pool = IdTokenPool(
+    mint=_mint_nhs_login_id_token,
+    common_claim_sets=[
+        {"id_token_claims": {"identity_proofing_level": proofing_level}, "allowed_proofing_level": "P9"}
+        for proofing_level in ("P5", "P6", "P9")
+    ],
+)
+
+
+class _TokenCache:
+    """
+    Caches identity service token responses so that tests sharing an app don't each mint a new token.
+
+    Entries are keyed by app consumer key, environment, grant type and subject token claims, are
+    refreshed `refresh_margin` seconds before `expires_in` elapses and are evicted when the app is deleted.
+    """
+
+    def __init__(self, refresh_margin: int = TOKEN_REFRESH_MARGIN_SECONDS):
+        self._refresh_margin = refresh_margin
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(app: Dict, environment: str, grant_type: str, subject_token_claims: Dict = None) -> Tuple:
+        consumer_key = app["credentials"][0]["consumerKey"]
+        return consumer_key, environment, grant_type, json.dumps(subject_token_claims or {}, sort_keys=True)
+
+    def get_or_fetch(self, key: Tuple, fetch: Callable[[], Dict]) -> Dict:
+        with self._lock:
+            cached = self._tokens.get(key)
+        if cached is not None:
+            expires_at, token_response = cached
+            if time() < expires_at - self._refresh_margin:
+                return dict(token_response)
+
+        token_response = fetch()
+        expires_at = time() + int(token_response.get("expires_in", 0))
+        with self._lock:
+            self._tokens[key] = (expires_at, token_response)
+        return dict(token_response)
+
+    def evict(self, consumer_key: str):
+        with self._lock:
+            for key in [key for key in self._tokens if key[0] == consumer_key]:
+                del self._tokens[key]
+
+
+_token_cache = _TokenCache()
+
+
+def _evict_app_tokens(app: Dict):
+    for credentials in app.get("credentials", []):
+        _token_cache.evict(credentials["consumerKey"])
+
+
 def get_token(
     app: Dict, environment: str, _jwt_keys
+):
+    return _token_cache.get_or_fetch(
+        key=_TokenCache.key(app=app, environment=environment, grant_type="client_credentials"),
+        fetch=lambda: _get_client_credentials_token(app=app, environment=environment, _jwt_keys=_jwt_keys),
+    )
+
+
+def _get_client_credentials_token(
+    app: Dict, environment: str, _jwt_keys
 ):
     client_credentials_config = ClientCredentialsConfig(
         environment=environment,
@@ -124,7 +215,25 @@ def get_token_nhs_login_token_exchange(
     _jwt_keys,
     subject_token_claims: Dict = None
 ):
-    """Call identity server to get an access token"""
+    """Call identity server to get an access token, reusing a cached one until it is about to expire"""
+    return _token_cache.get_or_fetch(
+        key=_TokenCache.key(
+            app=test_app, environment=environment, grant_type="token_exchange",
+            subject_token_claims=subject_token_claims
+        ),
+        fetch=lambda: _exchange_nhs_login_token(
+            test_app=test_app, environment=environment, _jwt_keys=_jwt_keys,
+            subject_token_claims=subject_token_claims
+        ),
+    )
+
+
+def _exchange_nhs_login_token(
+    test_app,
+    environment: str,
+    _jwt_keys,
+    subject_token_claims: Dict = None
+):
     if subject_token_claims is not None:
         id_token_jwt = nhs_login_id_token(
             id_token_claims=subject_token_claims
@@ -152,13 +261,7 @@ def get_token_nhs_login_token_exchange(
     return token_resp
 
 
-def _create_app(dev_apps_api: DeveloperAppsAPI, app_name: str, api_products: List[str], app_attrs: Dict,
-                jwt_public_key_url: str):
-    full_app_attrs = {
-        **app_attrs,
-        "jwks-resource-url": jwt_public_key_url
-    }
-
+def _create_app(dev_apps_api: DeveloperAppsAPI, app_name: str, api_products: List[str], full_app_attrs: Dict):
     body = {
         "name": app_name,
         "apiProducts": api_products,
@@ -168,7 +271,7 @@ def _create_app(dev_apps_api: DeveloperAppsAPI, app_name: str, api_products: Lis
         "scopes": [],
         "status": "approved",
         "callbackUrl": "http://example.com",
-        "keyExpiresIn": 60000
+        "keyExpiresIn": POOLED_RESOURCE_TTL_SECONDS * 1000
     }
     return dev_apps_api.create_app(email=APP_EMAIL, body=body)
 
@@ -195,6 +298,197 @@ def _create_product(product_name: str, products_api: ApiProductsAPI, proxies: Li
     return product
 
 
+def _fingerprint(**parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:32]
+
+
+# pytest-nhsd-apim raises a bare Exception whose message gives the status after the URL, which can contain digits
+_STATUS_CODE_MESSAGE = re.compile(r"failed with status_code: (\d{3})\b")
+
+
+def _status_code_of(exception: Exception) -> Optional[int]:
+    """The HTTP status of a failed Apigee request, None if the exception isn't for one"""
+    status = getattr(exception, "status", None)
+    if status is None:
+        status = getattr(getattr(exception, "response", None), "status_code", None)
+    if status is None:
+        match = _STATUS_CODE_MESSAGE.search(str(exception))
+        status = match and int(match.group(1))
+    return status
+
+
+def _status_code_in(exception: Exception, status_code: int) -> bool:
+    return _status_code_of(exception) == status_code
+
+
+def _get_if_exists(getter: Callable[..., Dict], **kwargs) -> Dict:
+    try:
+        return getter(**kwargs)
+    except Exception as e:
+        if _status_code_in(e, 404):
+            return None
+        raise
+
+
+def _is_reusable(resource: Dict) -> bool:
+    """Pooled resources are reused until they get close to the janitor's TTL"""
+    reuse_until_ms = (time() + POOLED_RESOURCE_MIN_REMAINING_SECONDS) * 1000
+    created_at_ms = int(resource.get("createdAt", 0))
+    return created_at_ms + POOLED_RESOURCE_TTL_SECONDS * 1000 >= reuse_until_ms
+
+
+def _get_or_create_pooled(get: Callable[[], Dict], create: Callable[[], Dict], delete: Callable[[], None]) -> Dict:
+    existing = get()
+    if existing is not None and _is_reusable(existing):
+        return existing
+    if existing is not None:
+        delete()
+    try:
+        return create()
+    except Exception as e:
+        if not _status_code_in(e, 409):
+            raise
+        # Another run created the same resource in the meantime
+        return get()
+
+
+def _create_session_app(dev_apps_api: DeveloperAppsAPI, api_products: List[str], app_attrs: Dict,
+                        jwt_public_key_url: str) -> Dict:
+    """
+    Creates an app for this session only, to be deleted with _delete_session_app.
+
+    Apps aren't pooled like products: their JWKS URL holds the key pair pytest-nhsd-apim generates for each session,
+    and concurrent runs sharing an app would keep replacing each other's key. Interrupted runs' apps are left to the
+    janitor.
+    """
+    full_app_attrs = {
+        **app_attrs,
+        "jwks-resource-url": jwt_public_key_url
+    }
+    return _create_app(dev_apps_api=dev_apps_api, app_name=f"{POOLED_RESOURCE_PREFIX}{uuid4()}",
+                       api_products=api_products, full_app_attrs=full_app_attrs)
+
+
+def _delete_session_app(dev_apps_api: DeveloperAppsAPI, app: Dict):
+    _evict_app_tokens(app)
+    dev_apps_api.delete_app_by_name(email=APP_EMAIL, app_name=app["name"])
+
+
+def _get_or_create_product(products_api: ApiProductsAPI, proxies: List, scopes: List) -> Dict:
+    """Reuses an existing product with exactly these proxies and scopes, creating it if needed"""
+    product_name = POOLED_RESOURCE_PREFIX + _fingerprint(proxies=sorted(proxies), scopes=sorted(scopes))
+    return _get_or_create_pooled(
+        get=lambda: _get_if_exists(products_api.get_product_by_name, product_name=product_name),
+        create=lambda: _create_product(product_name=product_name, products_api=products_api, proxies=proxies,
+                                       scopes=scopes),
+        delete=lambda: products_api.delete_product_by_name(product_name=product_name),
+    )
+
+
+def _listed(response, key: str) -> List[Dict]:
+    return response.get(key, []) if isinstance(response, dict) else response
+
+
+def _remove_orphaned_resources(developer_apps_api: DeveloperAppsAPI, products_api: ApiProductsAPI,
+                               ttl: int = POOLED_RESOURCE_TTL_SECONDS):
+    """Deletes this suite's pooled apps and products older than ttl, left behind by interrupted or earlier runs"""
+    cutoff_ms = (time() - ttl) * 1000
+
+    def _is_orphaned(resource: Dict) -> bool:
+        return resource["name"].startswith(POOLED_RESOURCE_PREFIX) and int(resource.get("createdAt", 0)) < cutoff_ms
+
+    def _delete_quietly(delete: Callable[..., Dict], **kwargs):
+        try:
+            delete(**kwargs)
+        except Exception as e:
+            # Already deleted by a concurrent job
+            print(f"Janitor could not delete {kwargs}: {e}")
+
+    apps = _listed(developer_apps_api.list_apps(email=APP_EMAIL, expand=True), "app")
+    products = _listed(products_api.get_products(expand=True), "apiProduct")
+    with ThreadPoolExecutor(max_workers=APP_PROVISIONING_WORKERS) as executor:
+        list(executor.map(
+            lambda app: _delete_quietly(developer_apps_api.delete_app_by_name, email=APP_EMAIL, app_name=app["name"]),
+            [app for app in apps if _is_orphaned(app)],
+        ))
+        list(executor.map(
+            lambda product: _delete_quietly(products_api.delete_product_by_name, product_name=product["name"]),
+            [product for product in products if _is_orphaned(product)],
+        ))
+
+
+def _app_attributes(request_params: Dict) -> Dict:
+    custom_attributes = {
+        "nhs-login-allowed-proofing-level": request_params.get(
+            "requested_proofing_level", ""
+        ),
+    }
+
+    authorised_targets = request_params.get("authorised_targets")
+    if authorised_targets is not None:
+        custom_attributes["apim-app-flow-vars"] = json.dumps(
+            {"immunisation-history": {"authorised_targets": authorised_targets}}
+        )
+
+    strict_mode = request_params.get("use_strict_authorised_targets", False)
+    if strict_mode:
+        custom_attributes["use_strict_authorised_targets"] = strict_mode
+
+    return custom_attributes
+
+
+def _app_spec_key(request_params: Dict) -> str:
+    return json.dumps(request_params, sort_keys=True)
+
+
+class _AppProvisioner:
+    """Creates and deletes one developer app per distinct set of request params, concurrently"""
+
+    def __init__(self, developer_apps_api: DeveloperAppsAPI, jwt_public_key_url: str,
+                 workers: int = APP_PROVISIONING_WORKERS):
+        self._developer_apps_api = developer_apps_api
+        self._jwt_public_key_url = jwt_public_key_url
+        self._workers = workers
+        self._apps = {}
+        self._lock = threading.Lock()
+
+    def _create(self, request_params: Dict) -> Dict:
+        app = _create_session_app(dev_apps_api=self._developer_apps_api,
+                                  api_products=get_product_names(request_params["suffixes"]),
+                                  app_attrs=_app_attributes(request_params),
+                                  jwt_public_key_url=self._jwt_public_key_url)
+        with self._lock:
+            self._apps[_app_spec_key(request_params)] = app
+        return app
+
+    def create_all(self, request_params_list: List[Dict]):
+        pending = {_app_spec_key(request_params): request_params for request_params in request_params_list}
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            list(executor.map(self._create, pending.values()))
+
+    def get(self, request_params: Dict) -> Dict:
+        with self._lock:
+            app = self._apps.get(_app_spec_key(request_params))
+        if app is None:
+            app = self._create(request_params)
+        return {**app, "request_params": request_params}
+
+    def delete_all(self):
+        with self._lock:
+            apps, self._apps = list(self._apps.values()), {}
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            list(executor.map(lambda app: _delete_session_app(self._developer_apps_api, app), apps))
+
+
+def pytest_collection_finish(session):
+    """Records the app each selected test needs, so that app_provisioner can create them all at once"""
+    session.config.immunisation_history_app_specs = [
+        item.callspec.params["immunisation_history_app"]
+        for item in session.items
+        if "immunisation_history_app" in getattr(getattr(item, "callspec", None), "params", {})
+    ]
+
+
 @pytest.fixture(scope="session")
 def client() -> ApigeeClient:
     config = ApigeeNonProdCredentials()
@@ -224,43 +518,36 @@ def service_url(environment):
 
 
 @pytest.fixture(scope="session")
-def immunisation_history_app(client: ApigeeClient, jwt_public_key_url: str, request):
-    """Setup & Teardown an app-restricted app for this api"""
-    request_params = request.param
-
-    custom_attributes = {
-        "nhs-login-allowed-proofing-level": request_params.get(
-            "requested_proofing_level", ""
-        ),
-    }
-
-    authorised_targets = request_params.get("authorised_targets")
-    if authorised_targets is not None:
-        custom_attributes["apim-app-flow-vars"] = json.dumps(
-            {"immunisation-history": {"authorised_targets": authorised_targets}}
-        )
-
-    strict_mode = request_params.get("use_strict_authorised_targets", False)
-    if strict_mode:
-        custom_attributes["use_strict_authorised_targets"] = strict_mode
-
-    api_products = get_product_names(request_params["suffixes"])
+def apigee_janitor(client: ApigeeClient):
+    """Removes pooled apps and products that have outlived POOLED_RESOURCE_TTL_SECONDS, once per session"""
+    _remove_orphaned_resources(
+        developer_apps_api=DeveloperAppsAPI(client=client), products_api=ApiProductsAPI(client=client)
+    )
 
-    app_name = f"apim-auto-{uuid4()}"
 
-    developer_apps_api = DeveloperAppsAPI(client=client)
-    app = _create_app(dev_apps_api=developer_apps_api, app_name=app_name, api_products=api_products,
-                      app_attrs=custom_attributes, jwt_public_key_url=jwt_public_key_url)
+@pytest.fixture(scope="session")
+def app_provisioner(client: ApigeeClient, jwt_public_key_url: str, apigee_janitor, request):
+    """Gets the apps for every collected immunisation_history_app parametrisation up front, in parallel"""
+    provisioner = _AppProvisioner(
+        developer_apps_api=DeveloperAppsAPI(client=client), jwt_public_key_url=jwt_public_key_url
+    )
+    try:
+        provisioner.create_all(getattr(request.config, "immunisation_history_app_specs", []))
+        yield provisioner
+    finally:
+        provisioner.delete_all()
 
-    app["request_params"] = request_params
-    yield app
 
-    developer_apps_api.delete_app_by_name(email=APP_EMAIL, app_name=app_name)
+@pytest.fixture(scope="session")
+def immunisation_history_app(app_provisioner, request):
+    """An app-restricted app for this api, created and deleted by app_provisioner"""
+    return app_provisioner.get(request.param)
 
 
 @pytest.fixture()
-def test_product_and_app(client: ApigeeClient, service_name: str, environment: str, jwt_public_key_url: str, request):
-    """Setup & Teardown an product and app for this api"""
+def test_product_and_app(client: ApigeeClient, service_name: str, environment: str, jwt_public_key_url: str,
+                         apigee_janitor, request):
+    """Get a pooled product, and setup & teardown an app for it"""
     request_params = request.param
 
     products_api = ApiProductsAPI(client=client)
@@ -271,11 +558,8 @@ def test_product_and_app(client: ApigeeClient, service_name: str, environment: s
     if service_name is not None:
         proxies.append(service_name)
 
-    app_name = f"apim-auto-{uuid4()}"
-    product_name = f"apim-auto-{uuid4()}"
-
-    product = _create_product(product_name=product_name, products_api=products_api, proxies=proxies,
-                              scopes=request_params.get("scopes", []))
+    product = _get_or_create_product(products_api=products_api, proxies=proxies,
+                                     scopes=request_params.get("scopes", []))
 
     custom_attributes = {
         "nhs-login-allowed-proofing-level": request_params[
@@ -283,10 +567,9 @@ def test_product_and_app(client: ApigeeClient, service_name: str, environment: s
         ]
     }
 
-    app = _create_app(dev_apps_api=developer_apps_api, app_name=app_name, api_products=[product_name],
-                      app_attrs=custom_attributes, jwt_public_key_url=jwt_public_key_url)
-    app["request_params"] = request_params
+    app = _create_session_app(dev_apps_api=developer_apps_api, api_products=[product["name"]],
+                              app_attrs=custom_attributes, jwt_public_key_url=jwt_public_key_url)
+    app = {**app, "request_params": request_params}
     yield product, app
 
-    developer_apps_api.delete_app_by_name(email=APP_EMAIL, app_name=app_name)
-    products_api.delete_product_by_name(product_name=product_name)
+    _delete_session_app(developer_apps_api, app)
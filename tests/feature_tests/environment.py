@@ -1,3 +1,16 @@
+from tests.feature_tests.utils.apigee import print_apigee_metrics
+from tests.feature_tests.utils.app import release_pooled_apps, remove_orphaned_apps
+
+
+def before_all(context):
+    remove_orphaned_apps()
+
+
+def after_all(context):
+    release_pooled_apps()
+    print_apigee_metrics()
+
+
 def before_scenario(context, scenario):
     context.app_attributes = {}
     context.api_products = []
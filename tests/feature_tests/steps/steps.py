@@ -5,7 +5,7 @@ from behave import given, when, then
 
 from tests.feature_tests.utils.app import app
 from tests.feature_tests.utils.oauth import get_nhs_login_id_token
-from tests.feature_tests.utils.trace import trace, save_trace
+from tests.feature_tests.utils.trace import trace
 from tests.feature_tests.utils.utils import make_correlation_id, api_name_from_endpoint, generate_test_case
 
 
@@ -70,15 +70,13 @@ def make_api_request(context):
 
     with app(
         api_products=api_products,
-        app_attrs=context.app_attributes,
-        correlation_id=context.correlation_id
+        app_attrs=context.app_attributes
     ) as secrets:
         test_case = generate_test_case(context, secrets, context.correlation_id, context.include_oauth)
         if context.include_trace:
-            with trace(api_name=api_name, correlation_id=context.correlation_id) as trace_data:
+            trace_path = Path(__file__).parent / "traces" / f"{context.correlation_id}.jsonl"
+            with trace(api_name=api_name, correlation_id=context.correlation_id, path=trace_path):
                 status_code, body, headers = test_case(base_url, request_config)
-            trace_save_root = Path(__file__).parent
-            save_trace(trace_data=trace_data, correlation_id=context.correlation_id, root=trace_save_root)
         else:
             status_code, body, headers = test_case(base_url, request_config)
 
@@ -1,25 +1,163 @@
+import base64
+import json
 import os
-from functools import cache
+import random
+import re
+import threading
+from collections import defaultdict
+from time import monotonic, sleep, time
+from typing import Optional
 
 import requests
 import sh
+from requests.adapters import HTTPAdapter
 
-from tests.feature_tests.utils.constants import SSO_LOGIN_URL
+from tests.feature_tests.utils.constants import SSO_LOGIN_URL, APIGEE_CONNECTION_POOL_SIZE
 
+TOKEN_REFRESH_MARGIN_SECONDS = 60
+DEFAULT_TOKEN_LIFETIME_SECONDS = 30 * 60
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Retrying these can't apply a request twice
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+MAX_RETRIES = 4
+BASE_BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 8
 
-@cache
-def _get_token():
-    response = sh.bash("get_token", _env={"SSO_LOGIN_URL": SSO_LOGIN_URL, **os.environ})
-    return response.split("\n")[0]
+
+def _token_expiry(token: str) -> Optional[float]:
+    """Reads the exp claim of a JWT access token, without verifying it"""
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (IndexError, KeyError, ValueError):
+        return None
+
+
+class _SessionToken:
+    """The Apigee SSO token, fetched with get_token and refreshed shortly before it expires"""
+
+    def __init__(self):
+        self._token = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+
+    def get(self, force_refresh: bool = False) -> str:
+        with self._lock:
+            if force_refresh or self._token is None or time() >= self._expires_at - TOKEN_REFRESH_MARGIN_SECONDS:
+                response = sh.bash("get_token", _env={"SSO_LOGIN_URL": SSO_LOGIN_URL, **os.environ})
+                self._token = response.split("\n")[0]
+                self._expires_at = _token_expiry(self._token) or time() + DEFAULT_TOKEN_LIFETIME_SECONDS
+            return self._token
+
+
+class _EndpointMetrics:
+    """Call counts and latencies per Apigee endpoint, with names and ids in the path collapsed to {}"""
+
+    def __init__(self):
+        self._metrics = defaultdict(lambda: {"calls": 0, "retries": 0, "errors": 0, "seconds": 0.0, "max": 0.0})
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def endpoint(method: str, url: str) -> str:
+        path = url.split("?")[0].split("/v1/", 1)[-1]
+        return f"{method.upper()} " + re.sub(r"(?<=/)[^/]*\d[^/]*", "{}", path)
+
+    def record(self, method: str, url: str, seconds: float, retries: int, failed: bool):
+        with self._lock:
+            metrics = self._metrics[self.endpoint(method, url)]
+            metrics["calls"] += 1
+            metrics["retries"] += retries
+            metrics["errors"] += int(failed)
+            metrics["seconds"] += seconds
+            metrics["max"] = max(metrics["max"], seconds)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                endpoint: {
+                    "calls": metrics["calls"],
+                    "retries": metrics["retries"],
+                    "errors": metrics["errors"],
+                    "total_seconds": round(metrics["seconds"], 3),
+                    "mean_ms": round(metrics["seconds"] / metrics["calls"] * 1000, 1),
+                    "max_ms": round(metrics["max"] * 1000, 1),
+                }
+                for endpoint, metrics in self._metrics.items()
+            }
+
+
+def _session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=APIGEE_CONNECTION_POOL_SIZE)
+    session.mount("https://", adapter)
+    return session
+
+
+_token = _SessionToken()
+_metrics = _EndpointMetrics()
+_http = _session()
+
+
+def _backoff(attempt: int, response: Optional[requests.Response]):
+    retry_after = response.headers.get("Retry-After", "") if response is not None else ""
+    if retry_after.isdigit():
+        sleep(int(retry_after))
+    else:
+        sleep(min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+def _is_retryable(method: str, response: Optional[requests.Response]) -> bool:
+    """
+    Whether a failed request can be sent again. A POST may have been applied before a dropped connection or 5xx,
+    and sending it again would create a duplicate app or trace session, so it's only retried when Apigee turned it
+    away: rate limited, or unavailable with a Retry-After.
+    """
+    if method.upper() in IDEMPOTENT_METHODS:
+        return response is None or response.status_code in RETRY_STATUS_CODES
+    if response is None:
+        return False
+    return response.status_code == 429 or (response.status_code == 503 and "Retry-After" in response.headers)
+
+
+def _send(method: str, url: str, **kwargs) -> requests.Response:
+    started_at = monotonic()
+    attempt = 0
+    refresh_token = False
+    refreshed = False
+    while True:
+        headers = {"Authorization": f"Bearer {_token.get(force_refresh=refresh_token)}"}
+        refresh_token = False
+        try:
+            r = _http.request(method=method, url=url, headers=headers, **kwargs)
+        except requests.ConnectionError:
+            if attempt == MAX_RETRIES or not _is_retryable(method, None):
+                _metrics.record(method, url, monotonic() - started_at, retries=attempt, failed=True)
+                raise
+            r = None
+        if r is not None and r.status_code == 401 and not refreshed:
+            # The token was revoked or expired early, so fetch a new one and go again
+            refresh_token = refreshed = True
+            continue
+        if r is not None and (not _is_retryable(method, r) or attempt == MAX_RETRIES):
+            _metrics.record(method, url, monotonic() - started_at, retries=attempt, failed=not r.ok)
+            return r
+        _backoff(attempt, r)
+        attempt += 1
+
+
+def apigee_metrics() -> dict:
+    return _metrics.summary()
 
 
-def _apigee_session_header():
-    return {"Authorization": f"Bearer {_get_token()}"}
+def print_apigee_metrics():
+    print("\nApigee management API calls:")
+    for endpoint, metrics in sorted(apigee_metrics().items(), key=lambda item: -item[1]["total_seconds"]):
+        print(f"\t- {endpoint}: " + ", ".join(f"{k}={v}" for k, v in metrics.items()))
 
 
 def apigee_request(method: str, url: str, **kwargs) -> dict:
-    headers = _apigee_session_header()
-    r = requests.request(method=method, url=url, headers=headers, **kwargs)
+    r = _send(method=method, url=url, **kwargs)
 
     try:
         r.raise_for_status()
@@ -1,15 +1,22 @@
 import base64
+import hashlib
 import json
 from contextlib import contextmanager
+from functools import lru_cache
+from time import time
 from typing import List
 
 from pytest_nhsd_apim.auth_journey import create_jwt_key_pair
 
 from tests.feature_tests.utils.apigee import apigee_request
-from tests.feature_tests.utils.constants import ApigeeUrl, REDIRECT_URI, DYNAMIC_APP_NAME, APP_LIFETIME_MILLISECONDS, \
-    PRODUCT_TYPES
+from tests.feature_tests.utils.constants import ApigeeUrl, REDIRECT_URI, POOLED_APP_PREFIX, APP_LIFETIME_MILLISECONDS, \
+    PRODUCT_TYPES, ORPHANED_APP_TTL_SECONDS
 from tests.feature_tests.utils.logging import logging
 
+# Apps are pooled for the lifetime of the process: the JWT private key is never stored, so an app can't be reused
+# by a later run, but scenarios sharing products and attributes share one app rather than each creating their own
+_app_pool = {}
+
 
 def _get_api_products(api_name: str):
     return [f"{api_name}-{term}" for term in PRODUCT_TYPES]
@@ -21,13 +28,19 @@ def jwt_public_key_url(jwt_public_key):
     return f"https://internal-dev.api.service.nhs.uk/mock-jwks/{encoded_public_key_bytes.decode()}"
 
 
+@lru_cache(maxsize=None)
+def _jwt_key_pair():
+    return create_jwt_key_pair("kid-1")
+
+
+def _app_fingerprint(api_products: List[str], app_attrs: dict[str:str]) -> str:
+    parts = {"api_products": sorted(api_products), "attributes": app_attrs}
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:32]
+
+
 @logging(teaser="Creating app", kwargs_to_log=["app_name"])
 def _create_app(app_name: str, api_products: List[str], app_attrs: dict[str:str]):
-    jwt_key_pair = create_jwt_key_pair("kid-1")
-    full_app_attrs = {
-        **app_attrs,
-        "jwks-resource-url": jwt_public_key_url(jwt_key_pair["json_web_key"])
-    }
+    jwt_key_pair = _jwt_key_pair()
 
     body = apigee_request(
         method="POST",
@@ -35,7 +48,7 @@ def _create_app(app_name: str, api_products: List[str], app_attrs: dict[str:str]
         json={
             "name": app_name,
             "attributes": [
-                {"name": key, "value": value} for key, value in full_app_attrs.items()
+                {"name": key, "value": value} for key, value in app_attrs.items()
             ],
             "callbackUrl": REDIRECT_URI,
             "keyExpiresIn": APP_LIFETIME_MILLISECONDS,
@@ -60,19 +73,31 @@ def _delete_app(app_name: str):
 
 
 @contextmanager
-def app(api_products: list[str], app_attrs: dict[str:str], correlation_id: str):
-    app_name = DYNAMIC_APP_NAME.format(correlation_id=correlation_id)
+def app(api_products: list[str], app_attrs: dict[str:str]):
+    full_app_attrs = {
+        **app_attrs,
+        "jwks-resource-url": jwt_public_key_url(_jwt_key_pair()["json_web_key"])
+    }
+    app_name = POOLED_APP_PREFIX + _app_fingerprint(api_products=api_products, app_attrs=full_app_attrs)
 
-    secrets = _create_app(
-        app_name=app_name, api_products=api_products, app_attrs=app_attrs
-    )
+    if app_name not in _app_pool:
+        _app_pool[app_name] = _create_app(
+            app_name=app_name, api_products=api_products, app_attrs=full_app_attrs
+        )
+    yield _app_pool[app_name]
+
+
+def release_pooled_apps():
+    while _app_pool:
+        app_name, _ = _app_pool.popitem()
+        _delete_app(app_name=app_name)
 
-    exception = None
-    try:
-        yield secrets
-    except Exception as _exception:
-        exception = _exception
 
-    _delete_app(app_name=app_name)
-    if exception:
-        raise Exception
+@logging(teaser="Removing orphaned apps")
+def remove_orphaned_apps(ttl: int = ORPHANED_APP_TTL_SECONDS):
+    """Deletes this suite's pooled apps older than ttl, left behind by interrupted runs"""
+    cutoff_ms = (time() - ttl) * 1000
+    apps = apigee_request(method="GET", url=ApigeeUrl.LIST_APPS, params={"expand": "true"}).get("app", [])
+    for orphaned_app in apps:
+        if orphaned_app["name"].startswith(POOLED_APP_PREFIX) and int(orphaned_app.get("createdAt", 0)) < cutoff_ms:
+            _delete_app(app_name=orphaned_app["name"])
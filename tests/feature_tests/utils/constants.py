@@ -3,16 +3,21 @@ ORGANISATION = "nhsd-nonprod"
 REDIRECT_URI = "http://tempuri.org/callback"
 APIM_EMAIL_ADDRESS = "apm-testing-internal-dev@nhs.net"
 SSO_LOGIN_URL = "https://login.apigee.com"
-DYNAMIC_APP_NAME = "apim-auto-dda-test-app-{correlation_id}"
+# Shares the pytest suite's pool prefix and TTL, so that either janitor only ever sweeps this repo's apps
+POOLED_APP_PREFIX = "ih-test-pool-feature-"
 PRODUCT_TYPES = ("application-restricted", "user-restricted")
-APP_LIFETIME_MILLISECONDS = 60000
+APP_LIFETIME_MILLISECONDS = 60 * 60 * 1000
+ORPHANED_APP_TTL_SECONDS = 24 * 60 * 60
 TRACE_LIFETIME_SECONDS = 30
+TRACE_FETCH_WORKERS = 8
+APIGEE_CONNECTION_POOL_SIZE = 16
 
 
 class ApigeeUrl:
     _BASE = f"https://api.enterprise.apigee.com/v1/organizations/{ORGANISATION}"
     _REVISIONS_SLUG = "apis/{api_name}/revisions"
     CREATE_APP = f"{_BASE}/developers/{APIM_EMAIL_ADDRESS}/apps"
+    LIST_APPS = CREATE_APP
     DELETE_APP = CREATE_APP + "/{app_name}"
     LIST_REVISIONS = f"{_BASE}/{_REVISIONS_SLUG}/"
     CREATE_TRACE_SESSION = (
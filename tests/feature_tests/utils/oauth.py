@@ -6,17 +6,23 @@ import jwt
 from pytest_nhsd_apim.auth_journey import get_access_token_via_signed_jwt_flow
 
 from tests.feature_tests.utils.logging import logging
+from tests.id_tokens import IdTokenPool, load_private_key
 
+COMMON_NHS_LOGIN_USERS = [{"nhs_number": "9912003888", "proofing_level": "P9"}]
 
-def _get_nhs_login_private_key() -> str:
+
+def _get_nhs_login_private_key():
     nhs_login_id_token_private_key_path = os.environ.get(
         "ID_TOKEN_NHS_LOGIN_PRIVATE_KEY_ABSOLUTE_PATH"
     )
-    with open(nhs_login_id_token_private_key_path, "r") as f:
-        return f.read()
+    return load_private_key(nhs_login_id_token_private_key_path)
 
 
 def get_nhs_login_id_token(nhs_number: str, proofing_level: str):
+    return _id_token_pool.get(nhs_number=nhs_number, proofing_level=proofing_level)
+
+
+def _mint_nhs_login_id_token(nhs_number: str, proofing_level: str):
     expires = int(time())
     payload = {
         "aud": 'tf_-APIM-1',
@@ -50,6 +56,9 @@ def get_nhs_login_id_token(nhs_number: str, proofing_level: str):
     )
 
 
+_id_token_pool = IdTokenPool(mint=_mint_nhs_login_id_token, common_claim_sets=COMMON_NHS_LOGIN_USERS)
+
+
 # This method from pytest-nhsd-apim has changed in later versions of the library so will need updating if these tests
 # are required, however given the PR for this https://github.com/NHSDigital/immunisation-history-api/pull/157/files
 # states that they did not run at the time of the commit, it is not being updated with the library update.
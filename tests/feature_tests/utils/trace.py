@@ -1,12 +1,16 @@
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from contextlib import contextmanager
 from pathlib import Path
+from typing import Optional
 from uuid import uuid4
 
 from tests.feature_tests.utils.apigee import apigee_request
-from tests.feature_tests.utils.constants import ApigeeUrl, TRACE_LIFETIME_SECONDS
+from tests.feature_tests.utils.constants import ApigeeUrl, TRACE_LIFETIME_SECONDS, TRACE_FETCH_WORKERS
 from tests.feature_tests.utils.logging import logging
 
+CORRELATION_ID_HEADER = "x-correlation-id"
+
 
 def _apim_session_name() -> str:
     return f"apim-auto-{uuid4()}"
@@ -29,34 +33,50 @@ def _create_trace_session(api_name: str) -> dict[str:str]:
     return dict(api_name=api_name, revision=revision, session_name=session_name)
 
 
+def _has_correlation_id(event: dict, correlation_id: str) -> bool:
+    """Only request messages are inspected, rather than searching the whole serialised event"""
+    for point in event.get("point", []):
+        for result in point.get("results", []):
+            if result.get("ActionResult") != "RequestMessage":
+                continue
+            for header in result.get("headers", []):
+                if header.get("name", "").lower() == CORRELATION_ID_HEADER and header.get("value") == correlation_id:
+                    return True
+    return False
+
+
+def _get_matching_event(url: str, correlation_id: str) -> Optional[dict]:
+    event = apigee_request(method="GET", url=url)
+    return event if _has_correlation_id(event, correlation_id) else None
+
+
 @logging(teaser="Getting trace session data")
-def _get_trace_session_data(api_name, revision, session_name):
+def _save_trace_session_data(api_name, revision, session_name, correlation_id: str, path: Path) -> int:
     url = ApigeeUrl.GET_TRACE_DATA.format(
         api_name=api_name, revision=revision, session_name=session_name
     )
     event_ids = apigee_request(method="GET", url=url)
-    data = [
-        apigee_request(method="GET", url=url + f"/{event_id}") for event_id in event_ids
-    ]
-    return data
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    saved = 0
+    with open(path, "w") as f, ThreadPoolExecutor(max_workers=TRACE_FETCH_WORKERS) as executor:
+        futures = [
+            executor.submit(_get_matching_event, url + f"/{event_id}", correlation_id) for event_id in event_ids
+        ]
+        for future in as_completed(futures):
+            event = future.result()
+            if event is not None:
+                f.write(json.dumps(event) + "\n")
+                saved += 1
+    return saved
 
 
 @contextmanager
-def trace(api_name: str, correlation_id: str):
+def trace(api_name: str, correlation_id: str, path: Path):
+    """Traces the requests made in the body, saving the events for correlation_id to path as JSON lines"""
     trace_session_metadata = _create_trace_session(api_name=api_name)
 
-    trace_data = []
-    yield trace_data
-
-    _trace_data = _get_trace_session_data(**trace_session_metadata)
-    trace_data += list(
-        event for event in _trace_data if correlation_id in json.dumps(event)
-    )
-
+    yield path
 
-@logging("Saving trace data")
-def save_trace(trace_data: list, root: Path, correlation_id: str):
-    path = root / "traces" / f"{correlation_id}.json"
-    with open(path, "w") as f:
-        json.dump(obj=trace_data, fp=f, indent=2)
+    _save_trace_session_data(**trace_session_metadata, correlation_id=correlation_id, path=path)
     print(path, end=" ")
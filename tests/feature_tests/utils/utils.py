@@ -2,12 +2,12 @@ import json
 import re
 from datetime import datetime
 
-import requests
 from requests.exceptions import HTTPError
 
 from tests.feature_tests.utils.constants import ENVIRONMENT
 from tests.feature_tests.utils.logging import logging
 from tests.feature_tests.utils.oauth import get_oauth_token
+from tests.rate_governor import rate_governor
 
 
 def _snake_case(s: str):
@@ -33,7 +33,7 @@ def make_request(request_config: dict, correlation_id: str, oauth_token: str = "
     if oauth_token:
         request_config["headers"]["Authorization"] = f"Bearer {oauth_token}"
     request_config["headers"]["x-correlation-id"] = correlation_id
-    response = requests.get(**request_config)
+    response = rate_governor.get(**request_config)
     try:
         body = response.json()
     except json.JSONDecodeError:
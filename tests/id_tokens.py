@@ -0,0 +1,103 @@
+import json
+import threading
+from collections import deque
+from functools import lru_cache
+from time import time
+from typing import Callable, Dict, Iterable, Optional
+
+from cryptography.hazmat.primitives import serialization
+
+DEFAULT_POOL_SIZE = 3
+DEFAULT_MAX_TOKEN_AGE_SECONDS = 60
+
+
+@lru_cache(maxsize=None)
+def load_private_key(path: str):
+    """Reads and parses a PEM private key once per process, so that signing doesn't pay for it every time"""
+    with open(path, "rb") as f:
+        return serialization.load_pem_private_key(f.read(), password=None)
+
+
+class IdTokenPool:
+    """
+    Keeps a few signed ID tokens ready for each claim set, minted on a background thread.
+
+    `mint` is called with the claim set as keyword arguments and must return a signed token. Claim sets
+    passed in `common_claim_sets` are kept topped up from the first call to `get`; any other claim set is
+    minted on the calling thread the first time it is asked for and pooled from then on.
+
+    Tokens older than `max_age` seconds are discarded rather than handed out, so that callers always get
+    a token with most of its lifetime left.
+    """
+
+    def __init__(
+        self,
+        mint: Callable[..., str],
+        common_claim_sets: Iterable[Dict] = (),
+        size: int = DEFAULT_POOL_SIZE,
+        max_age: int = DEFAULT_MAX_TOKEN_AGE_SECONDS,
+    ):
+        self._mint = mint
+        self._size = size
+        self._max_age = max_age
+        self._pools = {}
+        self._condition = threading.Condition()
+        self._minter = None
+        self._minter_failed = False
+        for claim_set in common_claim_sets:
+            self._pool_for(claim_set)
+
+    def get(self, **claim_set) -> str:
+        with self._condition:
+            token = self._pop_fresh(self._pool_for(claim_set))
+            self._start_minter()
+            self._condition.notify()
+        if token is None:
+            token = self._mint(**claim_set)
+        return token
+
+    def _pool_for(self, claim_set: Dict) -> deque:
+        key = json.dumps(claim_set, sort_keys=True)
+        if key not in self._pools:
+            self._pools[key] = (claim_set, deque())
+        return self._pools[key][1]
+
+    def _pop_fresh(self, pool: deque) -> Optional[str]:
+        while pool:
+            minted_at, token = pool.popleft()
+            if time() - minted_at < self._max_age:
+                return token
+        return None
+
+    def _start_minter(self):
+        if self._minter is None and not self._minter_failed:
+            self._minter = threading.Thread(target=self._mint_forever, name="id-token-pool", daemon=True)
+            self._minter.start()
+
+    def _next_claim_set_to_mint(self):
+        now = time()
+        for claim_set, pool in self._pools.values():
+            while pool and now - pool[0][0] >= self._max_age:
+                pool.popleft()
+            if len(pool) < self._size:
+                return claim_set, pool
+        return None
+
+    def _mint_forever(self):
+        while True:
+            with self._condition:
+                wanted = self._next_claim_set_to_mint()
+                while wanted is None:
+                    self._condition.wait(timeout=self._max_age / 2)
+                    wanted = self._next_claim_set_to_mint()
+            claim_set, pool = wanted
+            try:
+                token = self._mint(**claim_set)
+            except Exception:
+                # Leave minting to the calling thread, where the error will surface in the test that needs it
+                with self._condition:
+                    self._minter_failed = True
+                    self._minter = None
+                return
+            with self._condition:
+                pool.append((time(), token))
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+"""
+load_generator.py
+
+Drives GET FHIR/R4/Immunization at a fixed request rate and reports latency
+percentiles, throughput and the error mix by status code and Accept version.
+
+Intended to be run against a local sandbox (make start-sandbox) before each release:
+
+  poetry run python -m tests.load_generator --rate=200 --duration=60
+
+Usage:
+  load_generator.py [--base-url=<url>] [--rate=<rps>] [--duration=<seconds>] [--concurrency=<n>] [--json=<path>]
+
+Options:
+  --base-url=<url>      Server to send requests to [default: http://localhost:9000]
+  --rate=<rps>          Target request rate, in requests per second [default: 50]
+  --duration=<seconds>  How long to generate load for [default: 30]
+  --concurrency=<n>     Maximum number of requests in flight [default: 100]
+  --json=<path>         Also write the report to this file as JSON
+"""
+import asyncio
+import itertools
+import json
+import math
+import time
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional
+
+import aiohttp
+from docopt import docopt
+
+from tests.api_tests import _base_valid_uri, _valid_uri_immunization_target, _valid_uri_procedure_below
+
+SANDBOX_NHS_NUMBER = "9000000009"
+SANDBOX_EMPTY_NHS_NUMBER = "9000000033"
+ACCEPT_VERSIONS = [None, "version=1", "version=2"]
+PERCENTILES = [50, 95, 99]
+
+
+class Scenario(NamedTuple):
+    name: str
+    uri: str
+    accept: Optional[str]
+
+
+class Sample(NamedTuple):
+    scenario: str
+    version: str
+    status: str
+    latency: float
+
+
+def _scenarios() -> List[Scenario]:
+    uris = {
+        "procedure_below": _valid_uri_procedure_below(SANDBOX_NHS_NUMBER, "90640007"),
+        "target_covid19": _valid_uri_immunization_target(SANDBOX_NHS_NUMBER, "COVID19"),
+        "target_hpv": _valid_uri_immunization_target(SANDBOX_NHS_NUMBER, "HPV"),
+        "target_flu": _valid_uri_immunization_target(SANDBOX_NHS_NUMBER, "FLU"),
+        "empty_history": _valid_uri_immunization_target(SANDBOX_EMPTY_NHS_NUMBER, "COVID19"),
+        "missing_target": _base_valid_uri(SANDBOX_NHS_NUMBER),
+    }
+    return [
+        Scenario(name=name, uri=uri, accept=accept)
+        for name, uri in uris.items()
+        for accept in ACCEPT_VERSIONS
+    ]
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return float("nan")
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+async def _send(session: aiohttp.ClientSession, base_url: str, scenario: Scenario, scheduled_at: float,
+                limit: asyncio.Semaphore, samples: List[Sample]):
+    headers = {"Accept": scenario.accept} if scenario.accept else {}
+    async with limit:
+        try:
+            async with session.get(f"{base_url}/{scenario.uri}", headers=headers) as resp:
+                await resp.read()
+                status = str(resp.status)
+        except aiohttp.ClientError as e:
+            status = f"error:{type(e).__name__}"
+    # Latency is measured from when the request was due, not when it was sent, so that
+    # queueing behind a saturated server shows up in the percentiles (coordinated omission)
+    samples.append(
+        Sample(
+            scenario=scenario.name,
+            version=scenario.accept or "default",
+            status=status,
+            latency=time.monotonic() - scheduled_at,
+        )
+    )
+
+
+async def generate_load(base_url: str, rate: float, duration: float, concurrency: int) -> Dict:
+    """Sends requests at a fixed rate (open loop) for the given duration and returns the report"""
+    samples: List[Sample] = []
+    limit = asyncio.Semaphore(concurrency)
+    scenarios = itertools.cycle(_scenarios())
+    total_requests = int(rate * duration)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started_at = time.monotonic()
+        tasks = []
+        for i in range(total_requests):
+            scheduled_at = started_at + i / rate
+            delay = scheduled_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(
+                asyncio.ensure_future(_send(session, base_url, next(scenarios), scheduled_at, limit, samples))
+            )
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - started_at
+
+    return build_report(samples, elapsed, rate)
+
+
+def build_report(samples: List[Sample], elapsed: float, target_rate: float) -> Dict:
+    latencies = sorted(sample.latency for sample in samples)
+    errors = [sample for sample in samples if not sample.status.startswith("2")]
+    return {
+        "requests": len(samples),
+        "elapsed_seconds": round(elapsed, 3),
+        "target_rate": target_rate,
+        "throughput": round(len(samples) / elapsed, 2) if elapsed else 0,
+        "latency_ms": {
+            f"p{pct}": round(percentile(latencies, pct) * 1000, 2) for pct in PERCENTILES
+        },
+        "error_rate": round(len(errors) / len(samples), 4) if samples else 0,
+        "status_codes": dict(Counter(sample.status for sample in samples)),
+        "by_version": {
+            version: dict(Counter(sample.status for sample in samples if sample.version == version))
+            for version in sorted({sample.version for sample in samples})
+        },
+    }
+
+
+def print_report(report: Dict):
+    print(f"requests:    {report['requests']} in {report['elapsed_seconds']}s")
+    print(f"throughput:  {report['throughput']} req/s (target {report['target_rate']} req/s)")
+    print("latency:     " + ", ".join(f"{k}={v}ms" for k, v in report["latency_ms"].items()))
+    print(f"error rate:  {report['error_rate']:.2%}")
+    print("status codes by Accept version:")
+    for version, statuses in report["by_version"].items():
+        print(f"  {version:<10} " + ", ".join(f"{k}: {v}" for k, v in sorted(statuses.items())))
+
+
+def main(arguments):
+    """Program entry point"""
+    report = asyncio.run(
+        generate_load(
+            base_url=arguments["--base-url"].rstrip("/"),
+            rate=float(arguments["--rate"]),
+            duration=float(arguments["--duration"]),
+            concurrency=int(arguments["--concurrency"]),
+        )
+    )
+    print_report(report)
+    if arguments["--json"]:
+        with open(arguments["--json"], "w") as out_file:
+            json.dump(report, out_file, indent=2)
+
+
+if __name__ == "__main__":
+    main(arguments=docopt(__doc__, version="0"))
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+"""
+proxy_benchmark.py
+
+Measures the live proxy's target PreFlow in the proxy emulator, for apps with different numbers of
+authorised targets, with the proxy's caches and without them (every lookup misses). Reports requests per
+second and flow variable lookups per request, in total and for the authorised targets alone.
+
+  poetry run python -m tests.proxy_benchmark --targets=1,10,100
+
+Usage:
+  proxy_benchmark.py [--targets=<counts>] [--requests=<n>]
+
+Options:
+  --targets=<counts>  Comma-separated numbers of authorised targets to measure [default: 1,10,100]
+  --requests=<n>      Requests to send for each measurement [default: 5000]
+"""
+import json
+import uuid
+from time import perf_counter
+from typing import Dict
+
+from docopt import docopt
+
+from tests.proxy_emulator import EmulatedApp, FlowContext, ProxyEmulator
+
+PATH = "/FHIR/R4/Immunization?patient.identifier=https://fhir.nhs.uk/Id/nhs-number|9000000009"
+AUTHORISED_TARGETS_PREFIX = "apim-app-flow-vars.immunisation-history.authorised_targets"
+
+
+class _LookupCounter:
+    """Counts FlowContext.get_variable calls while in use"""
+
+    def __init__(self):
+        self.total = 0
+        self.authorised_targets = 0
+        self._get_variable = FlowContext.get_variable
+
+    def __enter__(self):
+        counter, get_variable = self, self._get_variable
+
+        def counting_get_variable(ctx, name):
+            counter.total += 1
+            if name.startswith(AUTHORISED_TARGETS_PREFIX):
+                counter.authorised_targets += 1
+            return get_variable(ctx, name)
+
+        FlowContext.get_variable = counting_get_variable
+        return self
+
+    def __exit__(self, *exc_info):
+        FlowContext.get_variable = self._get_variable
+
+
+def measure(targets: int, requests: int, caches: bool) -> Dict:
+    emulator = ProxyEmulator(rate_limits=False, caches=caches)
+    flow_vars = {"immunisation-history": {"authorised_targets": [f"TARGET{i}" for i in range(targets)]}}
+    app = EmulatedApp(
+        app_id=str(uuid.uuid4()), name="benchmark-app", attributes={"apim-app-flow-vars": json.dumps(flow_vars)}
+    )
+    headers = {"Authorization": f"Bearer {emulator.issue_token(app)}"}
+    # Warm up, which also fills the cache
+    assert emulator.handle("GET", PATH, headers).status == 200
+
+    started_at = perf_counter()
+    for _ in range(requests):
+        emulator.handle("GET", PATH, headers)
+    elapsed = perf_counter() - started_at
+
+    with _LookupCounter() as lookups:
+        emulator.handle("GET", PATH, headers)
+
+    return {
+        "targets": targets,
+        "caches": caches,
+        "requests_per_second": round(requests / elapsed),
+        "lookups": lookups.total,
+        "authorised_targets_lookups": lookups.authorised_targets,
+    }
+
+
+def main(arguments):
+    """Program entry point"""
+    requests = int(arguments["--requests"])
+    print(f"{'targets':>8} {'caches':>7} {'req/s':>8} {'lookups':>8} {'of which targets':>17}")
+    for targets in (int(count) for count in arguments["--targets"].split(",")):
+        for caches in (False, True):
+            result = measure(targets, requests, caches)
+            print(
+                f"{result['targets']:>8} {'on' if caches else 'off':>7} {result['requests_per_second']:>8} "
+                f"{result['lookups']:>8} {result['authorised_targets_lookups']:>17}"
+            )
+
+
+if __name__ == "__main__":
+    main(arguments=docopt(__doc__, version="0"))
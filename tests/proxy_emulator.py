@@ -0,0 +1,741 @@
+#!/usr/bin/env python
+
+"""
+proxy_emulator.py
+
+Runs the live proxy's target PreFlow (proxies/live/apiproxy/targets/ih-target.xml) in process, in front of
+a sandbox, so that the authorised targets, request URL and client RP details logic can be tested and
+benchmarked without deploying to Apigee.
+
+Steps, conditions and FaultRules are read from the proxy bundle and executed in the same order as Apigee
+would. AssignMessage, RaiseFault, ExtractVariables, the cache and the rate limiting policies are
+interpreted from their XML; the JS resources are ported to Python in JS_RESOURCES and must be kept in
+step with them. Access tokens are issued by the emulator itself, see ProxyEmulator.issue_token.
+
+  poetry run python -m tests.proxy_emulator --sandbox-url=http://localhost:9000
+
+Usage:
+  proxy_emulator.py [--sandbox-url=<url>] [--port=<port>] [--environment=<name>] [--no-rate-limits]
+
+Options:
+  --sandbox-url=<url>   Sandbox to forward emulated target requests to [default: http://localhost:9000]
+  --port=<port>         Port to listen on [default: 9001]
+  --environment=<name>  Value of environment.name, "prod" forces strict authorised targets [default: internal-dev]
+  --no-rate-limits      Skip the Quota and SpikeArrest steps
+"""
+import json
+import re
+import threading
+import uuid
+import xml.etree.ElementTree as ET
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from time import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import requests
+from docopt import docopt
+
+from tests.rate_governor import TIME_UNIT_SECONDS, TokenBucket, _spike_arrest_bucket
+
+APIPROXY_DIR = Path(__file__).parent.parent / "proxies" / "live" / "apiproxy"
+TARGET_ENDPOINT = "ih-target.xml"
+PROXY_BASE_PATH = "/immunisation-history"
+DEFAULT_HOST = "internal-dev.api.service.nhs.uk"
+CLIENT_CREDENTIALS_SCOPE = "urn:nhsd:apim:app:level3:immunisation-history"
+TOKEN_EXCHANGE_SCOPE = "urn:nhsd:apim:user-nhs-login:P9:immunisation-history"
+# Request headers that are not passed on from the client to the target, as with any HTTP proxy
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "host", "content-length"}
+
+
+class EmulatedApp(NamedTuple):
+    app_id: str
+    name: str
+    attributes: Dict[str, str]
+
+
+class EmulatedToken(NamedTuple):
+    app: EmulatedApp
+    grant_type: str
+    scope: str
+    id_token: Optional[str]
+
+
+class EmulatedResponse(NamedTuple):
+    status: int
+    headers: Dict[str, str]
+    body: bytes
+
+
+class Headers:
+    """Ordered, case-insensitive list of headers that, like Apigee's, allows repeated names"""
+
+    def __init__(self, items: List[Tuple[str, str]] = ()):
+        self.items = list(items)
+
+    def get(self, name: str) -> Optional[str]:
+        name = name.lower()
+        for key, value in self.items:
+            if key.lower() == name:
+                return value
+        return None
+
+    def add(self, name: str, value: str):
+        self.items.append((name, value))
+
+    def names(self) -> List[str]:
+        names = []
+        for key, _ in self.items:
+            if key not in names:
+                names.append(key)
+        return names
+
+
+class TargetRequest(NamedTuple):
+    method: str
+    path_suffix: str
+    query: str
+    headers: Headers
+    body: bytes = b""
+
+
+class FlowContext:
+    """Flow variables for one request; `request.*` variables read from the target request as it is built"""
+
+    def __init__(self, request: TargetRequest, variables: Dict):
+        self.request = request
+        self.variables = variables
+
+    def get_variable(self, name: str):
+        if name.startswith("request.header."):
+            return self.request.headers.get(name[len("request.header."):])
+        if name == "request.headers.names":
+            return self.request.headers.names()
+        return self.variables.get(name)
+
+    def set_variable(self, name: str, value):
+        self.variables[name] = value
+
+
+class _Fault(Exception):
+    def __init__(self, name: str, response: EmulatedResponse, variables: Dict = None):
+        super().__init__(name)
+        self.name = name
+        self.response = response
+        self.variables = variables or {}
+
+
+def _json_response(status: int, body, headers: Dict[str, str] = None) -> EmulatedResponse:
+    return EmulatedResponse(
+        status=status,
+        headers={"Content-Type": "application/json", **(headers or {})},
+        body=json.dumps(body).encode() if not isinstance(body, bytes) else body,
+    )
+
+
+def _apigee_fault(status: int, fault_string: str, error_code: str) -> EmulatedResponse:
+    return _json_response(status, {"fault": {"faultstring": fault_string, "detail": {"errorcode": error_code}}})
+
+
+def _as_string(value) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+# Conditions
+
+_CONDITION_TOKEN = re.compile(r'\s*(\(|\)|"[^"]*"|[^\s()"]+)')
+_EQUALS_OPERATORS = {"==", "=", "equals", "is"}
+_NOT_EQUALS_OPERATORS = {"!=", "notequals", "isnot"}
+_LITERALS = {"null": None, "true": "true", "false": "false"}
+
+Condition = Callable[[FlowContext], bool]
+
+
+def _tokenize(condition: str) -> List[str]:
+    return [token for token in _CONDITION_TOKEN.findall(condition) if token]
+
+
+def _operand(token: str):
+    if token.startswith('"'):
+        return token[1:-1]
+    return _LITERALS.get(token.lower(), token)
+
+
+def _equals(actual, expected) -> bool:
+    if actual is None or expected is None:
+        return actual is None and expected is None
+    return _as_string(actual) == _as_string(expected)
+
+
+class _ConditionParser:
+    """
+    Compiles the subset of Apigee's condition language used by the proxy into a Python callable:
+    parentheses, and/or, and comparisons of a flow variable against a literal. A bare variable is
+    true when it holds true or "true".
+    """
+
+    def __init__(self, condition: str):
+        self.condition = condition
+        self.tokens = _tokenize(condition)
+        self.position = 0
+
+    def parse(self) -> Condition:
+        compiled = self._or()
+        if self.position != len(self.tokens):
+            raise ValueError(f"Unexpected {self._peek()!r} in condition {self.condition!r}")
+        return compiled
+
+    def _peek(self) -> Optional[str]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _take(self) -> str:
+        token = self._peek()
+        if token is None:
+            raise ValueError(f"Unexpected end of condition {self.condition!r}")
+        self.position += 1
+        return token
+
+    def _or(self) -> Condition:
+        operands = [self._and()]
+        while (self._peek() or "").lower() == "or":
+            self._take()
+            operands.append(self._and())
+        return operands[0] if len(operands) == 1 else lambda ctx: any(operand(ctx) for operand in operands)
+
+    def _and(self) -> Condition:
+        operands = [self._comparison()]
+        while (self._peek() or "").lower() == "and":
+            self._take()
+            operands.append(self._comparison())
+        return operands[0] if len(operands) == 1 else lambda ctx: all(operand(ctx) for operand in operands)
+
+    def _comparison(self) -> Condition:
+        if self._peek() == "(":
+            self._take()
+            compiled = self._or()
+            if self._take() != ")":
+                raise ValueError(f"Unbalanced parentheses in condition {self.condition!r}")
+            return compiled
+
+        variable = self._take()
+        operator = (self._peek() or "").lower()
+        if operator in _EQUALS_OPERATORS or operator in _NOT_EQUALS_OPERATORS:
+            self._take()
+            expected = _operand(self._take())
+            if operator in _EQUALS_OPERATORS:
+                return lambda ctx: _equals(ctx.get_variable(variable), expected)
+            return lambda ctx: not _equals(ctx.get_variable(variable), expected)
+        return lambda ctx: _as_string(ctx.get_variable(variable)) == "true"
+
+
+def compile_condition(condition: Optional[str]) -> Optional[Condition]:
+    if condition is None or not condition.strip():
+        return None
+    return _ConditionParser(condition.strip()).parse()
+
+
+# Policies
+
+_TEMPLATE_VARIABLE = re.compile(r"{([^{}]+)}")
+
+
+def _text(element: Optional[ET.Element], default: str = "") -> str:
+    return element.text.strip() if element is not None and element.text else default
+
+
+class _AssignMessage:
+    def __init__(self, policy: ET.Element):
+        self.name = policy.get("name")
+        self.ignore_unresolved = _text(policy.find("IgnoreUnresolvedVariables"), "false") == "true"
+        self.variables = [
+            (_text(assign.find("Name")), _text(assign.find("Value"))) for assign in policy.findall("AssignVariable")
+        ]
+        self.headers = [(header.get("name"), _text(header)) for header in policy.findall("Add/Headers/Header")]
+
+    def _resolve(self, ctx: FlowContext, template: str) -> str:
+        def substitute(match):
+            value = ctx.get_variable(match.group(1))
+            if value is None:
+                if not self.ignore_unresolved:
+                    message = f"Failed to Resolve Variable : policy({self.name}) variable({match.group(1)})"
+                    raise _Fault(
+                        "UnresolvedVariable",
+                        _apigee_fault(500, message, "steps.assignmessage.UnresolvedVariable"),
+                        {"error.message": message},
+                    )
+                return ""
+            return _as_string(value)
+
+        return _TEMPLATE_VARIABLE.sub(substitute, template)
+
+    def __call__(self, ctx: FlowContext):
+        for name, value in self.variables:
+            ctx.set_variable(name, value)
+        for name, template in self.headers:
+            ctx.request.headers.add(name, self._resolve(ctx, template))
+
+
+class _RaiseFault:
+    def __init__(self, policy: ET.Element):
+        payload = policy.find("FaultResponse/Set/Payload")
+        self.response = EmulatedResponse(
+            status=int(_text(policy.find("FaultResponse/Set/StatusCode"), "500")),
+            headers={"Content-Type": payload.get("contentType")} if payload is not None else {},
+            body=_text(payload).encode(),
+        )
+        self.variables = {
+            _text(assign.find("Name")): _text(assign.find("Value"))
+            for assign in policy.findall("FaultResponse/AssignVariable")
+        }
+
+    def __call__(self, ctx: FlowContext):
+        raise _Fault("RaiseFault", self.response, self.variables)
+
+
+class _VerifyAccessToken:
+    def __init__(self, policy: ET.Element, tokens: Dict[str, EmulatedToken]):
+        self.name = policy.get("name")
+        self.scopes = set(_text(policy.find("Scope")).split())
+        self.tokens = tokens
+
+    def _fail(self, response: EmulatedResponse):
+        raise _Fault("InvalidAccessToken", response, {f"oauthV2.{self.name}.failed": True})
+
+    def __call__(self, ctx: FlowContext):
+        authorization = ctx.get_variable("request.header.Authorization") or ""
+        scheme, _, access_token = authorization.partition(" ")
+        if scheme.lower() != "bearer" or not access_token:
+            self._fail(_apigee_fault(401, "Invalid access token", "oauth.v2.InvalidAccessToken"))
+        token = self.tokens.get(access_token.strip())
+        if token is None:
+            self._fail(_apigee_fault(401, "Invalid access token", "keymanagement.service.invalid_access_token"))
+        if self.scopes and not self.scopes.intersection(token.scope.split()):
+            self._fail(
+                _apigee_fault(403, f"Required scope(s) : {' '.join(sorted(self.scopes))}", "oauth.v2.InsufficientScope")
+            )
+
+        ctx.set_variable("accesstoken.auth_grant_type", token.grant_type)
+        if token.id_token is not None:
+            ctx.set_variable("accesstoken.id_token", token.id_token)
+        ctx.set_variable("developer.app.name", token.app.name)
+        ctx.set_variable("developer.app.id", token.app.app_id)
+        for name, value in token.app.attributes.items():
+            ctx.set_variable(f"app.{name}", value)
+
+
+def _flatten(prefix: str, value, variables: Dict):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            _flatten(f"{prefix}.{key}", item, variables)
+    elif isinstance(value, list):
+        # Arrays are available as a whole as well as item by item, see AuthorisedTargets.PopulateFromApp.js
+        variables[prefix] = json.dumps(value)
+        for index, item in enumerate(value):
+            _flatten(f"{prefix}.{index}", item, variables)
+    elif value is not None:
+        variables[prefix] = value
+
+
+def _extended_attributes(ctx: FlowContext):
+    """Stands in for the ExtendedAttributes shared flow, which flattens the app's apim-app-flow-vars JSON"""
+    raw = ctx.get_variable("app.apim-app-flow-vars")
+    if raw:
+        _flatten("apim-app-flow-vars", json.loads(raw), ctx.variables)
+
+
+_APP_ATTRIBUTE_XPATH = re.compile(r"/App/Attributes/Attribute\[Name='([^']+)'\]/Value")
+
+
+class _ExtractAppAttributes:
+    """ExtractVariables reading app attributes out of the AccessEntity.GetApp profile, by XPath"""
+
+    def __init__(self, policy: ET.Element):
+        self.variables = []
+        for variable in policy.findall("XMLPayload/Variable"):
+            match = _APP_ATTRIBUTE_XPATH.fullmatch(_text(variable.find("XPath")))
+            if match is None:
+                raise ValueError(f"Unsupported XPath in {policy.get('name')}")
+            self.variables.append((variable.get("name"), match.group(1)))
+
+    def __call__(self, ctx: FlowContext):
+        for name, attribute in self.variables:
+            value = ctx.get_variable(f"app.{attribute}")
+            if value is not None:
+                ctx.set_variable(name, value)
+
+
+class _Quota:
+    """Calendar quota, counting requests in fixed windows of Interval x TimeUnit"""
+
+    def __init__(self, policy: ET.Element):
+        self.allow = int(policy.find("Allow").get("count"))
+        self.window_seconds = int(_text(policy.find("Interval"))) * TIME_UNIT_SECONDS[_text(policy.find("TimeUnit"))]
+        self._window = None
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, ctx: FlowContext):
+        with self._lock:
+            window = int(time() // self.window_seconds)
+            if window != self._window:
+                self._window, self._used = window, 0
+            self._used += 1
+            exceeded = self._used > self.allow
+        if exceeded:
+            message = "Rate limit quota violation. Quota limit exceeded."
+            raise _Fault("QuotaViolation", _apigee_fault(429, message, "policies.ratelimit.QuotaViolation"))
+
+
+def _cache_key(policy: ET.Element):
+    prefix = _text(policy.find("CacheKey/Prefix"))
+    fragments = [(fragment.get("ref"), _text(fragment)) for fragment in policy.findall("CacheKey/KeyFragment")]
+
+    def key(ctx: FlowContext) -> str:
+        values = [_as_string(ctx.get_variable(ref)) if ref else text for ref, text in fragments]
+        return "__".join([prefix] + values if prefix else values)
+
+    return key
+
+
+class _LookupCache:
+    def __init__(self, policy: ET.Element, cache: Optional[Dict]):
+        self.name = policy.get("name")
+        self.key = _cache_key(policy)
+        self.assign_to = _text(policy.find("AssignTo"))
+        self.cache = cache
+
+    def __call__(self, ctx: FlowContext):
+        entry = self.cache.get(self.key(ctx)) if self.cache is not None else None
+        hit = entry is not None and entry[0] > time()
+        ctx.set_variable(f"lookupcache.{self.name}.cachehit", hit)
+        if hit:
+            ctx.set_variable(self.assign_to, entry[1])
+
+
+class _PopulateCache:
+    def __init__(self, policy: ET.Element, cache: Optional[Dict]):
+        self.key = _cache_key(policy)
+        self.timeout = int(_text(policy.find("ExpirySettings/TimeoutInSec"), "300"))
+        self.source = _text(policy.find("Source"))
+        self.cache = cache
+
+    def __call__(self, ctx: FlowContext):
+        value = ctx.get_variable(self.source)
+        if self.cache is not None and value is not None:
+            self.cache[self.key(ctx)] = (time() + self.timeout, value)
+
+
+class _SpikeArrest:
+    def __init__(self, policy: ET.Element):
+        self.bucket: TokenBucket = _spike_arrest_bucket(policy)
+
+    def __call__(self, ctx: FlowContext):
+        if not self.bucket.try_take():
+            raise _Fault(
+                "SpikeArrestViolation",
+                _apigee_fault(429, "Spike arrest violation.", "policies.ratelimit.SpikeArrestViolation"),
+            )
+
+
+def _no_op(ctx: FlowContext):
+    pass
+
+
+# JS resources, ported
+
+def _request_inspection(ctx: FlowContext):
+    header_names = {name.lower() for name in ctx.get_variable("request.headers.names")}
+    ctx.set_variable("apigee.AUTHORISED_TARGETS_ALREADY_IN_HEADER", "authorised_targets" in header_names)
+    ctx.set_variable("apigee.REQUEST_URL_ALREADY_IN_HEADER", "x-request-url" in header_names)
+
+    in_prod_environment = ctx.get_variable("environment.name") == "prod"
+    use_strict_authorised_targets = ctx.get_variable("app.use_strict_authorised_targets") == "true"
+    ctx.set_variable("apigee.USE_STRICT_AUTHORISED_TARGETS", use_strict_authorised_targets or in_prod_environment)
+
+    req_url = (
+        f"{ctx.get_variable('client.scheme')}://{ctx.get_variable('request.header.host')}"
+        f"{ctx.get_variable('request.uri')}"
+    )
+    ctx.set_variable("apigee.X_REQUEST_URL", req_url)
+
+    client_rp_details_header = {
+        "developer.app.name": ctx.get_variable("developer.app.name"),
+        "developer.app.id": ctx.get_variable("developer.app.id"),
+        "developer.app.nhs-login-minimum-proofing-level": ctx.get_variable("nhs-login-allowed-proofing-level"),
+        "client.ip": ctx.get_variable("client.ip"),
+    }
+    ctx.request.headers.add("NHSD-Client-RP-Details", json.dumps(client_rp_details_header))
+
+
+def _authorised_targets_populate_from_app(ctx: FlowContext):
+    flow_var_prefix = "apim-app-flow-vars.immunisation-history.authorised_targets"
+    authorised_targets = ctx.get_variable(flow_var_prefix)
+    if authorised_targets != "*":
+        collection = []
+        while True:
+            authorised_target = ctx.get_variable(f"{flow_var_prefix}.{len(collection)}")
+            if authorised_target is None:
+                break
+            collection.append(_as_string(authorised_target))
+        authorised_targets = ",".join(collection)
+    ctx.set_variable("apigee.AUTHORISED_TARGETS", authorised_targets)
+
+
+JS_RESOURCES: Dict[str, Callable[[FlowContext], None]] = {
+    "RequestInspection.js": _request_inspection,
+    "AuthorisedTargets.PopulateFromApp.js": _authorised_targets_populate_from_app,
+}
+
+
+def _javascript(policy: ET.Element) -> Callable[[FlowContext], None]:
+    resource = _text(policy.find("ResourceURL"))[len("jsc://"):]
+    if resource not in JS_RESOURCES:
+        raise ValueError(f"{policy.get('name')} uses {resource}, which has no Python port in JS_RESOURCES")
+    return JS_RESOURCES[resource]
+
+
+# Flow
+
+class _Step(NamedTuple):
+    name: str
+    condition: Optional[Condition]
+    policy: Callable[[FlowContext], None]
+
+
+class _FaultRule(NamedTuple):
+    name: str
+    condition: Optional[Condition]
+    steps: List[_Step]
+
+
+class ProxyEmulator:
+    """
+    Executes the target PreFlow for each request and, unless it faults, forwards the resulting target
+    request with `forward`. Without `forward`, successful requests get a 200 response whose body is the
+    target request that would have been sent, which is what the emulator's tests and benchmarks look at.
+    """
+
+    def __init__(
+        self,
+        forward: Callable[[TargetRequest], EmulatedResponse] = None,
+        environment: str = "internal-dev",
+        rate_limits: bool = True,
+        caches: bool = True,
+        apiproxy_dir: Path = APIPROXY_DIR,
+    ):
+        self.forward = forward
+        self.environment = environment
+        self.rate_limits = rate_limits
+        self.tokens: Dict[str, EmulatedToken] = {}
+        # Shared by the LookupCache and PopulateCache policies; without it every lookup misses
+        self.cache: Optional[Dict[str, Tuple[float, object]]] = {} if caches else None
+        # Steps refer to policies by their name attribute, which doesn't always match the file name
+        self._policy_elements = {
+            element.get("name"): element
+            for element in (ET.parse(path).getroot() for path in (apiproxy_dir / "policies").glob("*.xml"))
+        }
+        self._policies: Dict[str, Callable[[FlowContext], None]] = {}
+
+        target = ET.parse(apiproxy_dir / "targets" / TARGET_ENDPOINT).getroot()
+        self.preflow = self._steps(target.findall("PreFlow/Request/Step"))
+        self.fault_rules = [
+            _FaultRule(
+                name=rule.get("name"),
+                condition=compile_condition(rule.findtext("Condition")),
+                steps=self._steps(rule.findall("Step")),
+            )
+            for rule in target.findall("FaultRules/FaultRule")
+        ]
+
+    def _steps(self, steps: List[ET.Element]) -> List[_Step]:
+        return [
+            _Step(
+                name=step.findtext("Name").strip(),
+                condition=compile_condition(step.findtext("Condition")),
+                policy=self._policy(step.findtext("Name").strip()),
+            )
+            for step in steps
+        ]
+
+    def _policy(self, name: str) -> Callable[[FlowContext], None]:
+        if name not in self._policies:
+            self._policies[name] = self._build_policy(self._policy_elements[name])
+        return self._policies[name]
+
+    def _build_policy(self, policy: ET.Element) -> Callable[[FlowContext], None]:
+        if policy.tag == "OAuthV2":
+            return _VerifyAccessToken(policy, self.tokens)
+        if policy.tag == "FlowCallout" and _text(policy.find("SharedFlowBundle")) == "ExtendedAttributes":
+            return _extended_attributes
+        if policy.tag == "AssignMessage":
+            return _AssignMessage(policy)
+        if policy.tag == "RaiseFault":
+            return _RaiseFault(policy)
+        if policy.tag == "AccessEntity":
+            # The app profile is already in flow variables as app.*, see _VerifyAccessToken
+            return _no_op
+        if policy.tag == "ExtractVariables":
+            return _ExtractAppAttributes(policy)
+        if policy.tag == "Javascript":
+            return _javascript(policy)
+        if policy.tag == "LookupCache":
+            return _LookupCache(policy, self.cache)
+        if policy.tag == "PopulateCache":
+            return _PopulateCache(policy, self.cache)
+        if policy.tag == "Quota":
+            return _Quota(policy) if self.rate_limits else _no_op
+        if policy.tag == "SpikeArrest":
+            return _SpikeArrest(policy) if self.rate_limits else _no_op
+        raise ValueError(f"{policy.get('name')}: {policy.tag} policies are not emulated")
+
+    def issue_token(
+        self, app: EmulatedApp, grant_type: str = "client_credentials", id_token: str = None, scope: str = None
+    ) -> str:
+        """Registers an access token for the app, as the OAuth proxy would after a successful token request"""
+        if scope is None:
+            scope = TOKEN_EXCHANGE_SCOPE if grant_type == "token_exchange" else CLIENT_CREDENTIALS_SCOPE
+        access_token = uuid.uuid4().hex
+        self.tokens[access_token] = EmulatedToken(app=app, grant_type=grant_type, scope=scope, id_token=id_token)
+        return access_token
+
+    def _run_fault_rules(self, ctx: FlowContext, fault: _Fault) -> EmulatedResponse:
+        ctx.variables.update(fault.variables)
+        ctx.set_variable("fault.name", fault.name)
+        for rule in self.fault_rules:
+            if rule.condition is not None and not rule.condition(ctx):
+                continue
+            response = fault.response
+            for step in rule.steps:
+                if step.condition is None or step.condition(ctx):
+                    try:
+                        step.policy(ctx)
+                    except _Fault as raised:
+                        response = raised.response
+            return response
+        return fault.response
+
+    def handle(
+        self, method: str, path: str, headers: Dict[str, str], client_ip: str = "127.0.0.1", body: bytes = b""
+    ) -> EmulatedResponse:
+        """Handles a client request for `path`, relative to the proxy base path, e.g. /FHIR/R4/Immunization?..."""
+        path_suffix, _, query = path.partition("?")
+        client_headers = Headers(headers.items())
+        request = TargetRequest(
+            method=method,
+            path_suffix=path_suffix,
+            query=query,
+            headers=Headers(
+                [(name, value) for name, value in client_headers.items if name.lower() not in HOP_BY_HOP_HEADERS]
+                + [("host", client_headers.get("host") or DEFAULT_HOST)]
+            ),
+            body=body,
+        )
+        ctx = FlowContext(
+            request,
+            {
+                "environment.name": self.environment,
+                "client.ip": client_ip,
+                "client.scheme": "https",
+                "request.verb": method,
+                "request.uri": PROXY_BASE_PATH + path,
+                "proxy.pathsuffix": path_suffix,
+            },
+        )
+
+        try:
+            for step in self.preflow:
+                if step.condition is None or step.condition(ctx):
+                    step.policy(ctx)
+        except _Fault as fault:
+            return self._run_fault_rules(ctx, fault)
+
+        if self.forward is None:
+            return _json_response(
+                200,
+                {
+                    "method": method,
+                    "path": path_suffix,
+                    "query": query,
+                    "headers": request.headers.items,
+                    "body": body.decode(),
+                },
+            )
+        return self.forward(request)
+
+
+class SandboxForwarder:
+    """
+    Sends target requests to a running sandbox over a pooled connection
+
+    Like Apigee when no policy reads the response payload, the client's Accept-Encoding is passed on as it
+    is and compressed responses are passed back without being decompressed.
+    """
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        del self.session.headers["Accept-Encoding"]
+
+    def __call__(self, request: TargetRequest) -> EmulatedResponse:
+        url = f"{self.base_url}{request.path_suffix}" + (f"?{request.query}" if request.query else "")
+        headers = [(name, value) for name, value in request.headers.items if name.lower() != "host"]
+        response = self.session.request(
+            request.method, url, headers=dict(headers), data=request.body or None, stream=True
+        )
+        return EmulatedResponse(
+            status=response.status_code,
+            headers={
+                name: value for name, value in response.headers.items() if name.lower() not in HOP_BY_HOP_HEADERS
+            },
+            body=response.raw.read(decode_content=False),
+        )
+
+
+def serve(emulator: ProxyEmulator, port: int):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self._handle("GET", b"")
+
+        def do_POST(self):
+            self._handle("POST", self.rfile.read(int(self.headers.get("Content-Length") or 0)))
+
+        def _handle(self, method: str, body: bytes):
+            response = emulator.handle(method, self.path, dict(self.headers.items()), self.client_address[0], body)
+            self.send_response(response.status)
+            for name, value in response.headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(response.body)))
+            self.end_headers()
+            self.wfile.write(response.body)
+
+        def log_message(self, format, *args):
+            pass
+
+    ThreadingHTTPServer(("", port), Handler).serve_forever()
+
+
+def main(arguments):
+    """Program entry point"""
+    sandbox_url = arguments["--sandbox-url"]
+    emulator = ProxyEmulator(
+        forward=SandboxForwarder(sandbox_url),
+        environment=arguments["--environment"],
+        rate_limits=not arguments["--no-rate-limits"],
+    )
+    app = EmulatedApp(
+        app_id=str(uuid.uuid4()),
+        name="proxy-emulator",
+        attributes={"apim-app-flow-vars": json.dumps({"immunisation-history": {"authorised_targets": "*"}})},
+    )
+    port = int(arguments["--port"])
+    print(f"Listening on http://localhost:{port}, forwarding to {sandbox_url}")
+    print(f"Authorization: Bearer {emulator.issue_token(app)}")
+    serve(emulator, port)
+
+
+if __name__ == "__main__":
+    main(arguments=docopt(__doc__, version="0"))
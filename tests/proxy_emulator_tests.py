@@ -0,0 +1,211 @@
+import gzip
+import json
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from tests.proxy_emulator import (
+    EmulatedApp,
+    FlowContext,
+    Headers,
+    ProxyEmulator,
+    SandboxForwarder,
+    TargetRequest,
+    compile_condition,
+)
+
+PATH = "/FHIR/R4/Immunization?patient.identifier=https://fhir.nhs.uk/Id/nhs-number|9000000009"
+
+
+def _app(authorised_targets=None, **attributes) -> EmulatedApp:
+    if authorised_targets is not None:
+        flow_vars = {"immunisation-history": {"authorised_targets": authorised_targets}}
+        attributes["apim-app-flow-vars"] = json.dumps(flow_vars)
+    return EmulatedApp(app_id=str(uuid.uuid4()), name="app-name", attributes=attributes)
+
+
+def _send(emulator: ProxyEmulator, app: EmulatedApp, headers: dict = None, **token_kwargs):
+    token = emulator.issue_token(app, **token_kwargs)
+    response = emulator.handle("GET", PATH, {"Authorization": f"Bearer {token}", **(headers or {})})
+    return response.status, json.loads(response.body) if response.body else None
+
+
+def _target_headers(body: dict) -> dict:
+    return {name: value for name, value in body["headers"]}
+
+
+@pytest.fixture
+def emulator():
+    return ProxyEmulator(rate_limits=False)
+
+
+@pytest.mark.parametrize(
+    "condition,variables,expected",
+    [
+        ('accesstoken.auth_grant_type == "token_exchange"', {"accesstoken.auth_grant_type": "token_exchange"}, True),
+        ("apigee.FLAG is true", {"apigee.FLAG": True}, True),
+        ("apigee.FLAG is true", {"apigee.FLAG": False}, False),
+        ("apigee.VALUE IsNot null", {}, False),
+        ('(apigee.VALUE is null) or (apigee.VALUE Equals "")', {"apigee.VALUE": ""}, True),
+        ('(apigee.FLAG is false) and ((apigee.VALUE Equals "*"))', {"apigee.FLAG": False, "apigee.VALUE": "*"}, True),
+        ("oauthV2.OauthV2.VerifyAccessToken.failed", {}, False),
+    ],
+)
+def test_conditions(condition, variables, expected):
+    ctx = FlowContext(TargetRequest("GET", "/", "", Headers()), variables)
+    assert compile_condition(condition)(ctx) is expected
+
+
+def test_invalid_access_token(emulator):
+    response = emulator.handle("GET", PATH, {"Authorization": "Bearer not-a-token"})
+
+    assert response.status == 401
+    assert json.loads(response.body)["issue"][0]["diagnostics"] == "Provided access token is invalid"
+
+
+@pytest.mark.parametrize(
+    "authorised_targets,expected", [(None, "*"), ("*", "*"), (["COVID19", "HPV"], "COVID19,HPV")]
+)
+def test_authorised_targets_header(emulator, authorised_targets, expected):
+    status, body = _send(emulator, _app(authorised_targets))
+
+    assert status == 200
+    assert _target_headers(body)["AUTHORISED_TARGETS"] == expected
+
+
+@pytest.mark.parametrize("authorised_targets", ["", "somethingInvalid", []])
+def test_missing_authorised_targets(emulator, authorised_targets):
+    status, body = _send(emulator, _app(authorised_targets))
+
+    assert status == 401
+    assert body["error"] == "access_denied"
+
+
+@pytest.mark.parametrize("environment,attributes", [("prod", {}), ("int", {"use_strict_authorised_targets": "true"})])
+def test_strict_authorised_targets_cannot_be_all(environment, attributes):
+    emulator = ProxyEmulator(environment=environment, rate_limits=False)
+
+    assert _send(emulator, _app("*", **attributes))[0] == 403
+    assert _send(emulator, _app(None, **attributes))[0] == 401
+    assert _send(emulator, _app(["COVID19"], **attributes))[0] == 200
+
+
+@pytest.mark.parametrize("header", ["AUTHORISED_TARGETS", "authorised_targets", "X-Request-Url", "x-request-url"])
+def test_headers_cannot_be_provided_by_client(emulator, header):
+    status, body = _send(emulator, _app("*"), headers={header: "anything"})
+
+    assert status == 404
+    assert body["error"] == "invalid_request"
+
+
+def test_request_url_and_client_rp_details(emulator):
+    app = _app("*", **{"nhs-login-allowed-proofing-level": "P9"})
+
+    _, body = _send(emulator, app, headers={"Host": "int.api.service.nhs.uk"})
+    headers = _target_headers(body)
+
+    assert headers["X-Request-Url"] == f"https://int.api.service.nhs.uk/immunisation-history{PATH}"
+    assert json.loads(headers["NHSD-Client-RP-Details"]) == {
+        "developer.app.name": "app-name",
+        "developer.app.id": app.app_id,
+        "developer.app.nhs-login-minimum-proofing-level": "P9",
+        "client.ip": "127.0.0.1",
+    }
+
+
+def test_token_exchange_adds_user_identity(emulator):
+    status, body = _send(emulator, _app("*"), grant_type="token_exchange", id_token="id-token")
+
+    assert status == 200
+    assert _target_headers(body)["NHSD-User-Identity"] == "id-token"
+
+
+@pytest.mark.parametrize("id_token", [None, ""])
+def test_token_exchange_without_id_token(emulator, id_token):
+    status, body = _send(emulator, _app("*"), grant_type="token_exchange", id_token=id_token)
+
+    assert status == 400
+    assert body["error"] == "invalid_request"
+
+
+def test_spike_arrest():
+    emulator = ProxyEmulator()
+    app = _app("*")
+
+    assert [_send(emulator, app)[0] for _ in range(2)] == [200, 429]
+
+
+def test_authorised_targets_are_cached_per_app(emulator):
+    app = _app(["COVID19"])
+    _send(emulator, app)
+
+    _, cached = _send(emulator, app._replace(attributes=_app(["HPV"]).attributes))
+    _, other_app = _send(emulator, _app(["HPV"]))
+
+    assert _target_headers(cached)["AUTHORISED_TARGETS"] == "COVID19"
+    assert _target_headers(other_app)["AUTHORISED_TARGETS"] == "HPV"
+
+
+def test_batch_is_authorised_once_for_all_of_its_searches():
+    emulator = ProxyEmulator()
+    token = emulator.issue_token(_app(["COVID19", "HPV"]))
+    search = PATH.split("/")[-1]
+    batch = json.dumps(
+        {
+            "resourceType": "Bundle",
+            "type": "batch",
+            "entry": [
+                {"request": {"method": "GET", "url": f"{search}&immunization.target={target}"}}
+                for target in ["COVID19", "HPV", "FLU"]
+            ],
+        }
+    ).encode()
+
+    response = emulator.handle("POST", "/FHIR/R4", {"Authorization": f"Bearer {token}"}, body=batch)
+    body = json.loads(response.body)
+
+    assert response.status == 200
+    assert (body["method"], body["path"], body["body"]) == ("POST", "/FHIR/R4", batch.decode())
+    assert [name for name, _ in body["headers"]].count("AUTHORISED_TARGETS") == 1
+    assert _target_headers(body)["AUTHORISED_TARGETS"] == "COVID19,HPV"
+
+
+@pytest.fixture
+def gzip_target():
+    """A target that gzips its response when the request accepts it, and records the Accept-Encoding it was sent"""
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            received.append(self.headers.get("Accept-Encoding"))
+            body = b'{"resourceType": "Bundle"}'
+            self.send_response(200)
+            if "gzip" in (self.headers.get("Accept-Encoding") or ""):
+                body = gzip.compress(body)
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("localhost", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://localhost:{server.server_address[1]}", received
+    server.shutdown()
+
+
+@pytest.mark.parametrize("accept_encoding", ["gzip", None])
+def test_forwarder_passes_compression_through(gzip_target, accept_encoding):
+    base_url, received = gzip_target
+    headers = Headers([("Accept-Encoding", accept_encoding)] if accept_encoding else [])
+
+    response = SandboxForwarder(base_url)(TargetRequest("GET", "/FHIR/R4/Immunization", "", headers))
+
+    assert received == [accept_encoding or "identity"]
+    assert response.headers.get("Content-Encoding") == accept_encoding
+    body = gzip.decompress(response.body) if accept_encoding else response.body
+    assert json.loads(body) == {"resourceType": "Bundle"}
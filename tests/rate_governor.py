@@ -0,0 +1,115 @@
+import random
+import threading
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from time import monotonic, sleep
+from typing import List
+
+import requests
+
+PROXY_POLICIES_DIR = Path(__file__).parent.parent / "proxies" / "live" / "apiproxy" / "policies"
+TIME_UNIT_SECONDS = {"s": 1, "second": 1, "m": 60, "minute": 60, "hour": 3600, "day": 86400, "week": 604800}
+RATE_SUFFIXES = {"ps": 1, "pm": 60}
+MAX_RETRIES = 5
+BASE_BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 10
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `rate` tokens per second, up to `capacity` tokens"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def reserve(self) -> float:
+        """Takes a token and returns how many seconds the caller must wait before using it"""
+        with self._lock:
+            now = monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            return 0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def try_take(self) -> bool:
+        """Takes a token if one is available right now, without waiting for one"""
+        with self._lock:
+            self._refill(monotonic())
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def drain(self):
+        with self._lock:
+            self._refill(monotonic())
+            self._tokens = min(self._tokens, 0)
+
+
+def _spike_arrest_bucket(policy: ET.Element) -> TokenBucket:
+    # Apigee smooths SpikeArrest rates, e.g. 5ps allows one request every 200ms rather than bursts of 5
+    rate = policy.find("Rate").text.strip()
+    per_second = float(rate[:-2]) / RATE_SUFFIXES[rate[-2:]]
+    return TokenBucket(rate=per_second, capacity=1)
+
+
+def _quota_bucket(policy: ET.Element) -> TokenBucket:
+    allow = int(policy.find("Allow").get("count"))
+    interval = int(policy.find("Interval").text.strip())
+    time_unit = TIME_UNIT_SECONDS[policy.find("TimeUnit").text.strip()]
+    return TokenBucket(rate=allow / (interval * time_unit), capacity=allow)
+
+
+class RateGovernor:
+    """
+    Paces outgoing requests so that they stay within the proxy's SpikeArrest and Quota limits,
+    and backs off and retries when the proxy responds with 429 anyway.
+    """
+
+    def __init__(self, buckets: List[TokenBucket], max_retries: int = MAX_RETRIES):
+        self.buckets = buckets
+        self.max_retries = max_retries
+
+    @classmethod
+    def from_proxy_policies(cls, policies_dir: Path = PROXY_POLICIES_DIR) -> "RateGovernor":
+        return cls(
+            buckets=[
+                _spike_arrest_bucket(ET.parse(policies_dir / "SpikeArrest.xml").getroot()),
+                _quota_bucket(ET.parse(policies_dir / "Quota.xml").getroot()),
+            ]
+        )
+
+    def acquire(self):
+        wait = max(bucket.reserve() for bucket in self.buckets)
+        if wait > 0:
+            sleep(wait)
+
+    def _backoff(self, response: requests.Response, attempt: int):
+        for bucket in self.buckets:
+            bucket.drain()
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            delay = int(retry_after)
+        else:
+            delay = min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2 ** attempt) * random.uniform(0.5, 1.5)
+        sleep(delay)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        for attempt in range(self.max_retries + 1):
+            self.acquire()
+            response = requests.request(method=method, url=url, **kwargs)
+            if response.status_code != 429 or attempt == self.max_retries:
+                return response
+            self._backoff(response, attempt)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+
+rate_governor = RateGovernor.from_proxy_policies()